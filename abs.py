@@ -9,31 +9,42 @@ import logging
 import sys
 import re
 import json
+import threading
+import time
+import functools
+import tempfile
+import contextlib
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import api_limit
+import audio_ingest
+import ffmpeg_runner
+import ledger
+import line_store
+import manifest
+import profiler
+import scheduler
+import transcribe
+import transcript_cache
 
 from pathlib import Path, PureWindowsPath
 
+# Pipeline step scripts, run in-process. Scripts with heavy dependencies (openai, cv2, joblib) are imported by their step.
+import fix_srt
+import make_prompts
+import resegment
+import get_characters
+import replace_actors
+import apply_actors
+import remove_all_other_actors
+import rename_png_files_int
+import run_comfy_wf_api
+
 # Define constants and initialize logging
 SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
 DEBUG = 1  # Set to 1 for debug mode, 0 to disable
 
-def extract_first_minute(file_path, temp_file="temp_first_minute.mp3"):
-    """
-    Extracts the first minute from the audio file.
-
-    :param file_path: Path to the original audio file.
-    :param temp_file: Path to save the extracted audio segment.
-    """
-    command = [
-        'ffmpeg',
-        '-i', file_path,
-        '-ss', "00:00:00",  # Start at the beginning
-        '-t', "00:01:00",  # Extract 1 minute
-        '-acodec', 'copy',  # Use the same audio codec to avoid re-encoding
-        temp_file
-    ]
-    subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-    return temp_file
-
 logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO)
 
 def run_command(command):
@@ -45,93 +56,6 @@ def run_command(command):
         logging.error("Command failed: %s", e)
         return False
 
-def get_loudness_measurements(file_path):
-    """Analyze the file to get loudness measurements using ffmpeg."""
-    command = [
-        'ffmpeg',
-        '-i', file_path,
-        '-af', 'loudnorm=I=-23:LRA=7:print_format=json',
-        '-f', 'null',
-        '-'
-    ]
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    json_start = result.stderr.find('{')
-    json_end = result.stderr.rfind('}') + 1
-    if json_start != -1 and json_end != -1:
-        loudnorm_report = result.stderr[json_start:json_end]
-        try:
-            loudness_data = json.loads(loudnorm_report)
-            return loudness_data
-        except json.JSONDecodeError:
-            return None
-
-def check_and_adjust_volume(file_path, lufs_target):
-    """
-    Checks the loudness of a given audio file and adjusts its volume.
-    Automatically targets a loudness level 2 dB above the specified LUFS_target.
-    :param file_path: Path to the audio file to check.
-    :param lufs_target: The LUFS level below which volume adjustment is triggered.
-    """
-    loudness_data = get_loudness_measurements(file_path)
-    if loudness_data:
-        integrated_loudness = float(loudness_data['input_i'])
-        logging.info(f"Detected loudness: {integrated_loudness} LUFS, Adjustment threshold: {lufs_target} LUFS")
-
-        if integrated_loudness < lufs_target:
-            # Automatically target a volume 2 dB above the threshold
-            volume_adjustment = (lufs_target - integrated_loudness) + 2
-            logging.info(f"Volume adjustment needed: +{volume_adjustment}dB to reach 2 dB above the threshold.")
-            return f"+{volume_adjustment}dB"
-        else:
-            logging.info("No volume adjustment needed.")
-    else:
-        logging.warning(f"Loudness data could not be determined for {file_path}.")
-
-    return None
-
-def adjust_volume(source_file, target_file, volume_adjustment):
-    ffmpeg_adjust_cmd = f'ffmpeg -hide_banner -i "{source_file}" -filter:a "volume={volume_adjustment}" "{target_file}"'
-    return run_command(ffmpeg_adjust_cmd)
-
-def concatenate_files(filelist_path, output_file, volume_adjustment=None):
-    if volume_adjustment:
-        ffmpeg_concat_cmd = f'ffmpeg -hide_banner -f concat -safe 0 -i "{filelist_path}" -filter:a "volume={volume_adjustment}" "{output_file}"'
-    else:
-        ffmpeg_concat_cmd = f'ffmpeg -hide_banner -f concat -safe 0 -i "{filelist_path}" -c copy "{output_file}"'
-    return run_command(ffmpeg_concat_cmd)
-
-def convert_to_mp3(source_file, target_file, volume_adjustment=None):
-    if volume_adjustment:
-        ffmpeg_convert_cmd = f'ffmpeg -hide_banner -i "{source_file}" -acodec libmp3lame -filter:a "volume={volume_adjustment}" "{target_file}"'
-    else:
-        ffmpeg_convert_cmd = f'ffmpeg -hide_banner -i "{source_file}" -acodec libmp3lame "{target_file}"'
-    return run_command(ffmpeg_convert_cmd)
-
-
-def handle_single_file(file_path, target_file, lufs_target=None):
-    """
-    Handle copying or converting a single file. Perform a volume check and adjust the volume if necessary.
-    """
-    if lufs_target is not None:
-        # Extract the first minute for loudness analysis
-        temp_first_minute = extract_first_minute(file_path)
-        try:
-            # Perform volume check on the extracted first minute
-            volume_adjustment = check_and_adjust_volume(temp_first_minute, lufs_target)
-            if volume_adjustment:
-                logging.info(f"Adjusting volume for {file_path} by {volume_adjustment}.")
-                adjust_volume(file_path, target_file, volume_adjustment)
-        finally:
-            # Clean up the temporary file
-            os.remove(temp_first_minute)
-    else:
-        # If lufs_target is not specified, proceed as before
-        if file_path.endswith('.mp3'):
-            shutil.copyfile(file_path, target_file)
-        else:
-            convert_to_mp3(file_path, target_file)
-    return True
-
 def is_file_nonempty(file_path):
     """Check if the file exists and is not empty."""
     return os.path.exists(file_path) and os.path.getsize(file_path) > 0
@@ -192,29 +116,25 @@ def fix_path(old_path):
     else:
         return old_path
 
-def main(bookname, wildcard_path=None):
-    # Step 1: Create the folder books\<bookname> if it does not exist
-
-    q = '"' if platform.system() == 'Windows' else "'"
-
-    book_folder = os.path.join('books', bookname)
-    if not create_directory(book_folder):
-        return
-    else:
-        if DEBUG:
-            logging.debug("Step 01/20: Audio book folder: %s",book_folder)
-
-    api_key_file_path = os.path.join(SCRIPT_PATH, 'ABS_API_KEY.txt')
-
-    # Read the default configuration
+def load_default_config():
+    """Reads default_config.yaml, which also holds the settings shared by all books of a batch. None on error."""
     default_config_path = os.path.join(SCRIPT_PATH, 'default_config.yaml')
 
     try:
         with open(default_config_path, 'r') as file:
-            default_config = yaml.safe_load(file)
+            return yaml.safe_load(file)
     except Exception as e:
         logging.error("Error reading default YAML file: %s", e)
-        return
+        return None
+
+def load_config(bookname, book_folder):
+    """
+    Reads default_config.yaml, merges books/<bookname>/<bookname>.yaml over it and normalizes the paths.
+    Returns None if a configuration file can not be read.
+    """
+    default_config = load_default_config()
+    if default_config is None:
+        return None
 
     # Step 2: Check for book-specific configuration
     if DEBUG:
@@ -236,7 +156,7 @@ def main(bookname, wildcard_path=None):
 
         except Exception as e:
             logging.error("Error reading book-specific YAML file: %s", e)
-            return
+            return None
 
     # Replace placeholders in the config dictionary
     config = replace_bookname_recursive(config, bookname)
@@ -249,746 +169,1120 @@ def main(bookname, wildcard_path=None):
             original_path = config[key]
             config[key] = fix_path(original_path)
 
-    openai_api_key = None
+    return config
+
+def read_api_key():
+    """Reads the OpenAI API key from ABS_API_KEY.txt and exports it as ABS_API_KEY. Returns None if unavailable."""
+    api_key_file_path = os.path.join(SCRIPT_PATH, 'ABS_API_KEY.txt')
 
-    # Read the OpenAI API key from ABS_API_KEY.txt
     try:
         with open(api_key_file_path, 'r') as file:
             openai_api_key = file.read().strip()
         os.environ['ABS_API_KEY'] = openai_api_key
+        return openai_api_key
     except Exception as e:
         logging.info("ABS_API_KEY.txt does not contain an API key. GPT API will be unavailable.")
+        return None
+
+class Book:
+    """Everything a pipeline step needs to know about one book: its name, folder and merged configuration."""
+
+    def __init__(self, bookname, config, api_key=None, wildcard_path=None, explain=False, process_pool=None,
+                 profile=False, interactive=True, dry_run=False):
+        self.name = bookname
+        self.folder = os.path.join('books', bookname)
+        self.config = config
+        self.api_key = api_key
+        self.wildcard_path = wildcard_path
+        self.explain = explain
+        self.manifest = manifest.load_manifest(self.folder)
+        # Only a book started before the build manifest existed has outputs without a build record to adopt
+        self.adopt_outputs = not os.path.exists(manifest.manifest_path(self.folder))
+        # Outputs of later steps written by an earlier step in the same pass (see Step prebuilds)
+        self.prebuilt = set()
+        # Guards the manifest while steps of this book run concurrently
+        self.lock = threading.RLock()
+        # Shared pool for cpu_bound steps in batch mode; None runs them in the calling thread
+        self.process_pool = process_pool
+        # Kept when the book crosses into the pool (process_pool is not): its cpu_bound steps share cpu_workers cores
+        self.pooled = process_pool is not None
+        # Dump cProfile stats of the Python steps to books/<bookname>/profile/<step>.prof
+        self.profile = profile
+        # Cost of each step that ran, saved to abs_profile.json at the end of the run
+        self.profile_records = {}
+        # False answers the input() checkpoints from the config (auto_accept_actors, rename_existing_images, image_wait_minutes)
+        self.interactive = interactive
+        # Why the book waits for the user, eg. "waiting for books/<bookname>/<bookname>_ts_p_actors.txt"
+        self.blocked = None
+        # abs plan: inputs missing from the manifest's hash cache are compared by size and mtime instead of read
+        self.dry_run = dry_run
+
+    def __getstate__(self):
+        # Only what the step functions need crosses into a pool process
+        state = dict(self.__dict__)
+        for key in ('lock', 'manifest', 'process_pool', 'profile_records'):
+            state.pop(key, None)
+        return state
+
+    def path(self, suffix):
+        """Path of a file in the book folder, e.g. path('_ts.srt') is books/<bookname>/<bookname>_ts.srt"""
+        return os.path.join(self.folder, f"{self.name}{suffix}")
+
+    def images_path(self):
+        """Folder holding the generated images for the configured image_generator."""
+        if self.config.get('image_generator') == 'ComfyUI':
+            return self.config.get('path_to_comfyui', '')
+        elif self.config.get('image_generator') == 'A1111':
+            return self.config.get('path_to_stablediffusion', '')
+        return ''
+
+    def video_format(self):
+        return self.config.get('video_format', 'avi')
+
+class Step:
+    """
+    One stage of the pipeline, executed in-process by run_step().
+
+    inputs and outputs are book file suffixes ('_ts.srt') or callables that take the Book and return a path,
+    a list of paths, or None.
+    A step is skipped while its outputs exist and the build manifest shows that its inputs, the config_keys
+    it reads and its version are unchanged; a step without outputs always runs.
+    script: module implementing the step; its source hash is the step version. Otherwise version is used.
+    extra: optional callable returning additional values (besides config_keys) the output depends on.
+    when: optional predicate; the step is ignored for books where it returns False.
+    verify: optional check run after the step; on failure the outputs are removed and the step runs once more.
+    missing_hint: optional callable(book, path) called when an input does not exist yet. It logs what the user must
+                  do, or creates the input itself and returns True so the step runs after all.
+    transient: the outputs are deleted by a later step; they are not rebuilt while that step is up to date.
+    source: the inputs are only known when a wildcard path is given; existing outputs are kept otherwise.
+    after: names of steps that must finish first although no file links them (eg. steps editing a folder in place).
+    uses_api: the step calls the GPT API when an API key is configured and counts against api_concurrency. Its requests
+              also share the api_requests slots of api_limit.
+    uses_comfyui: the step queues ComfyUI prompts; in batch mode one book at a time submits them.
+    cpu_bound: pure Python work that runs on the shared process pool in batch mode.
+    prebuilds: outputs of a later step this step may write in the same pass; the later step records them as built.
+    """
 
-    # Step 3: Create the MP3 file if it does not exist
-    mp3_file_path = os.path.join(book_folder, f"{bookname}.mp3")
+    def __init__(self, number, name, description, func, inputs=(), outputs=(), config_keys=(), script=None, version=1,
+                 extra=None, when=None, verify=None, missing_hint=None, transient=False, source=False, after=(),
+                 uses_api=False, uses_comfyui=False, cpu_bound=False, prebuilds=()):
+        self.number = number
+        self.name = name
+        self.description = description
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.config_keys = list(config_keys)
+        self.script = script
+        self.version = version
+        self.extra = extra
+        self.when = when
+        self.verify = verify
+        self.missing_hint = missing_hint
+        self.transient = transient
+        self.source = source
+        self.after = list(after)
+        self.uses_api = uses_api
+        self.uses_comfyui = uses_comfyui
+        self.cpu_bound = cpu_bound
+        self.prebuilds = list(prebuilds)
+
+    def input_paths(self, book):
+        return resolve_step_paths(book, self.inputs)
+
+    def output_paths(self, book):
+        return resolve_step_paths(book, self.outputs)
+
+    def prebuilt_paths(self, book):
+        return resolve_step_paths(book, self.prebuilds)
+
+def resolve_step_paths(book, entries):
+    paths = []
+    for entry in entries:
+        resolved = entry(book) if callable(entry) else book.path(entry)
+        if isinstance(resolved, list):
+            paths.extend(resolved)
+        elif resolved is not None:
+            paths.append(resolved)
+    return paths
+
+@contextlib.contextmanager
+def scratch_dir(book):
+    """A private temporary folder in the book folder, removed afterwards, so parallel jobs never share temp files."""
+    path = tempfile.mkdtemp(prefix='.abs_tmp_', dir=book.folder)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def block(book, reason):
+    """Records why a book cannot go on without the user, so a batch can report it and move on to other books."""
+    with book.lock:
+        book.blocked = reason
+    logging.info("%s is blocked: %s", book.name, reason)
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.error("Error deleting file %s: %s", path, e)
 
-    if not os.path.exists(mp3_file_path):
-        if wildcard_path is None:
-            logging.error("Missing required wildcard path for audio file creation.")
-            return False
+def find_audio_files(wildcard_path):
+    """
+    Resolves the audio_file_wildcard_path argument to (directory, [file names]).
+    Returns (None, []) if the directory can not be determined.
+    """
+    # Initialize dir_path
+    dir_path = None
+    file_extension = None  # Initialize file_extension
 
-        # Initialize dir_path
-        dir_path = None
-        file_extension = None  # Initialize file_extension
+    wildcard_path = wildcard_path.rstrip('"')  # Ensure no trailing quote
 
-        wildcard_path = wildcard_path.rstrip('"')  # Ensure no trailing quote
+    # Normalize the wildcard path to eliminate any OS-specific characters
+    normalized_path = os.path.normpath(wildcard_path)
 
-        # Normalize the wildcard path to eliminate any OS-specific characters
-        normalized_path = os.path.normpath(wildcard_path)
+    # Determine if the path is a directory, a specific file pattern, or a wildcard for any file
+    if os.path.isdir(normalized_path) or normalized_path.endswith('*.*'):
+        dir_path = normalized_path if os.path.isdir(normalized_path) else os.path.dirname(normalized_path)
+    else:
+        dir_path = os.path.dirname(normalized_path)
+        file_extension = os.path.splitext(os.path.basename(normalized_path))[1] if '.' in os.path.basename(normalized_path) else None
 
-        # Determine if the path is a directory, a specific file pattern, or a wildcard for any file
-        if os.path.isdir(normalized_path) or normalized_path.endswith('*.*'):
-            dir_path = normalized_path if os.path.isdir(normalized_path) else os.path.dirname(normalized_path)
-        else:
-            dir_path = os.path.dirname(normalized_path)
-            file_extension = os.path.splitext(os.path.basename(normalized_path))[1] if '.' in os.path.basename(normalized_path) else None
+    # Check if dir_path is set before logging
+    if dir_path:
+        logging.debug("Determined audio directory path: %s", dir_path)
+    else:
+        logging.error("The directory path could not be determined.")
+        return None, []  # or handle the error as appropriate
 
-        # Check if dir_path is set before logging
-        if dir_path:
-            logging.debug("Determined audio directory path: %s", dir_path)
-        else:
-            logging.error("The directory path could not be determined.")
-            return False  # or handle the error as appropriate
+    if DEBUG:
+        logging.debug("Step 03/20: Audio file %s", wildcard_path)
+        logging.debug("Determined audio directory path: %s", dir_path)
 
-        if DEBUG:
-            logging.debug("Step 03/20: Audio file %s", wildcard_path)
-            logging.debug("Determined audio directory path: %s", dir_path)
+    # Search for files based on the determined extension or default to common audio file types
+    if file_extension:
+        # Make the comparison case-insensitive by converting both the filename and extension to lowercase
+        files = [f for f in os.listdir(dir_path) if f.lower().endswith(file_extension.lower())]
+    else:
+        extensions = ['.mp3', '.aac', '.wav', '.m4a', '.m4b']
+        # Apply .lower() to both the file names and the extensions for case-insensitive matching
+        files = [f for f in os.listdir(dir_path) for ext in extensions if f.lower().endswith(ext.lower())]
 
-        filelist_path = os.path.join(book_folder, 'filelist.txt')
+    return dir_path, files
 
-        # Search for files based on the determined extension or default to common audio file types
-        if file_extension:
-            # Make the comparison case-insensitive by converting both the filename and extension to lowercase
-            files = [f for f in os.listdir(dir_path) if f.lower().endswith(file_extension.lower())]
-        else:
-            extensions = ['.mp3', '.aac', '.wav']
-            # Apply .lower() to both the file names and the extensions for case-insensitive matching
-            files = [f for f in os.listdir(dir_path) for ext in extensions if f.lower().endswith(ext.lower())]
+def source_audio_files(book):
+    """Full paths of the source audio files, or None when no wildcard path was given for this run."""
+    if book.wildcard_path is None:
+        return None
+    dir_path, files = find_audio_files(book.wildcard_path)
+    return [os.path.join(dir_path, f) for f in sorted(files)] if dir_path else []
 
-        if not files:
-            logging.error(f"No matching files found in {dir_path} for the pattern {wildcard_path}")
-            return False
+def book_audio(book):
+    """
+    The book audio made by Step 3: bookname.m4a when ingest_mode is copy and the sources are AAC (m4b, m4a,
+    aac), so they are joined without re-encoding; bookname.mp3 otherwise.
+    """
+    if book.config.get('ingest_mode') == 'copy':
+        sources = source_audio_files(book)
+        if sources is None and os.path.exists(book.path('.m4a')):
+            return book.path('.m4a')
+        if sources and all(audio_ingest.is_aac(path) for path in sources):
+            return book.path('.m4a')
+    return book.path('.mp3')
+
+def chapters_file(book):
+    return os.path.join(book.folder, 'chapters.json')
+
+# Step 3: Create the MP3 file
+def step_ingest_audio(book):
+    mp3_file_path = book_audio(book)
+    wildcard_path = book.wildcard_path
+
+    if wildcard_path is None:
+        logging.error("Missing required wildcard path for audio file creation.")
+        return False
 
-        if DEBUG and files:
-            logging.debug("Found %d files: %s...", len(files), files[0])
+    dir_path, files = find_audio_files(wildcard_path)
+    if not dir_path:
+        return False
 
+    filelist_path = os.path.join(book.folder, 'filelist.txt')
 
-        lufs_target = config.get('LUFS_target')
-        if lufs_target is not None:
-            logging.info(f"LUFS target {lufs_target} detected in config file. Will check file for volume.")
+    if not files:
+        logging.error(f"No matching files found in {dir_path} for the pattern {wildcard_path}")
+        return False
 
-        # Process files
-        if len(files) == 1:
-            # Only one file, handle it directly
-            single_file_path = os.path.join(dir_path, files[0])
-            if not handle_single_file(single_file_path, mp3_file_path, lufs_target):
-                logging.error(f"Failed to copy single file to book folder {single_file_path} , {mp3_file_path}")
-                return False
-        else:
-            # Multiple files, concatenate and then convert
-            with open(filelist_path, 'w') as filelist:
-                for audio_file in sorted(files):
-                    full_path = os.path.join(dir_path, audio_file)
-                    # Inside the loop where you write to filelist.txt
-                    escaped_path = full_path.replace('\\', '\\\\')  # Escape the backslashes
-                    escaped_path = escaped_path.replace("'", "'\\''")  # Escape single quotes
-                    filelist.write(f"file '{escaped_path}'\n")
-
-            temp_output_file = os.path.splitext(filelist_path)[0] + os.path.splitext(files[0])[1]  # Use the extension of the first file
-            if not concatenate_files(filelist_path, temp_output_file):
-                return False
-
-            if not handle_single_file(temp_output_file, mp3_file_path, lufs_target):
-                logging.error("Error processing the audio file.")
-                return False
-            os.remove(temp_output_file)
-    else:
-        logging.info("MP3 file already exists, skipping creation: %s", mp3_file_path)
+    if DEBUG and files:
+        logging.debug("Found %d files: %s...", len(files), files[0])
 
+    lufs_target = book.config.get('LUFS_target')
+    if lufs_target is not None:
+        logging.info(f"LUFS target {lufs_target} detected in config file. Will check file for volume.")
 
-    # Step 4: Create .srt file
-    srt_file_path = os.path.join(book_folder, f"{bookname}.srt")
-    if not os.path.exists(srt_file_path):
+    files = [os.path.join(dir_path, audio_file) for audio_file in sorted(files)]
+    if not audio_ingest.ingest(files, mp3_file_path, filelist_path, lufs_target,
+                               int(book.config.get('loudness_windows', 12)), float(book.config.get('loudness_window_seconds', 30))):
+        return False
+    # Chapter boundaries for later steps, read from the sources once (an mp3 keeps no chapter metadata)
+    audio_ingest.write_chapters(files, chapters_file(book))
+    return True
 
-        logging.info("Creating ssubtitle: %s", srt_file_path)
+# Step 4: Create .srt file
+def step_transcribe(book):
+    q = '"' if platform.system() == 'Windows' else "'"
+    mp3_file_path = book_audio(book)
+    srt_file_path = book.path('.srt')
 
-        # Step 4.1: construct and optionally display the whisperx_cmd
+    # Determine the appropriate key based on the operating system
+    key = 'whisperx_win' if platform.system() == 'Windows' else 'whisperx_linux'
 
-        # Determine the appropriate key based on the operating system
-        key = 'whisperx_win' if platform.system() == 'Windows' else 'whisperx_linux'
+    # Extract directory from mp3_file_path
+    output_dir = os.path.dirname(mp3_file_path)
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
 
-        # Extract directory from mp3_file_path
-        output_dir = os.path.dirname(mp3_file_path)
-        os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
+    # Keep the word timings (bookname.json) for resegment.py when keep_word_json is 1
+    base_cmd = book.config[key]
+    if book.config.get('keep_word_json', 0):
+        base_cmd = transcribe.with_word_json(base_cmd)
 
-        # Construct whisperx_cmd using the base command from config and appending the dynamic directory and file path
-        whisperx_cmd = f'{config[key]} {q}{output_dir}{q} {q}{mp3_file_path}{q}'
+    # Construct whisperx_cmd using the base command from config and appending the dynamic directory and file path
+    whisperx_cmd = f'{base_cmd} {q}{output_dir}{q} {q}{mp3_file_path}{q}'
 
-        # Log the command if debugging is enabled
-        if DEBUG:
-            logging.debug("Step 04/20: WhisperX command: %s", whisperx_cmd)
+    # Log the command if debugging is enabled
+    if DEBUG:
+        logging.debug("Step 04/20: WhisperX command: %s", whisperx_cmd)
+
+    shards = int(book.config.get('transcribe_shards', 1) or 1)
+
+    # A .json left by an earlier transcription must not pass for the word timings of this one
+    if os.path.exists(book.path('.json')):
+        os.remove(book.path('.json'))
+
+    # Transcripts are cached by the audio and the command line, which sharding is part of
+    transcript_files = {'.srt': srt_file_path, '.json': book.path('.json')}
+    cache_limit = float(book.config.get('transcript_cache_gb', 0) or 0) * 1024 ** 3
+    if cache_limit:
+        with book.lock:
+            audio_sha256 = manifest.hash_file(mp3_file_path, book.manifest)
+        command = base_cmd
+        if shards > 1:
+            command += f" [shards={shards} {book.config.get('silence_noise', '-35dB')} {book.config.get('silence_seconds', 0.5)}]"
+        cache_key = transcript_cache.cache_key(audio_sha256, command)
+        written = transcript_cache.lookup(cache_key, transcript_files)
+        if written and (kept_word_json(book) is None or '.json' in written):
+            logging.info("Transcript of identical audio found in the cache: %s", srt_file_path)
+            return True
 
-        try:
-            result = subprocess.run(whisperx_cmd, shell=True, check=True)
-            # Verify if the srt file was created
-            if result.returncode == 0 and os.path.exists(srt_file_path):
-                logging.info("Created srt: %s", srt_file_path)
-            else:
-                logging.error("Failed to create SRT file: %s", srt_file_path)
-                return
-                # WhisperX creates this for some reason.
-                temp_output_file = "temp_output.srt"
-                if os.path.exists(temp_output_file):
-                    try:
-                        os.remove(temp_output_file)
-                        print(f"Deleted file: {temp_output_file}")
-                    except OSError as e:
-                        print(f"Error deleting file {temp_output_file}: {e}")
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
-            return
+    if shards > 1:
+        # Cut at silences and run one WhisperX per shard at the same time
+        with scratch_dir(book) as shard_dir:
+            ok = transcribe.transcribe_sharded(base_cmd, mp3_file_path, srt_file_path, shards, shard_dir,
+                                               book.config.get('silence_noise', '-35dB'),
+                                               float(book.config.get('silence_seconds', 0.5)))
     else:
-        logging.info("Subtitle already exists: %s", srt_file_path)
-
-    # Step 5: Modify SRT file with fix_srt.py script
-    modified_srt_file_path = os.path.join(book_folder, f"{bookname}_m300.srt")
-    original_srt_file_path = os.path.join(book_folder, f"{bookname}.srt")
-
-    if not os.path.exists(modified_srt_file_path):
-        logging.info("Creating modified srt: %s", modified_srt_file_path)
+        ok = run_command(whisperx_cmd)
+        transcribe.remove_extra_outputs(mp3_file_path)
+    if not ok or not os.path.exists(srt_file_path):
+        logging.error("Failed to create SRT file: %s", srt_file_path)
+        return False
+    logging.info("Created srt: %s", srt_file_path)
+    if cache_limit:
+        transcript_cache.store(cache_key, transcript_files, cache_limit, book.name)
+    return True
 
-        # Construct the fix_srt.py command
-        fix_srt_cmd = f'python fix_srt.py -join 300 "{original_srt_file_path}" "{modified_srt_file_path}"'
+def kept_word_json(book):
+    """bookname.json, which Step 4 writes beside the .srt when keep_word_json is 1."""
+    base_cmd = book.config.get(WHISPERX_KEY) or ''
+    if book.config.get('keep_word_json', 0) and transcribe.writes_word_json(transcribe.with_word_json(base_cmd)):
+        return book.path('.json')
+    return None
 
-        # Log the command if debugging is enabled
-        if DEBUG:
-            logging.debug("Step 05/20: Convert subtitle to 300 characters per line: %s", fix_srt_cmd)
+# The settings of Steps 4 and 5 below are only fingerprinted when they differ from their defaults, which is how books
+# were transcribed and joined before the settings existed: upgrading abs must not transcribe every book again.
+
+def transcribe_settings(book):
+    """What bookname.srt depends on besides the WhisperX command: the word JSON and the sharding, when used."""
+    settings = {}
+    if book.config.get('keep_word_json', 0):
+        settings['keep_word_json'] = 1
+    shards = int(book.config.get('transcribe_shards', 1) or 1)
+    if shards > 1:
+        # The silence settings only change the transcript when it is cut at them
+        settings.update(transcribe_shards=shards, silence_noise=book.config.get('silence_noise', '-35dB'),
+                        silence_seconds=float(book.config.get('silence_seconds', 0.5)))
+    return settings
+
+def word_json(book):
+    """bookname.json with the WhisperX word timings when Step 5 uses them, otherwise None."""
+    if book.config.get('segment_from_words', 0) and os.path.exists(book.path('.json')):
+        return book.path('.json')
+    return None
 
-        try:
-            result = subprocess.run(fix_srt_cmd, shell=True, check=True)
-            # Verify if the modified srt file was created
-            if result.returncode == 0 and os.path.exists(modified_srt_file_path):
-                logging.info("Created modified srt: %s", modified_srt_file_path)
-            else:
-                logging.error("Failed to create modified SRT file: %s", modified_srt_file_path)
-                return
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
-            return
-    else:
-        logging.info("Merged subtitle already exists: %s", modified_srt_file_path)
+def segment_limits(book):
+    """(characters, seconds) of a Step 5 subtitle; 0 seconds is no time limit."""
+    return int(book.config.get('segment_chars', 300)), float(book.config.get('segment_seconds', 0) or 0)
+
+def segment_settings(book):
+    """What _m300.srt depends on besides fix_srt.py: the resegment.py version and the limits, when not the defaults."""
+    settings = {}
+    if word_json(book):
+        settings['resegment'] = manifest.script_version('resegment')
+    chars, seconds = segment_limits(book)
+    if chars != 300:
+        settings['segment_chars'] = chars
+    if seconds:
+        settings['segment_seconds'] = seconds
+    return settings
+
+# Step 5: Modify SRT file with fix_srt.py
+def step_fix_srt(book):
+    char_limit, seconds = segment_limits(book)
+    # When Step 6 has not run either, its _ts.srt is written in the same pass and Step 6 records it as built (prebuilds).
+    # It is written under another name first, so a step that fails halfway never leaves a _ts.srt to adopt.
+    ts_file = None if os.path.exists(book.path('_ts.srt')) else book.path('_ts.srt') + '.part'
+    try:
+        if word_json(book):
+            # Cut the word timings at any length instead of joining whole WhisperX cues
+            ok = resegment.run(word_json(book), book.path('_m300.srt'), char_limit, seconds, ts_file)
+        else:
+            ok = fix_srt.run(book.path('.srt'), book.path('_m300.srt'), char_limit, ts_file)
+        if ok and ts_file:
+            os.replace(ts_file, book.path('_ts.srt'))
+        return ok
+    finally:
+        remove_files([ts_file] if ts_file else [])
 
-    # Step 6: Create time-synced SRT file with make_prompts.py script
-    ts_srt_file_path = os.path.join(book_folder, f"{bookname}_ts.srt")
-    modified_srt_file_path = os.path.join(book_folder, f"{bookname}_m300.srt")
+# Step 6: Create time-synced SRT file with make_prompts.py. Usually Step 5 has already written it.
+def step_make_prompts(book):
+    return make_prompts.run(book.path('_m300.srt'), book.path('_ts.srt'))
 
-    if not os.path.exists(ts_srt_file_path):
-        logging.info("Creating time-stamped srt: %s", ts_srt_file_path)
+# Step 7: Generate character names with combined_dictionary.py (no API key)
+def step_character_names(book):
+    import combined_dictionary  # Deferred: only needed when GPT is unavailable
 
-        # Construct the make_prompts.py command
-        make_prompts_cmd = f'python make_prompts.py {q}{modified_srt_file_path}{q} {q}{ts_srt_file_path}{q}'
+    # tokenizer_vocab_2.txt is a dictionary of words that are probably not english names. If you regularly see
+    # character names you do not think are characters, add them to this list to have them excluded.
+    use_dictionary = book.config.get('use_dictionary')
 
-        # Log the command if debugging is enabled
-        if DEBUG:
-            logging.debug("Step 06/20: Add timestamp tags to .srt file: %s", make_prompts_cmd)
+    # Compare use_dictionary as integers
+    dictionary_file = "NONE" if use_dictionary == 0 else "tokenizer_vocab_2.txt"
 
-        try:
-            result = subprocess.run(make_prompts_cmd, shell=True, check=True)
-            # Verify if the time-synced srt file was created
-            if result.returncode == 0 and os.path.exists(ts_srt_file_path):
-                logging.info("Created time-stamp srt: %s", ts_srt_file_path)
-            else:
-                logging.error("Failed to create time-stamp SRT file: %s", ts_srt_file_path)
-                return
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
-            return
-    else:
-        logging.info("Timestamped subtitle already exists: %s", ts_srt_file_path)
+    # use_speech_verbs 0 relaxes the character detection
+    strict = 0 if book.config.get('use_speech_verbs') == 0 else 1
 
+    # character_workers shards very large books over several processes; 0 is one per CPU core. In a batch this
+    # step already runs in one of the cpu_workers pool processes, which have the cores, so it is not sharded again
+    workers = 1 if book.pooled else book.config.get('character_workers', 1) or os.cpu_count()
 
-    ts_srt_file_path = os.path.join(book_folder, f"{bookname}_ts.srt")
-    ts_p_srt_file_path = os.path.join(book_folder, f"{bookname}_ts_p.srt")
+    return combined_dictionary.run(dictionary_file, book.path('_m300.srt'), book.path('_ts.srt'), book.path('_ts_p.srt'), strict, workers)
 
-    if not openai_api_key:
-        m300_srt_filepath = os.path.join(book_folder, f"{bookname}_m300.srt")
+# Step 7: Create prompt-enhanced SRT file with gen_prompts.py (API key)
+def step_gen_prompts(book):
+    import gen_prompts  # Deferred: imports openai
 
-        if not os.path.exists(ts_p_srt_file_path):
-            logging.info("Generating character names : %s", ts_p_srt_file_path)
+    return gen_prompts.run(book.path('_ts.srt'), book.path('_ts_p.srt'), book.api_key)
 
-            # tokenizer_vocab_2.txt is a dictionary of words that are probably not english names. If you regularly see
-            # character names you do not think are characters, add them to this list to have them excluded.
+def verify_line_count(suffix):
+    """Returns a verify callback checking that a step output has as many lines as _ts.srt"""
+    def verify(book):
+        input_lines = count_lines(book.path('_ts.srt'))
+        output_lines = count_lines(book.path(suffix))
+        if input_lines == output_lines:
+            logging.info("Verified %s with correct line count.", book.path(suffix))
+            return True
+        logging.error("Line count mismatch: %s (%d) vs. %s (%d)", book.path('_ts.srt'), input_lines, book.path(suffix), output_lines)
+        return False
+    return verify
 
-            use_dictionary = config.get('use_dictionary')
+# Step 11: Get characters with get_characters.py
+def step_get_characters(book):
+    return get_characters.run(book.path('_ts_p.srt'), book.path('_ts_p_characters.srt'))
 
-            # Compare use_dictionary as integers
-            dictionary_file = "NONE" if use_dictionary == 0 else "tokenizer_vocab_2.txt"
-            make_api_names_cmd = f'python combined_dictionary.py {dictionary_file} {q}{m300_srt_filepath}{q} {q}{ts_srt_file_path}{q} {q}{ts_p_srt_file_path}{q}'
+# Step 12: Extract scenes with extract_scene.py
+def step_extract_scene(book):
+    import extract_scene  # Deferred: imports openai
 
-            use_speech_verbs = config.get('use_speech_verbs')
-            # Append "--strict 0" to the command if use_speech_verbs is 0, comparing as integers
-            if use_speech_verbs == 0:
-                make_api_names_cmd += " --strict 0"
+    return extract_scene.run(book.path('_ts.srt'), book.path('_ts_p_ns.srt'), book.api_key)
 
-            if DEBUG:
-                logging.debug("Step 07/20: Generate a list of potential character names: %s", make_api_names_cmd)
+# Step 13: Merge the scenes and characters files
+def step_merge(book):
+    output_file = book.path('_merged.txt')
 
-            try:
-                result = subprocess.run(make_api_names_cmd, shell=True, check=True)
-                if result.returncode == 0:
-                    logging.info("Created file with character names: %s", ts_p_srt_file_path)
+    # The characters (_ts_p.srt) and scenes (_ts_p_ns.srt) of each timestamp are joined in the line store
+    connection = line_store.connect(book)
+    try:
+        line_store.sync(book, connection, force=('character', 'scene'))
+        with open(output_file, 'w', encoding='utf-8') as merged_file:
+            for key, character, scene in line_store.rows(connection, 'character', 'scene'):
+                # Like the lines were read before: the first field after the key, once the line end is stripped
+                character, scene = character.rstrip(), scene.rstrip()
+                if not character or not scene:
+                    continue
+                character, scene = character.split('\t')[0], scene.split('\t')[0]
+                if book.api_key:
+                    merged_line = f"{character}\t{scene}\t{key}\n"
                 else:
-                    logging.error("Failed to create file with character names: %s", ts_p_srt_file_path)
-                    return
-            except subprocess.CalledProcessError as e:
-                logging.error("Command failed: %s", e)
-                return
-        else:
-            logging.info("Timestamped characters already exists: %s", ts_p_srt_file_path)
-
-    file_needs_creation = not is_file_nonempty(ts_p_srt_file_path)
-    file_created_or_verified = False
-
-    if openai_api_key:
-        # Step 7: Create or verify prompt-enhanced SRT file with gen_prompts.py script
-
-        # Function to execute gen_prompts.py command
-        def execute_gen_prompts():
-            gen_prompts_cmd = f"python gen_prompts.py {q}{ts_srt_file_path}{q} {q}{ts_p_srt_file_path}{q}"
-            if DEBUG:
-                logging.debug("Step 07/20: Use GPT API to create image prompts for StableDiffusion: %s", gen_prompts_cmd)
-            try:
-                result = subprocess.run(gen_prompts_cmd, shell=True, check=True)
-                return result.returncode == 0
-            except subprocess.CalledProcessError as e:
-                logging.error("Command failed: %s", e)
-                return False
-
-        file_needs_creation = not is_file_nonempty(ts_p_srt_file_path)
-        file_created_or_verified = False
-
-        if file_needs_creation:
-            logging.info("Creating prompt-enhanced srt: %s", ts_p_srt_file_path)
-            file_created_or_verified = execute_gen_prompts()
-        else:
-            logging.info("Timestamped characters already exists: %s", ts_p_srt_file_path)
-
-    # Verify line count and non-emptiness
-    if file_created_or_verified or is_file_nonempty(ts_p_srt_file_path):
-        input_lines = count_lines(ts_srt_file_path)
-        output_lines = count_lines(ts_p_srt_file_path)
-        if input_lines == output_lines:
-            logging.info("Verified prompt-enhanced srt with correct line count: %s", ts_p_srt_file_path)
-        else:
-            logging.error("Line count mismatch or %s vs. %s", ts_srt_file_path, ts_p_srt_file_path)
-            os.remove(ts_p_srt_file_path)  # Delete the empty or incorrect file
-            if file_needs_creation and openai_api_key:
-                logging.info("Attempting to recreate prompt-enhanced SRT file.")
-                file_created_or_verified = execute_gen_prompts()
-                if not file_created_or_verified:
-                    return
-            else:
-                return
-    else:
-        logging.error("File creation failed or file is empty: %s", ts_p_srt_file_path)
-        return
+                    # KAS Do not include actors. We will do that later after they have been filtered and pruned
+                    merged_line = f"{scene}\t{key}\n"
+                merged_file.write(merged_line)
+    finally:
+        connection.close()
 
+    logging.info("Merged files to: %s", output_file)
+    return True
 
-    # Step 11: Get characters with get_characters.py script
-    ts_srt_p_file_path = os.path.join(book_folder, f"{bookname}_ts_p.srt")
-    ts_srt_p_characters_file_path = os.path.join(book_folder, f"{bookname}_ts_p_characters.srt")
+# Step 14: Create the actor list to be edited by the user
+def step_replace_actors(book):
+    edit_file = book.path('_ts_p_actors_EDIT.txt')
+    replace_actors.run(book.path('_ts_p_characters.srt'), book.config.get('actors'), book.config.get('actresses'),
+                       edit_file, book.config.get('depth'))
+    logging.info("* You must edit actors file %s, make any corrections, and save as %s", edit_file, book.path('_ts_p_actors.txt'))
+    return True
 
-    if not os.path.exists(ts_srt_p_characters_file_path):
-        logging.info("Getting characters list: %s", ts_srt_p_characters_file_path)
+def actors_file_hint(book, path):
+    edit_file = book.path('_ts_p_actors_EDIT.txt')
+    actors_file = book.path('_ts_p_actors.txt')
+    if path != actors_file or not os.path.exists(edit_file):
+        logging.error("Step 15/20: Input file %s not found. Exiting.", path)
+        return False
 
-        # Construct the get_characters.py command
-        get_characters_cmd = f'python get_characters.py {q}{ts_srt_p_file_path}{q} {q}{ts_srt_p_characters_file_path}{q}'
+    if not book.interactive and book.config.get('auto_accept_actors', 1):
+        shutil.copyfile(edit_file, actors_file)
+        logging.info("Accepted %s unchanged as %s (auto_accept_actors)", edit_file, actors_file)
+        return True
 
-        # Log the command if debugging is enabled
-        if DEBUG:
-            logging.debug("Step 11/20: Extract named characters from .srt file: %s", get_characters_cmd)
+    logging.info("* You must edit actors file %s, make any corrections, and save as %s", edit_file, actors_file)
+    block(book, f"waiting for {actors_file}")
+    return False
 
-        try:
-            result = subprocess.run(get_characters_cmd, shell=True, check=True)
-            if result.returncode == 0:
-                logging.info("Got characters to: %s", ts_srt_p_characters_file_path)
-            else:
-                logging.error("Failed to get characters: %s", ts_srt_p_characters_file_path)
-                return
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
-            return
-    else:
-        logging.info("Characters list already exists: %s", ts_srt_p_characters_file_path)
+# Step 15: Apply actors using apply_actors.py
+def step_apply_actors(book):
+    return apply_actors.run(book.path('_ts_p_actors.txt'), book.path('_merged.txt'), book.path('_merged_names_dup.txt'))
 
-   # Step 12: Extract scenes with extract_scene.py script
-    ts_srt_file_path = os.path.join(book_folder, f"{bookname}_ts.srt")
-    ts_srt_p_ns_file_path = os.path.join(book_folder, f"{bookname}_ts_p_ns.srt")
+# Step 15.1: Remove low priority actors using remove_all_other_actors.py
+def step_prune_actors(book):
+    log_file_path = os.path.join(book.folder, 'remove.log')
+    return remove_all_other_actors.run(book.path('_merged_names_dup.txt'), book.path('_merged_names.txt'), book.config, log_file_path)
 
-    if not os.path.exists(ts_srt_p_ns_file_path):
-        logging.info("Extracting scenes: %s", ts_srt_p_ns_file_path)
+# Steps 16 and 17: Generate images and verify the existence of the image folder
+def step_generate_images(book):
+    config = book.config
+    input_file = book.path('_merged_names.txt')
+    image_generator = config.get('image_generator')
 
-        # Construct the extract_scene.py command
-        extract_scene_cmd = f'python extract_scene.py {q}{ts_srt_file_path}{q} {q}{ts_srt_p_ns_file_path}{q}'
+    if image_generator == 'ComfyUI':
+        logging.info("Generating images using ComfyUI")
+        run_comfy_wf_api.run(input_file, config['path_to_workflow'], config, ckpt_name=config['comfyui_model'],
+                             cfg=float(config['cfg']), steps=int(config['steps']), count=int(config['image_count']),
+                             width=int(config['image_width']), height=int(config['image_height']), bookname=book.name)
 
-        # Log the command if debugging is enabled
-        if DEBUG:
-            logging.debug("Step 12/20: Generate scene information: %s", extract_scene_cmd)
+    elif image_generator == 'A1111':
+        path_to_stablediffusion = config['path_to_stablediffusion']  # This should be 'E:\SD\stable-diffusion-webui\outputs\txt2img-images\03BAllTheseWorlds'
 
-        try:
-            result = subprocess.run(extract_scene_cmd, shell=True, check=True)
-            if result.returncode == 0:
-                logging.info("Extracted scenes to: %s", ts_srt_p_ns_file_path)
-            else:
-                logging.error("Failed to extract scenes: %s", ts_srt_p_ns_file_path)
-                return
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
-            return
-    else:
-        logging.info("Scenes file already exists: %s", ts_srt_p_ns_file_path)
+        # Corrected user instruction using string replace
+        path_for_renaming = path_to_stablediffusion.replace(book.name, 'YYYY-MM-DD')
+        user_instruction = (
+            "Ready for A1111 image generation.\n"
+            "1. Change the 'Script' dropdown setting near the bottom of the txt2img tab to 'Prompts from file or textbox'.\n"
+            "2. Drop '{input_file}' onto the file upload box.\n"
+            "3. Select the model, and styles you want and click Generate.\n"
+            "4. Rename '{path_for_renaming}' to '{path_to_stablediffusion}' when images are complete.\n"
+            "5. You may need to merge multiple folders together if your image generation task crossed midnight.\n"
+            "Press <enter> when ready:"
+        ).format(input_file=input_file, path_for_renaming=path_for_renaming, path_to_stablediffusion=path_to_stablediffusion)
+
+        if book.interactive:
+            input(user_instruction)
+        else:
+            logging.info(user_instruction.rsplit("\n", 1)[0])
 
-    # Verify line count
-    input_lines = count_lines(ts_srt_file_path)
-    output_lines = count_lines(ts_srt_p_ns_file_path)
-    if input_lines == output_lines:
-        logging.info("Verified scenes file with correct line count: %s", ts_srt_p_ns_file_path)
     else:
-        logging.error("Line count mismatch in scenes file: %s", ts_srt_p_ns_file_path)
-        return
-
-    # Step 13: Merge two input files and create an output file
-    input_file1 = f"books/{bookname}/{bookname}_ts_p_ns.srt"
-    input_file2 = f"books/{bookname}/{bookname}_ts_p.srt"
-    output_file = f"books/{bookname}/{bookname}_merged.txt"
-
-    if not os.path.exists(output_file):
-        logging.info("Step 12/20: Merging timestamp, character, and scenes: %s and %s to %s", input_file1, input_file2, output_file)
+        logging.error("image_generator tag in config file must be A1111 or ComfyUI. Found: %s", image_generator)
+        return False
 
-        try:
-            # Open input files for reading
-            with open(input_file1, 'r', encoding='utf-8') as file1, \
-                 open(input_file2, 'r', encoding='utf-8') as file2:
-
-                # Create a dictionary to store data from the first file
-                data_dict = {}
-
-                # Read and store data from the first file
-                for line in file1:
-                    fields = line.strip().split('\t')
-                    if len(fields) >= 2:
-                        key, value = fields[0], fields[1]
-                        data_dict[key] = value
-
-                # Merge data from the second file and write to the output file
-                with open(output_file, 'w', encoding='utf-8') as merged_file:
-                    for line in file2:
-                        fields = line.strip().split('\t')
-                        if len(fields) >= 2:
-                            key, value = fields[0], fields[1]
-                            if key in data_dict:
-                                if openai_api_key:
-                                    merged_line = f"{value}\t{data_dict[key]}\t{key}\n"
-                                else:
-                                    # KAS Do not include actors. We will do that later after they have been filtered and pruned
-                                    merged_line = f"{data_dict[key]}\t{key}\n"
-                                merged_file.write(merged_line)
-
-            logging.info("Merged files to: %s", output_file)
+    # Step 17: Verify the existence of the image folder after image generation
+    path_to_images = book.images_path()
+    if not book.interactive:
+        wait_for_folder(path_to_images, book.config.get('image_wait_minutes', 0), book.config.get('image_poll_seconds', 60))
+    if os.path.exists(path_to_images):
+        return True
 
-        except Exception as e:
-            logging.error("Error during merging: %s", e)
-            return
+    # Count the lines in the input file again to get the image count
+    generated_image_count = count_lines(input_file)
+    if generated_image_count < 0:
+        logging.error("Failed to count image generation requirements")
+    elif image_generator == 'ComfyUI':
+        logging.debug(
+            "If there were no errors, you should see %d images appear in the ComfyUI\\output folder. When they are finished, delete any images you do not want,\n"
+            "then rename ComfyUI\\output to ComfyUI\\%s. Output folder does not exist: %s",
+            generated_image_count, book.name, path_to_images)
     else:
-        logging.info("Merged characters and scenes already exists: %s", output_file)
-
-
-
-    # Step 14: Replace actors using the existing script
-    male_actors_csv = config.get('actors')
-    female_actors_csv = config.get('actresses')
-    depth = config.get('depth')
-
-    # Ensure platform-independent path separators
-    input_file = os.path.join("books", bookname, f"{bookname}_ts_p_characters.srt")
-    edit_file = os.path.join("books", bookname, f"{bookname}_ts_p_actors_EDIT.txt")
-
-    if not os.path.exists(edit_file):
-        logging.info("Step 14/20: Creating actor list from %s and saving to %s", input_file, edit_file)
-
-        try:
-            # Execute the existing replace_actors.py script with depth parameter
-            replace_actors_cmd = f'python replace_actors.py {q}{input_file}{q} {q}{male_actors_csv}{q} {q}{female_actors_csv}{q} {q}{edit_file}{q} {depth}'
+        logging.debug("There should be %d images in the '%s' folder when complete.", generated_image_count, path_to_images)
+    block(book, f"waiting for images in {path_to_images}")
+    return False
+
+def wait_for_folder(path, minutes, poll_seconds):
+    """Polls for a folder to appear for up to the given minutes. Unattended runs use it in place of a prompt."""
+    deadline = time.time() + float(minutes) * 60
+    while not os.path.exists(path) and time.time() < deadline:
+        logging.info("Waiting for %s", path)
+        time.sleep(min(float(poll_seconds), max(0.0, deadline - time.time())))
+
+# Step 18: Run png_text.py and rename_png_files_int.py
+def step_rename_images(book):
+    import png_text  # Deferred: imports joblib
+
+    path_to_images = book.images_path()
+    file_path = os.path.join(path_to_images, '000000000.png')
 
-            # Log the command if debugging is enabled
-            if DEBUG:
-                logging.debug("Step 14/20: Combining characters with actors: %s", replace_actors_cmd)
+    skip_renaming = "n"
+    if os.path.exists(file_path) and not book.interactive:
+        skip_renaming = "n" if book.config.get('rename_existing_images', 0) else "y"
+    elif os.path.exists(file_path):
+        while True:
+            skip_renaming = input("Step 18/20: Generated image file %s already exists. Do you want to skip file renaming step? [Y/n] (Default: Y): " % file_path).strip().lower()
 
-            result = subprocess.run(replace_actors_cmd, shell=True, check=True)
+            if not skip_renaming:  # Default to "Y" if the user presses Enter
+                skip_renaming = "y"
 
-            if result.returncode == 0:
-                logging.info("* You must edit actors file %s, make any corrections, and save as %s", edit_file, os.path.join("books", bookname, f"{bookname}_ts_p_actors.txt"))
+            if skip_renaming in ["y", "n"]:
+                break
             else:
-                logging.error("Failed to replace actors: %s", edit_file)
-                return
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
-            return
-
-    # Step 15: Apply actors using the apply_actors.py script
-    input_file = f"books/{bookname}/{bookname}_ts_p_actors.txt"
-    merged_file = f"books/{bookname}/{bookname}_merged.txt"
-    output_file = f"books/{bookname}/{bookname}_merged_names_dup.txt"
-
-    # Check if input_file exists
-    if not os.path.exists(input_file):
-        logging.info("* You must edit actors file %s, make any corrections, and save as %s", edit_file, input_file)
-        return  # Stop processing or skip to the next step
-
-    if not os.path.exists(output_file):
-        logging.info("Applying actors from %s and saving as %s.", input_file, output_file)
-
-        try:
-            # Execute the apply_actors.py script
-            apply_actors_cmd = f'python apply_actors.py {q}{input_file}{q} {q}{merged_file}{q} {q}{output_file}{q}'
-
-            # Log the command if debugging is enabled
-            if DEBUG:
-                logging.debug("Step 15/20: Making replacements of character names with actor names: %s", apply_actors_cmd)
+                print("Invalid input. Please enter 'Y' or 'N'.")
 
-            result = subprocess.run(apply_actors_cmd, shell=True, check=True)
-            if result.returncode == 0:
-                logging.info("Actors applied and saved to: %s", output_file)
-            else:
-                logging.error("Failed to apply actors: %s", output_file)
-                return
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
-            return
-    else:
-        logging.info("Replaced actors already exists: %s", output_file)
+    if skip_renaming != "n":
+        print("Skipping file renaming step as per user choice.")
+        return True
 
-    # Step 15.1: Apply actors using the apply_actors.py script
-    input_file = f"books/{bookname}/{bookname}_merged_names_dup.txt"
-    output_file = f"books/{bookname}/{bookname}_merged_names.txt"
+    # removed -o (overwrite) flag. Not sure why it was enabled. Allows for faster restarts
+    png_text.run(path_to_images)
 
-    # Check if input_file exists
-    if not os.path.exists(input_file):
-        logging.error("Error pruning duplicate actors. Input file %s not found. Exiting.", input_file)
-        return  # Stop processing or skip to the next step
+    if DEBUG:
+        logging.debug("Step 18.1/20 Read .txt files and rename PNG files to the .srt timestamp: %s", path_to_images)
 
-    if not os.path.exists(output_file):
-        logging.info("Pruning extra actors from %s and saving to %s.", input_file, output_file)
+    rename_png_files_int.run(path_to_images)
 
+    txt_files = glob.glob(os.path.join(path_to_images, "*.tEXt.txt"))
+    for file_path in txt_files:
         try:
-            # Execute the apply_actors.py script
-            apply_actors_cmd = f'python remove_all_other_actors.py {q}{input_file}{q} {q}{output_file}{q} --bookname {q}{bookname}{q}'
+            os.remove(file_path)
+        except OSError as e:
+            print(f"Error deleting file {file_path}: {e}")
+    return True
 
-            # Log the command if debugging is enabled
-            if DEBUG:
-                logging.debug("Step 15.1/20: Removing low priority actors per actor_priority in config file. Removals in removed.log: %s", apply_actors_cmd)
+# Step 19: Create the silent output video with jobvid.py
+def step_render_video(book):
+    import jobvid  # Deferred: imports cv2
 
-            result = subprocess.run(apply_actors_cmd, shell=True, check=True)
-            if result.returncode == 0:
-                logging.info("Pruned actors file: %s", output_file)
-            else:
-                logging.error("Failed to prune actors: %s", output_file)
-                return
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
-            return
+    return jobvid.run(os.path.join(book.images_path(), '*.png'), book.path(f"_output.{book.video_format()}"), book.video_format())
+
+# Step 20: Create the final video with audio
+def step_mux(book):
+    q = '"' if platform.system() == 'Windows' else "'"
+    video_format = book.video_format()
+    output_avi_path = book.path(f".{video_format}")
+    silent_video_path = book.path(f"_output.{video_format}")
+
+    if video_format == "mp4":
+        ffmpeg_cmd = ['ffmpeg', '-hide_banner', '-y', '-i', silent_video_path, '-i', book_audio(book),
+                      '-sub_charenc', 'UTF-8', '-i', book.path(".srt"),
+                      '-map', '0:v:0', '-map', '1:a:0', '-map', '2:s:0', '-c:v', 'copy', '-c:a', 'copy', '-c:s', 'mov_text',
+                      output_avi_path]
     else:
-        logging.info("Pruned low priority actors already exists: %s", output_file)
+        ffmpeg_cmd = ['ffmpeg', '-hide_banner', '-y', '-i', silent_video_path, '-i', book_audio(book),
+                      '-c:v', 'copy', '-map', '0:v:0', '-map', '1:a:0', output_avi_path]
 
+    # Log the command if debugging is enabled
+    if DEBUG:
+        logging.debug("Step 20/20: This combines the original mp3 audio book and the generated video. .srt is included in the same folder. You could embed it in the video if you wanted to: \n%s", subprocess.list2cmdline(ffmpeg_cmd))
 
-    # Step 16: Verify the existence of <path_to_comfyui> from config YAML
-    input_file = f"books/{bookname}/{bookname}_merged_names.txt"
+    if not ffmpeg_runner.call(ffmpeg_cmd, f"Step 20 {book.name}"):
+        return False
 
-    if not os.path.exists(input_file):
-        logging.error("Error generating images. Input file %s not found. Exiting.", input_file)
-        return  # Stop processing or skip to the next step
+    logging.info(f"{q}{output_avi_path}{q} and {q}{book.path('.srt')}{q} files created.")
+    remove_files([silent_video_path])
+    return True
 
-    image_generator = config.get('image_generator')
-    if image_generator not in ['ComfyUI', 'A1111']:
-        logging.error("image_generator tag in config file must be A1111 or ComfyUI. Found: %s", image_generator)
-        exit(1)
+# Step 21: Create one video per chapter
+def step_chapter_videos(book):
+    import chapter_videos  # Deferred: its workers import cv2
+
+    return chapter_videos.run(book)
+
+def images_folder(book):
+    return book.images_path()
+
+def silent_video(book):
+    return book.path(f"_output.{book.video_format()}")
+
+def chapter_videos_folder(book):
+    return os.path.join(book.folder, 'chapters')
+
+def chapters_input(book):
+    """chapters.json once Step 3 (or an earlier chapter render) has written it."""
+    return chapters_file(book) if os.path.exists(chapters_file(book)) else None
+
+def full_video(book):
+    return bool(book.config.get('full_video', 1))
+
+def final_video(book):
+    return book.path(f".{book.video_format()}")
+
+def dictionary_file(book):
+    return None if book.config.get('use_dictionary') == 0 else "tokenizer_vocab_2.txt"
+
+def actor_files(book):
+    return [book.config.get('actors'), book.config.get('actresses')]
+
+def workflow_file(book):
+    return book.config.get('path_to_workflow') if book.config.get('image_generator') == 'ComfyUI' else None
+
+def uses_gpt(book):
+    return {'use_gpt': bool(book.api_key)}
+
+WHISPERX_KEY = 'whisperx_win' if platform.system() == 'Windows' else 'whisperx_linux'
+
+IMAGE_CONFIG_KEYS = ['image_generator', 'comfyui_model', 'path_to_workflow', 'cfg', 'steps', 'image_count',
+                     'image_width', 'image_height', 'Pos', 'Neg']
+
+PIPELINE = [
+    Step('03', 'ingest_audio', "Create the book mp3 from the source audio files",
+         step_ingest_audio, inputs=[source_audio_files], outputs=[book_audio],
+         config_keys=['LUFS_target', 'loudness_windows', 'loudness_window_seconds', 'ingest_mode'], script='audio_ingest',
+         source=True),
+    Step('04', 'transcribe', "Transcribe the audio book with WhisperX",
+         step_transcribe, inputs=[book_audio], outputs=['.srt', kept_word_json],
+         config_keys=[WHISPERX_KEY], extra=transcribe_settings),
+    Step('05', 'fix_srt', "Convert subtitle to 300 characters per line",
+         step_fix_srt, inputs=['.srt', word_json], outputs=['_m300.srt'], script='fix_srt', cpu_bound=True,
+         extra=segment_settings, prebuilds=['_ts.srt']),
+    Step('06', 'make_prompts', "Add timestamp tags to .srt file",
+         step_make_prompts, inputs=['_m300.srt'], outputs=['_ts.srt'], script='make_prompts', cpu_bound=True),
+    Step('07', 'character_names', "Generate a list of potential character names",
+         step_character_names, inputs=['_m300.srt', '_ts.srt', dictionary_file], outputs=['_ts_p.srt'],
+         config_keys=['use_dictionary', 'use_speech_verbs'], script='combined_dictionary', cpu_bound=True,
+         when=lambda book: not book.api_key, verify=verify_line_count('_ts_p.srt')),
+    Step('07', 'gen_prompts', "Use GPT API to create image prompts for StableDiffusion",
+         step_gen_prompts, inputs=['_ts.srt'], outputs=['_ts_p.srt'], script='gen_prompts', uses_api=True,
+         when=lambda book: bool(book.api_key), verify=verify_line_count('_ts_p.srt')),
+    Step('11', 'get_characters', "Extract named characters from .srt file",
+         step_get_characters, inputs=['_ts_p.srt'], outputs=['_ts_p_characters.srt'], script='get_characters',
+         cpu_bound=True),
+    Step('12', 'extract_scene', "Generate scene information",
+         step_extract_scene, inputs=['_ts.srt'], outputs=['_ts_p_ns.srt'], script='extract_scene', extra=uses_gpt,
+         uses_api=True, verify=verify_line_count('_ts_p_ns.srt')),
+    Step('13', 'merge', "Merging timestamp, character, and scenes",
+         step_merge, inputs=['_ts_p_ns.srt', '_ts_p.srt'], outputs=['_merged.txt'], extra=uses_gpt, cpu_bound=True),
+    Step('14', 'replace_actors', "Combining characters with actors",
+         step_replace_actors, inputs=['_ts_p_characters.srt', actor_files], outputs=['_ts_p_actors_EDIT.txt'],
+         config_keys=['actors', 'actresses', 'depth'], script='replace_actors', extra=uses_gpt),
+    Step('15', 'apply_actors', "Making replacements of character names with actor names",
+         step_apply_actors, inputs=['_ts_p_actors.txt', '_merged.txt'], outputs=['_merged_names_dup.txt'],
+         script='apply_actors', missing_hint=actors_file_hint, cpu_bound=True),
+    Step('15.1', 'prune_actors', "Removing low priority actors per actor_priority in config file. Removals in remove.log",
+         step_prune_actors, inputs=['_merged_names_dup.txt'], outputs=['_merged_names.txt'],
+         config_keys=['keep_actors', 'actor_priority'], script='remove_all_other_actors', cpu_bound=True),
+    Step('16', 'generate_images', "Generate images with the configured image_generator",
+         step_generate_images, inputs=['_merged_names.txt', workflow_file], outputs=[images_folder],
+         config_keys=IMAGE_CONFIG_KEYS, script='run_comfy_wf_api', uses_comfyui=True),
+    Step('18', 'rename_images', "Extract metadata from PNG files and rename them to the .srt timestamp",
+         step_rename_images, inputs=[images_folder]),
+    Step('19', 'render_video', "Parallel ffmpeg processes generate and combine still image videos",
+         step_render_video, inputs=[images_folder], outputs=[silent_video], config_keys=['video_format'],
+         script='jobvid', transient=True, after=['rename_images'], when=full_video),
+    Step('20', 'mux', "Combine the generated video with the mp3 audio book and subtitles",
+         step_mux, inputs=[silent_video, book_audio, '.srt'], outputs=[final_video], config_keys=['video_format'],
+         when=full_video),
+    Step('21', 'chapter_videos', "Render one video per chapter, several chapters at a time",
+         step_chapter_videos, inputs=[images_folder, book_audio, '.srt', chapters_input], outputs=[chapter_videos_folder],
+         config_keys=['video_format', 'chapter_minutes', 'silence_noise', 'silence_seconds'], script='chapter_videos',
+         after=['rename_images'], when=lambda book: bool(book.config.get('chapter_videos'))),
+]
+
+def step_fingerprint(book, step):
+    """The current inputs, config values and version of a step, in the form stored in the build manifest."""
+    input_hashes = {}
+    for path in step.input_paths(book):
+        sha256 = manifest.hash_path(path, book.manifest, read=not book.dry_run)
+        if sha256 is None:
+            # A transient file that was consumed and deleted by a later step
+            sha256 = manifest.recorded_output_hash(book.manifest, path)
+        input_hashes[path] = sha256
+
+    config_values = {key: book.config.get(key) for key in step.config_keys}
+    if step.extra:
+        config_values.update(step.extra(book))
+    version = manifest.script_version(step.script) if step.script else step.version
+    return manifest.fingerprint(config_values, version, input_hashes)
+
+def consumers(step, steps, book):
+    """Steps that read any of the outputs of step."""
+    outputs = set(step.output_paths(book))
+    return [other for other in steps if outputs.intersection(other.input_paths(book))]
+
+def step_status(book, step, steps, adopt=True):
+    """
+    Decides whether a step must run. Returns (fingerprint, reasons); no reasons means the step is up to date.
+    Outputs that exist but have no build record are adopted as current only in a book started before the manifest
+    existed, or when an earlier step of this run prebuilt them; anywhere else they may be the leftovers of a
+    failed run and are rebuilt. adopt=False treats adoptable outputs as current without writing the manifest (for abs plan).
+    """
+    current = step_fingerprint(book, step)
+    outputs = step.output_paths(book)
+    if not outputs:
+        return current, ["step has no outputs and always runs"]
+
+    missing = [path for path in outputs if not os.path.exists(path)]
+    record = book.manifest['steps'].get(step.name)
+
+    if not missing and record is None and (book.adopt_outputs or book.prebuilt.issuperset(outputs)):
+        if adopt:
+            logging.info("Recording existing outputs of %s in the build manifest: %s", step.name, ", ".join(outputs))
+            record_outputs(book, step, current)
+            book.prebuilt.difference_update(outputs)
+        return current, []
+
+    if step.source and book.wildcard_path is None and not missing:
+        return current, []
+
+    if missing and step.transient and record is not None and not manifest.stale_reasons(record, current, []):
+        if all(not step_status(book, other, steps, adopt)[1] for other in consumers(step, steps, book)):
+            return current, []
+
+    if not missing and record is None:
+        return current, [f"no build record: {path}" for path in outputs]
+
+    return current, manifest.stale_reasons(record, current, missing)
+
+def record_outputs(book, step, current):
+    with book.lock:
+        output_hashes = {path: manifest.hash_path(path, book.manifest) for path in step.output_paths(book)}
+        manifest.record_step(book.manifest, step.name, current, output_hashes)
+        manifest.save_manifest(book.folder, book.manifest)
+        if any(path == book.path(suffix) for path in output_hashes for suffix, _ in line_store.PRODUCTS.values()):
+            line_store.update(book)
+
+def text_lines(paths):
+    """Lines in the .srt and .txt files among paths, counted with count_lines."""
+    return sum(max(0, count_lines(path)) for path in paths if path.endswith(('.srt', '.txt')) and os.path.isfile(path))
+
+def image_count(paths):
+    return sum(len(glob.glob(os.path.join(path, '*.png'))) for path in paths if os.path.isdir(path))
+
+def record_run(book, step, started, metrics, status):
+    """Keeps the cost of a step execution for abs_profile.json and adds it to the run ledger."""
+    inputs, outputs = step.input_paths(book), step.output_paths(book)
+    metrics.update(number=step.number, started=started,
+                   input_bytes=sum(profiler.path_size(path) for path in inputs),
+                   output_bytes=sum(profiler.path_size(path) for path in outputs))
+    if status == 'ok':
+        with book.lock:
+            book.profile_records[step.name] = metrics
+
+    ledger.record(dict(metrics, book=book.name, step=step.name, status=status,
+                       finished=datetime.now().isoformat(timespec='seconds'),
+                       input_lines=text_lines(inputs), output_lines=text_lines(outputs),
+                       images=image_count(inputs + outputs),
+                       version=manifest.script_version(step.script)[:12] if step.script else str(step.version)))
+
+def report_profile(book):
+    """Saves the cost of the steps that ran to abs_profile.json and logs the summary table."""
+    if book.profile_records:
+        profiler.save_profile(book.folder, book.profile_records)
+        logging.info("Step costs for %s (details in %s):\n%s", book.name, os.path.join(book.folder, profiler.PROFILE_NAME),
+                     profiler.summary_table(book.profile_records))
+
+def discard_outputs(book, step, kept=()):
+    """
+    Moves the outputs a failed step left behind to <path>.failed, so a truncated file is never taken for a
+    built one. Outputs in kept (recorded before the step ran) stay where they are.
+    """
+    for path in step.output_paths(book):
+        if path in kept or not os.path.exists(path):
+            continue
+        failed_path = path + '.failed'
+        try:
+            if os.path.isdir(failed_path):
+                shutil.rmtree(failed_path)
+            os.replace(path, failed_path)
+            logging.info("Moved the output of failed step %s aside: %s", step.name, failed_path)
+        except OSError as e:
+            logging.error("Error moving %s aside: %s", path, e)
+
+def execute_step(book, step):
+    """
+    Calls the step function in this process. Returns True if it succeeded and created its outputs.
+    A step that fails has its partial outputs moved aside by discard_outputs.
+    """
+    if DEBUG:
+        logging.debug("Step %s/20: %s", step.number, step.description)
 
-    if image_generator == 'ComfyUI':
-        path_to_comfyui = config['path_to_comfyui']
-        if os.path.isdir(path_to_comfyui):
-            logging.info("Output folder already exists: %s", path_to_comfyui)
-        else:
-            comfyui_model = config['comfyui_model']
-            cfg = config['cfg']
-            steps = config['steps']
-            image_count = config['image_count']
-            image_width = config['image_width']
-            image_height = config['image_height']
-            workflow_path = config['path_to_workflow']
-
-            input_file = os.path.join("books", bookname, f"{bookname}_merged_names.txt")
-
-            logging.info("Generating images using ComfyUI")
-            run_comfy_cmd = (
-                f"python run_comfy_wf_api.py --ckpt_name {q}{comfyui_model}{q} "
-                f"--cfg {cfg} --steps {steps} --count {image_count} "
-                f"--width {image_width} --height {image_height} "
-                f"{q}{input_file}{q} {workflow_path} --bookname {q}{bookname}{q} "
-            )
-
-            if DEBUG:
-                logging.debug("Step 16/20: Launch ComfyUI. Command: %s", run_comfy_cmd)
+    with book.lock:
+        recorded = book.manifest['steps'].get(step.name, {}).get('outputs', {})
+        kept = {path for path in step.output_paths(book) if path in recorded and os.path.exists(path)}
+    prebuilt = [path for path in step.prebuilt_paths(book) if not os.path.exists(path)]
 
-            try:
-                result = subprocess.run(run_comfy_cmd, shell=True, check=True)
-                if result.returncode == 0:
-                    logging.info("Images generated successfully")
-                else:
-                    logging.error("Failed to generate images")
-            except subprocess.CalledProcessError as e:
-                logging.error("Command failed: %s", e)
+    profile_file = None
+    if book.profile and (step.script or step.cpu_bound):
+        profile_file = os.path.join(book.folder, 'profile', f"{step.name}.prof")
 
-    elif image_generator == 'A1111':
-        path_to_stablediffusion = config['path_to_stablediffusion']  # This should be 'E:\SD\stable-diffusion-webui\outputs\txt2img-images\03BAllTheseWorlds'
-        if os.path.isdir(path_to_stablediffusion):
-            logging.info("Output folder already exists: %s", path_to_stablediffusion)
+    started = datetime.now().isoformat(timespec='seconds')
+    try:
+        if step.cpu_bound and book.process_pool is not None:
+            result, metrics = book.process_pool.submit(profiler.measure, step.func, book, profile_file=profile_file).result()
         else:
-            input_file = os.path.join("books", bookname, f"{bookname}_merged_names.txt")
-
-            if DEBUG:
-                logging.debug("Step 16/20: Launch Stable Diffusion (A1111)")
-
-            # Corrected user instruction using string replace
-            path_for_renaming = path_to_stablediffusion.replace(bookname, 'YYYY-MM-DD')
-            user_instruction = (
-                "Ready for A1111 image generation.\n"
-                "1. Change the 'Script' dropdown setting near the bottom of the txt2img tab to 'Prompts from file or textbox'.\n"
-                "2. Drop '{input_file}' onto the file upload box.\n"
-                "3. Select the model, and styles you want and click Generate.\n"
-                "4. Rename '{path_for_renaming}' to '{path_to_stablediffusion}' when images are complete.\n"
-                "5. You may need to merge multiple folders together if your image generation task crossed midnight.\n"
-                "Press <enter> when ready:"
-            ).format(input_file=input_file, path_for_renaming=path_for_renaming, path_to_stablediffusion=path_to_stablediffusion)
-
-            input(user_instruction)
-
-    # Step 17: Verify the existence of <path_to_comfyui> after image generation
-    if config.get('image_generator') == 'ComfyUI':
-        if not os.path.exists(path_to_comfyui):
-            # Count the lines in the input file again to get the image count
-            generated_image_count = count_lines(input_file)
-            if generated_image_count >= 0:
-                logging.debug(
-                    "If there were no errors, you should see %d images appear in the ComfyUI\\output folder. When they are finished, delete any images you do not want,\n"
-                    "then rename ComfyUI\\output to ComfyUI\\%s. Output folder does not exist: %s",
-                    generated_image_count, bookname, path_to_comfyui)
-            else:
-                logging.error("Failed to count submitted image generation prompts.")
-            return
-    elif config.get('image_generator') == 'A1111':
-        if not os.path.exists(path_to_stablediffusion):
-            # Count the lines in the input file again to get the image count
-            generated_image_count = count_lines(input_file)
-            if generated_image_count >= 0:
-                logging.debug("There should be %d images in the '%s' folder when complete.",generated_image_count, path_to_stablediffusion)
-            else:
-                logging.error("Failed to count image generation requirements")
-            return
-    else:
-        logging.error("image_generator tag in config file must be A1111 or ComfyUI. Found: %s", config.get('image_generator'))
-        return
-
-
-    # Step 18: Run png_text.py and rename_png_files.py scripts
-    path_to_images = ''
-    if config.get('image_generator') == 'ComfyUI':
-        path_to_images = config.get('path_to_comfyui', '')
-    elif config.get('image_generator') == 'A1111':
-        path_to_images = config.get('path_to_stablediffusion', '')
-
-    if not path_to_images:
-        logging.error("Missing path to images in the config YAML. Exiting.")
-        return
+            result, metrics = profiler.measure(step.func, book, profile_file=profile_file)
+    except (Exception, SystemExit) as e:
+        # The step scripts were written as programs; treat sys.exit() inside them as a failed step
+        logging.error("Step %s/20 %s failed: %s", step.number, step.name, e)
+        record_run(book, step, started, {}, 'failed')
+        discard_outputs(book, step, kept)
+        return False
 
-    # Check if 'path_to_images' exists as a folder
-    if not os.path.exists(path_to_images):
-        logging.error("Folder '%s' does not exist. Exiting.", path_to_images)
-        return
+    if isinstance(result, dict):
+        # Steps may return counts for the ledger, eg. {'llm_tokens': 1234}
+        metrics.update(result)
+
+    ok = result is not False
+    for path in step.output_paths(book):
+        if ok and not os.path.exists(path):
+            logging.error("Step %s/20 %s did not create: %s", step.number, step.name, path)
+            ok = False
+    record_run(book, step, started, metrics, 'ok' if ok else 'failed')
+    if not ok:
+        discard_outputs(book, step, kept)
+        return False
+    with book.lock:
+        book.prebuilt.update(path for path in prebuilt if os.path.exists(path))
+    return True
 
-    file_path = os.path.join(path_to_images, '000000000.png')
+def run_step(book, step, steps=PIPELINE):
+    """Runs one step unless the build manifest shows it is up to date. Returns True if the pipeline may continue."""
+    if step.when is not None and not step.when(book):
+        return True
 
-    skip_renaming = "n"
-    if os.path.exists(file_path):
-        while True:
-            skip_renaming = input("Step 18/20: Generated image file %s already exists. Do you want to skip file renaming step? [Y/n] (Default: Y): " % file_path).strip().lower()
+    with book.lock:
+        current, reasons = step_status(book, step, steps)
 
-            if not skip_renaming:  # Default to "Y" if the user presses Enter
-                skip_renaming = "y"
+    if book.explain:
+        logging.info("Step %s/20 %s: %s", step.number, step.name, "run: " + "; ".join(reasons) if reasons else "up to date")
 
-            if skip_renaming in ["y", "n"]:
-                break
+    for path, sha256 in current['inputs'].items():
+        if sha256 is None or (reasons and not os.path.exists(path)):
+            if step.missing_hint:
+                if step.missing_hint(book, path):
+                    return run_step(book, step, steps)
             else:
-                print("Invalid input. Please enter 'Y' or 'N'.")
-
-    if skip_renaming == "n":
-        # Define the command to run png_text.py
-        # removed -o (overwrite) flag. Not sure why it was enabled. Allows for faster restarts
-        make_text_cmd = f"python png_text.py {q}{path_to_images}{q}"
-
-        # Define the command to run rename_png_files.py
-        rename_png_cmd = f"python rename_png_files_int.py {q}{path_to_images}{q}"
-
-        # Log the commands if debugging is enabled
-        if DEBUG:
-            logging.debug("Step 18/20: Extract metadata from PNG files and save as .tEXt.txt: %s", make_text_cmd)
+                logging.error("Step %s/20: Input file %s not found. Exiting.", step.number, path)
+            return False
 
-        try:
-            # Execute the png_text.py command
-            result = subprocess.run(make_text_cmd, shell=True, check=True)
-
-            if DEBUG:
-                logging.debug("Step 18.1/20 Read .txt files and rename PNG files to the .srt timestamp: %s", rename_png_cmd)
-
-            # Execute the rename_png_files.py command
-            result = subprocess.run(rename_png_cmd, shell=True, check=True)
-
-            path_to_images = path_to_images.replace("<bookname>", bookname)  # Replace placeholder
-            txt_files = glob.glob(os.path.join(path_to_images, "*.tEXt.txt"))
-            for file_path in txt_files:
-                try:
-                    os.remove(file_path)
-                except OSError as e:
-                    print(f"Error deleting file {file_path}: {e}")
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
+    outputs = step.output_paths(book)
+    ran = bool(reasons)
+    if not reasons:
+        logging.info("Up to date: %s", ", ".join(outputs))
     else:
-        print("Skipping file renaming step as per user choice.")
+        stale_folders = [path for path in outputs if os.path.isdir(path)]
+        if stale_folders:
+            logging.error("Step %s/20 %s: %s is out of date (%s). Move it aside to regenerate it, or delete the '%s' entry "
+                          "from %s to keep it.", step.number, step.name, ", ".join(stale_folders), "; ".join(reasons),
+                          step.name, manifest.manifest_path(book.folder))
+            return False
+        # Stale files are removed so no step (or ffmpeg) finds an old output in its way
+        remove_files(outputs)
+        if not execute_step(book, step):
+            return False
 
-    # Step 19: Create an output video if it doesn't exist
-    video_format = config.get('video_format', 'avi')
-    output_video_path = os.path.join(book_folder, f"{bookname}_output.{video_format}")
+    if step.verify and not step.verify(book):
+        # Delete the incorrect file and try once more
+        remove_files(outputs)
+        logging.info("Attempting to recreate: %s", ", ".join(outputs))
+        if not execute_step(book, step):
+            return False
+        if not step.verify(book):
+            discard_outputs(book, step)
+            return False
+        ran = True
 
-    if not os.path.exists(output_video_path):
-        logging.info("Creating silent output video: %s", output_video_path)
+    if ran and outputs:
+        record_outputs(book, step, current)
+    return True
 
-        # Construct the jobvid.py command
-        jobvid_cmd = f"python jobvid.py {q}{os.path.join(path_to_images, '*.png')}{q} {q}{output_video_path}{q} {video_format}"
+def step_dependencies(book, steps):
+    """Maps each step name to the steps that produce its inputs, plus the steps it must run after."""
+    producers = {}
+    for step in steps:
+        for path in step.output_paths(book):
+            producers[path] = step.name
+
+    names = {step.name for step in steps}
+    dependencies = {}
+    for step in steps:
+        deps = [producers[path] for path in step.input_paths(book) if producers.get(path, step.name) != step.name]
+        deps += [name for name in step.after if name in names]
+        dependencies[step.name] = list(dict.fromkeys(deps))
+    return dependencies
+
+def step_resources(book, step):
+    resources = []
+    if step.uses_api and book.api_key:
+        resources.append('api')
+    if step.uses_comfyui and book.config.get('image_generator') == 'ComfyUI':
+        resources.append('comfyui')
+    if book.profile and (step.script or step.cpu_bound):
+        # Newer Pythons allow only one active cProfile per process
+        resources.append('cprofile')
+    return resources
+
+def pipeline_tasks(book, steps=PIPELINE):
+    """
+    The enabled steps of a book as scheduler tasks linked by the files they read and write.
+    Tasks are named <bookname>:<step> so the steps of several books can share one scheduler.
+    """
+    steps = [step for step in steps if step.when is None or step.when(book)]
+    dependencies = step_dependencies(book, steps)
+    task_name = lambda name: f"{book.name}:{name}"
+    return [scheduler.Task(task_name(step.name), functools.partial(run_step, book, step, steps),
+                           [task_name(dep) for dep in dependencies[step.name]], step_resources(book, step), book.name)
+            for step in steps]
+
+def resource_limits(config):
+    """
+    GPT steps share one budget and ComfyUI gets one book's prompts at a time. Each GPT step sends several
+    requests at once, so the requests themselves are limited to api_requests by api_limit.
+    """
+    api_limit.configure(config)
+    return {'api': config.get('api_concurrency', 1), 'comfyui': 1, 'cprofile': 1}
 
-        # Log the command if debugging is enabled
+def run_pipeline(book, steps=PIPELINE, workers=None):
+    """
+    Runs the steps of a book. Steps whose inputs are ready run concurrently, up to the 'workers' config key,
+    with at most 'api_concurrency' of them and 'api_requests' GPT requests calling the API at once.
+    workers=1 runs them in order.
+    """
+    workers = workers or book.config.get('workers', 1)
+    runner = scheduler.Scheduler(workers, resource_limits(book.config))
+    status = runner.run(pipeline_tasks(book, steps))
+    report_profile(book)
+    if book.blocked:
+        logging.info("%s stopped until the user acts: %s", book.name, book.blocked)
+    return all(status.values())
+
+def open_book(bookname, wildcard_path=None, explain=False, api_key=None, process_pool=None, profile=False,
+              interactive=True, dry_run=False):
+    """
+    Creates the book folder and loads its configuration. Returns None if either fails.
+    dry_run (abs plan) leaves the folder alone and never reads an input the manifest has no hash for.
+    """
+    # Step 1: Create the folder books\<bookname> if it does not exist
+    book_folder = os.path.join('books', bookname)
+    if not dry_run:
+        if not create_directory(book_folder):
+            return None
         if DEBUG:
-            logging.debug("Step 19/20: Parallel ffmpeg processes generate and combine still image ."+video_format+" %s", jobvid_cmd)
+            logging.debug("Step 01/20: Audio book folder: %s",book_folder)
 
-        try:
-            subprocess.run(jobvid_cmd, shell=True, check=True)
-        except subprocess.CalledProcessError:
-            # Silently ignore the error
-            pass
-
-        # Check if the output file was created, after the try-except block
-        if not os.path.exists(output_video_path):
-            logging.error("Failed to create output video: %s", output_video_path)
-            return  # Exit from the current function or script
-        else:
-            logging.info("Output video created: %s", output_video_path)
+    config = load_config(bookname, book_folder)
+    if config is None:
+        return None
 
-    else:
-        logging.info("Output video already exists: %s", output_video_path)
+    return Book(bookname, config, api_key, wildcard_path, explain, process_pool, profile, interactive, dry_run)
 
-    # Step 20: Create the final video if it doesn't already exist
-    output_avi_path = os.path.join(book_folder, f"{bookname}.{video_format}")
+def main(bookname, wildcard_path=None, explain=False, workers=None, profile=False, interactive=True):
+    book = open_book(bookname, wildcard_path, explain, read_api_key(), profile=profile, interactive=interactive)
+    if book is None:
+        return
+    return run_pipeline(book, workers=workers)
 
-    if not os.path.exists(output_avi_path):
-        logging.info("Creating the final video with audio: %s", output_avi_path)
+def read_batch(batch_path):
+    """
+    Returns the (bookname, wildcard_path) pairs of a batch. batch_path is either a text file with one
+    book per line, "bookname" or "bookname<TAB>wildcard_path" (# starts a comment), or a folder whose
+    subfolders containing audio files each become a book named after the subfolder.
+    """
+    entries = []
+    if os.path.isdir(batch_path):
+        for entry in sorted(os.scandir(batch_path), key=lambda e: e.name):
+            if entry.is_dir() and find_audio_files(entry.path)[1]:
+                entries.append((entry.name, entry.path))
+        return entries
+
+    with open(batch_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            bookname, _, wildcard_path = line.partition('\t')
+            entries.append((bookname.strip(), wildcard_path.strip() or None))
+    return entries
+
+def run_batch(batch_path, explain=False, workers=None, profile=False):
+    """
+    Runs the pipelines of several books on one scheduler. The books share the step workers, the
+    api_concurrency and api_requests budgets for GPT calls, the ComfyUI queue and a process pool ('cpu_workers') for
+    the pure Python steps, so one book's transcription overlaps another's text processing.
+    Batches never prompt: a book that needs the user is reported as blocked while the others go on.
+    Returns True if every book finished.
+    """
+    entries = read_batch(batch_path)
+    if not entries:
+        logging.error("No books found in batch: %s", batch_path)
+        return False
 
-        if video_format == "mp4":
-            ffmpeg_cmd = (
-                f'ffmpeg -hide_banner -i "books/{bookname}/{bookname}_output.{video_format}" '
-                f'-i "books/{bookname}/{bookname}.mp3" '
-                f'-sub_charenc UTF-8 -i "books/{bookname}/{bookname}.srt" '
-                f'-map 0:v:0 -map 1:a:0 -map 2:s:0 -c:v copy -c:a copy -c:s mov_text {q}{output_avi_path}{q}'
-            )
+    default_config = load_default_config() or {}
+    workers = workers or default_config.get('workers', 1)
+    api_key = read_api_key()
+
+    with ProcessPoolExecutor(max_workers=default_config.get('cpu_workers') or None) as pool:
+        books, tasks, failed = [], [], []
+        for bookname, wildcard_path in entries:
+            book = open_book(bookname, wildcard_path, explain, api_key, pool, profile, interactive=False)
+            if book is None:
+                failed.append(bookname)
+                continue
+            books.append(book)
+            tasks += pipeline_tasks(book)
+
+        status = scheduler.Scheduler(workers, resource_limits(default_config)).run(tasks)
+
+    for book in books:
+        report_profile(book)
+        results = [(task.name.split(':', 1)[1], status[task.name]) for task in tasks if task.group == book.name]
+        stopped = next((name for name, ok in results if ok is False), None)
+        if stopped is None and all(ok for name, ok in results):
+            logging.info("Batch: %s finished", book.name)
+        elif book.blocked:
+            logging.info("Batch: %s blocked at %s, %s", book.name, stopped, book.blocked)
+            failed.append(book.name)
         else:
-            ffmpeg_cmd = (
-                f'ffmpeg -hide_banner -i "books/{bookname}/{bookname}_output.{video_format}" '
-                f'-i "books/{bookname}/{bookname}.mp3" '
-                f'-c:v copy -map 0:v:0 -map 1:a:0 {q}{output_avi_path}{q}'
-            )
-
-        # Log the command if debugging is enabled
-        if DEBUG:
-            logging.debug("Step 20/20: This combines the original mp3 audio book and the generated video. .srt is included in the same folder. You could embed it in the video if you wanted to: \n%s", ffmpeg_cmd)
-        try:
-            result = subprocess.run(ffmpeg_cmd, shell=True, check=True)
-            if result.returncode == 0:
-                logging.info(f"{q}{output_avi_path}{q} and {q}books/{bookname}/{bookname}.srt{q} files created.")
-
-                temp_output_file = os.path.join("books", bookname, f"{bookname}_output.{video_format}")
-                if os.path.exists(temp_output_file):
-                    try:
-                        os.remove(temp_output_file)
-                    except OSError:
-                        pass
-        except subprocess.CalledProcessError as e:
-            logging.error("Command failed: %s", e)
-    else:
-        logging.info("Final video already exists: %s", output_avi_path)
+            logging.info("Batch: %s stopped at %s", book.name, stopped)
+            failed.append(book.name)
+    for bookname in failed:
+        if bookname not in [book.name for book in books]:
+            logging.info("Batch: %s could not be opened", bookname)
+    return not failed
 
 
 def check_ffmpeg_availability():
+    # ffmpeg runs through ffmpeg_runner everywhere; its job limit and time limits come from the default config
+    ffmpeg_runner.configure(load_default_config() or {})
     try:
         # Run the ffmpeg --version command and capture its output
-        ffmpeg_version_output = subprocess.check_output(["ffmpeg", "-version"], stderr=subprocess.STDOUT, text=True)
-
-        # Display the first line of the output
-        first_line = ffmpeg_version_output.splitlines()[0]
-        logging.info("ffmpeg found: %s", first_line)
-        return True
-
-    except subprocess.CalledProcessError as e:
+        result = ffmpeg_runner.run(["ffmpeg", "-version"])
+    except OSError as e:
+        logging.error("ffmpeg not found. Error: %s", e)
+        return False
+    if result.returncode != 0 or not result.stdout:
         # ffmpeg command failed, so it's not available
-        logging.error("ffmpeg not found. Error: %s", e.output)
+        logging.error("ffmpeg not found. Error: %s", result.stderr)
         return False
 
+    # Display the first line of the output
+    first_line = result.stdout.splitlines()[0]
+    logging.info("ffmpeg found: %s", first_line)
+    return True
+
 def get_version_and_description_from_setup():
     setup_path = 'setup.py'  # Assuming setup.py is in the same directory
     info = {"version": "1.0", "description": "Default description"}  # Default values
@@ -1019,16 +1313,62 @@ def get_version_and_description_from_setup():
 def cli():
     setup_info = get_version_and_description_from_setup()
     print(f"Audiobookslides (abs) version: {setup_info['version']}, {setup_info['description']}")
+    if sys.argv[1:2] == ['watch']:
+        import watch_inbox
+        if not check_ffmpeg_availability() or not watch_inbox.cli(sys.argv[2:]):
+            sys.exit(1)
+        return
+    if sys.argv[1:2] == ['plan']:
+        import plan_book
+        if not plan_book.cli(sys.argv[2:]):
+            sys.exit(1)
+        return
+    if sys.argv[1:2] == ['chapters']:
+        import chapter_videos
+        if not check_ffmpeg_availability() or not chapter_videos.cli(sys.argv[2:]):
+            sys.exit(1)
+        return
+
+    if sys.argv[1:2] == ['lines']:
+        if not line_store.cli(sys.argv[2:]):
+            sys.exit(1)
+        return
+
+    if sys.argv[1:2] == ['stats']:
+        if not ledger.cli(sys.argv[2:]):
+            sys.exit(1)
+        return
+
     parser = argparse.ArgumentParser(description='AudioBookSlides Command Line Tool')
-    parser.add_argument('bookname', type=str, help='Name of the book')
+    parser.add_argument('bookname', type=str, nargs='?', default=None, help='Name of the book')
     parser.add_argument('wildcard_path', nargs='?', default=None, help='Wildcard path to audio files')
+    parser.add_argument('--explain', action='store_true', help='Log why each step runs or is skipped')
+    parser.add_argument('--workers', type=int, default=None, help='Number of steps that may run at once (overrides the workers config key)')
+    parser.add_argument('--batch', metavar='PATH', default=None,
+                        help='Run several books: a text file with one "bookname[<TAB>wildcard_path]" per line, or a folder of audio folders')
+
+    parser.add_argument('--non-interactive', action='store_true',
+                        help='Never wait for input; answer the prompts from the config file (always on with --batch)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Dump cProfile stats of the Python steps to books/<bookname>/profile/<step>.prof')
 
     args = parser.parse_args()
+    if args.batch is None and args.bookname is None:
+        parser.error('bookname or --batch is required')
     # Check ffmpeg availability
     if not check_ffmpeg_availability():
         sys.exit(1)
 
-    main(args.bookname, args.wildcard_path)
+    try:
+        if args.batch is not None:
+            if not run_batch(args.batch, args.explain, args.workers, args.profile):
+                sys.exit(1)
+        else:
+            main(args.bookname, args.wildcard_path, args.explain, args.workers, args.profile, not args.non_interactive)
+    except KeyboardInterrupt:
+        # Do not leave ffmpeg encodes running after abs is stopped
+        ffmpeg_runner.cancel_all()
+        raise
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
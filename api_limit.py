@@ -0,0 +1,15 @@
+import threading
+
+# Every GPT request of the pipeline holds one of a fixed number of slots while it waits for the API, whichever
+# book or step sends it. The scheduler's api_concurrency counts steps, and each GPT step sends several requests
+# at once, so it alone does not bound the requests in flight; api_requests does.
+
+MAX_REQUESTS = 10
+
+slots = threading.BoundedSemaphore(MAX_REQUESTS)
+
+def configure(config):
+    """Sets the number of GPT requests that may be in flight at once from the api_requests key of a config."""
+    global MAX_REQUESTS, slots
+    MAX_REQUESTS = max(1, int(config.get('api_requests') or MAX_REQUESTS))
+    slots = threading.BoundedSemaphore(MAX_REQUESTS)
@@ -100,9 +100,13 @@ def process_line(line):
 
     return line
 
-def main(replacements_file, input_file, output_file):
+def run(replacements_file, input_file, output_file):
     replacements = load_replacements(replacements_file)
     replace_in_file(input_file, replacements, output_file)
+    return True
+
+def main(replacements_file, input_file, output_file):
+    run(replacements_file, input_file, output_file)
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,288 @@
+import os
+import re
+import json
+import math
+import bisect
+import itertools
+import shutil
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import ffmpeg_runner
+import manifest
+
+# Step 3 ingest: the source audio files become books/<bookname>/<bookname>.mp3 (or .m4a) in a single ffmpeg run.
+# Loudness is measured on evenly spaced windows across every source file before that run, so a multi-file
+# book is decoded once in full and encoded at most once, with no intermediate concat or sample files.
+
+# Seconds of audio measured when the length of a file can not be determined
+SAMPLE_SECONDS = 60
+
+# Window measurements of source files by content hash, shared by all books: books/.abs_loudness.json
+LOUDNESS_CACHE = os.path.join('books', '.abs_loudness.json')
+cache_lock = threading.Lock()
+
+# Sources that can go into bookname.m4a without re-encoding (ingest_mode: copy)
+AAC_EXTENSIONS = ('.m4b', '.m4a', '.aac')
+
+def write_concat_list(files, filelist_path):
+    """Writes the ffmpeg concat demuxer list for the files, in order. ffmpeg reads relative paths from the list folder."""
+    with open(filelist_path, 'w', encoding='utf-8') as filelist:
+        for full_path in files:
+            escaped_path = os.path.abspath(full_path).replace('\\', '\\\\')  # Escape the backslashes
+            escaped_path = escaped_path.replace("'", "'\\''")  # Escape single quotes
+            filelist.write(f"file '{escaped_path}'\n")
+
+def input_args(files, filelist_path):
+    """ffmpeg input arguments that read the files as one continuous stream."""
+    if len(files) == 1:
+        return ['-i', files[0]]
+    write_concat_list(files, filelist_path)
+    return ['-f', 'concat', '-safe', '0', '-i', filelist_path]
+
+def get_loudness_measurements(inputs, start=0, duration=SAMPLE_SECONDS):
+    """Runs loudnorm over duration seconds of the input from start and returns its JSON report, or None."""
+    command = ['ffmpeg', '-hide_banner', '-nostats', '-ss', str(start), '-t', str(duration)] + inputs + \
+              ['-af', 'loudnorm=I=-23:LRA=7:print_format=json', '-f', 'null', '-']
+    result = ffmpeg_runner.run(command, description='loudness measurement')
+    json_start = result.stderr.find('{')
+    json_end = result.stderr.rfind('}') + 1
+    if json_start != -1 and json_end > json_start:
+        try:
+            return json.loads(result.stderr[json_start:json_end])
+        except json.JSONDecodeError:
+            return None
+    return None
+
+def audio_duration(path):
+    """Length of an audio file in seconds from the ffmpeg header dump, or None."""
+    result = ffmpeg_runner.run(['ffmpeg', '-hide_banner', '-i', path])
+    match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def sample_windows(duration, count, window_seconds):
+    """(start, seconds) of count windows spread evenly over a file, each centred in its share of the file."""
+    if duration is None:
+        return [(0, SAMPLE_SECONDS)]
+    if duration <= count * window_seconds:
+        # Short file: measure all of it
+        return [(0, duration)]
+    share = duration / count
+    return [(round((i + 0.5) * share - window_seconds / 2, 3), window_seconds) for i in range(count)]
+
+def measure_window(path, start, window_seconds):
+    """Integrated loudness of one window, in LUFS (-inf for silence), or None if ffmpeg can not tell."""
+    loudness_data = get_loudness_measurements(['-i', path], start, window_seconds)
+    return float(loudness_data['input_i']) if loudness_data else None
+
+def aggregate_loudness(measurements):
+    """
+    Combines (LUFS, seconds) window measurements into one integrated loudness the way EBU R128 gates its
+    blocks: silent windows (below -70 LUFS) and windows 10 LU below the first average are left out.
+    """
+    def energy_mean(values):
+        total = sum(seconds for _, seconds in values)
+        return 10 * math.log10(sum(seconds * 10 ** (lufs / 10) for lufs, seconds in values) / total)
+
+    gated = [(lufs, seconds) for lufs, seconds in measurements if lufs is not None and lufs > -70]
+    if not gated:
+        return None
+    relative_gate = energy_mean(gated) - 10
+    gated = [(lufs, seconds) for lufs, seconds in gated if lufs > relative_gate]
+    return energy_mean(gated)
+
+def load_cache(path=LOUDNESS_CACHE):
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error("Error reading loudness cache %s: %s", path, e)
+    return {'files': {}, 'loudness': {}}
+
+def save_cache(cache, path=LOUDNESS_CACHE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(cache, file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def window_counts(lengths, windows):
+    """
+    How many windows fall in each file when windows windows are spread evenly over the whole book, window i
+    centred at (i + 0.5) / windows of its length. The counts add up to windows, so a book of more files than
+    windows is measured on some of its files only.
+    """
+    ends = list(itertools.accumulate(lengths))
+    counts = [0] * len(lengths)
+    if not ends:
+        return counts
+    for i in range(windows):
+        counts[min(bisect.bisect_right(ends, (i + 0.5) * ends[-1] / windows), len(lengths) - 1)] += 1
+    return counts
+
+def measure_book(files, windows=12, window_seconds=30, workers=None, cache_path=None):
+    """
+    Loudness of the whole book as a loudnorm-like report ({'input_i': ...}) for check_and_adjust_volume.
+    The windows are shared out over the files by length (window_counts) and measured in parallel on a process
+    pool. Each file's duration and windows are cached under its sha256 (looked up by size and mtime), so
+    measuring the same audio again, under any book name, costs nothing. The cache is LOUDNESS_CACHE by default.
+    """
+    cache_path = cache_path or LOUDNESS_CACHE
+    with cache_lock:
+        cache = load_cache(cache_path)
+        hashes = {path: manifest.hash_file(path, cache) for path in files}
+        entries = {path: dict(cache['loudness'].get(hashes[path], {})) for path in files}
+
+    durations = {path: entries[path]['duration'] if 'duration' in entries[path] else audio_duration(path) for path in files}
+    counts = dict(zip(files, window_counts([durations[path] or SAMPLE_SECONDS for path in files], windows)))
+    key = lambda path: f"windows {counts[path]}x{window_seconds}"
+    measured = [path for path in files if counts[path]]
+    pending = [path for path in measured if key(path) not in entries[path]]
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = {path: [(pool.submit(measure_window, path, start, seconds), seconds)
+                           for start, seconds in sample_windows(durations[path], counts[path], window_seconds)]
+                    for path in pending}
+            for path in pending:
+                entries[path][key(path)] = [[future.result(), seconds] for future, seconds in jobs[path]]
+
+    changed = [path for path in files if path in pending or 'duration' not in entries[path]]
+    if changed:
+        with cache_lock:
+            cache = load_cache(cache_path)
+            for path in changed:
+                entry = cache['loudness'].setdefault(manifest.hash_file(path, cache), {})
+                entry['duration'] = durations[path]
+                if path in pending:
+                    entry[key(path)] = entries[path][key(path)]
+            save_cache(cache, cache_path)
+
+    measurements = []
+    for path in measured:
+        measurements += [tuple(window) for window in entries[path][key(path)]]
+    logging.info("Measured loudness on %d windows of %d of %d files (%d from cache)", len(measurements), len(measured),
+                 len(files), len(measured) - len(pending))
+    loudness = aggregate_loudness(measurements)
+    return {'input_i': f"{loudness:.2f}"} if loudness is not None else None
+
+def check_and_adjust_volume(loudness_data, lufs_target, source):
+    """
+    Decides the volume change for a loudness measurement.
+    Automatically targets a loudness level 2 dB above the specified LUFS_target.
+    :param loudness_data: loudnorm report of the audio.
+    :param lufs_target: The LUFS level below which volume adjustment is triggered.
+    :return: ffmpeg volume filter value like "+4.5dB", or None.
+    """
+    if loudness_data:
+        integrated_loudness = float(loudness_data['input_i'])
+        logging.info(f"Detected loudness: {integrated_loudness} LUFS, Adjustment threshold: {lufs_target} LUFS")
+
+        if integrated_loudness < lufs_target:
+            # Automatically target a volume 2 dB above the threshold
+            volume_adjustment = (lufs_target - integrated_loudness) + 2
+            logging.info(f"Volume adjustment needed: +{volume_adjustment}dB to reach 2 dB above the threshold.")
+            return f"+{volume_adjustment}dB"
+        else:
+            logging.info("No volume adjustment needed.")
+    else:
+        logging.warning(f"Loudness data could not be determined for {source}.")
+
+    return None
+
+def is_aac(path):
+    return os.path.splitext(path)[1].lower() in AAC_EXTENSIONS
+
+def encode(inputs, target_file, volume_adjustment=None, copy=False):
+    """
+    The single full pass: joins the inputs, applies the volume filter and writes target_file.
+    An .m4a target keeps AAC audio and drops the cover art, which the audio-only container can not hold.
+    """
+    codec = 'aac' if target_file.lower().endswith('.m4a') else 'libmp3lame'
+    command = ['ffmpeg', '-hide_banner', '-y'] + inputs
+    if codec == 'aac':
+        command += ['-vn']
+    if volume_adjustment:
+        command += ['-filter:a', f"volume={volume_adjustment}", '-acodec', codec]
+    elif copy:
+        command += ['-c', 'copy']
+    else:
+        command += ['-acodec', codec]
+    command.append(target_file)
+
+    try:
+        return ffmpeg_runner.call(command, f"Step 3 {os.path.basename(target_file)}")
+    except OSError as e:
+        logging.error("Command failed: %s", e)
+        return False
+
+def ingest(files, target_file, filelist_path, lufs_target=None, windows=12, window_seconds=30):
+    """
+    Creates target_file from the source audio files. With lufs_target the book is measured with
+    measure_book and quiet books are raised to 2 dB above the target in the same pass that joins and
+    encodes them. Sources that need no change are copied without re-encoding when they already have the
+    codec of the target: mp3 into an .mp3, AAC (m4b, m4a, aac) into an .m4a.
+    """
+    inputs = input_args(files, filelist_path)
+
+    volume_adjustment = None
+    if lufs_target is not None:
+        volume_adjustment = check_and_adjust_volume(measure_book(files, windows, window_seconds), lufs_target, files[0])
+        if volume_adjustment:
+            logging.info(f"Adjusting volume for {target_file} by {volume_adjustment}.")
+
+    if target_file.lower().endswith('.m4a'):
+        return encode(inputs, target_file, volume_adjustment, copy=all(is_aac(path) for path in files))
+    all_mp3 = all(path.lower().endswith('.mp3') for path in files)
+    if len(files) == 1 and all_mp3 and not volume_adjustment:
+        shutil.copyfile(files[0], target_file)
+        return True
+    return encode(inputs, target_file, volume_adjustment, copy=all_mp3)
+
+def probe_chapters(path):
+    """(duration, [(start, end, title)]) of an audio file from ffprobe, or from the ffmpeg header dump without ffprobe."""
+    command = ['ffprobe', '-v', 'error', '-show_chapters', '-show_format', '-print_format', 'json', path]
+    try:
+        result = ffmpeg_runner.run(command)
+        data = json.loads(result.stdout or '{}')
+        duration = float(data['format']['duration']) if 'duration' in data.get('format', {}) else None
+        return duration, [(float(chapter['start_time']), float(chapter['end_time']), chapter.get('tags', {}).get('title'))
+                          for chapter in data.get('chapters', [])]
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        logging.error("Error reading ffprobe output for %s: %s", path, e)
+
+    result = ffmpeg_runner.run(['ffmpeg', '-hide_banner', '-i', path])
+    chapters = []
+    for match in re.finditer(r'Chapter #\d+:\d+: start (-?[\d.]+), end ([\d.]+)\n(?:\s+Metadata:\n\s+title\s*: (.*)\n)?', result.stderr):
+        chapters.append((float(match.group(1)), float(match.group(2)), match.group(3)))
+    return audio_duration(path), chapters
+
+def write_chapters(files, chapters_file):
+    """
+    Writes the chapters of the book to chapters_file as JSON, with times on the joined book audio.
+    A source file without chapter metadata (eg. one mp3 per chapter) is one chapter named after the file.
+    """
+    chapters = []
+    offset = 0.0
+    for path in files:
+        duration, file_chapters = probe_chapters(path)
+        if not file_chapters:
+            file_chapters = [(0.0, duration or 0.0, os.path.splitext(os.path.basename(path))[0])]
+        for start, end, title in file_chapters:
+            chapters.append({'number': len(chapters) + 1, 'title': title or f"Chapter {len(chapters) + 1}",
+                             'start': round(offset + start, 3), 'end': round(offset + end, 3), 'source': os.path.basename(path)})
+        offset += duration if duration is not None else file_chapters[-1][1]
+
+    temp_path = chapters_file + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump({'duration': round(offset, 3), 'chapters': chapters}, file, indent=1)
+    os.replace(temp_path, chapters_file)
+    logging.info("Found %d chapters in %d files: %s", len(chapters), len(files), chapters_file)
+    return chapters
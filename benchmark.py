@@ -0,0 +1,256 @@
+import os
+import copy
+import json
+import zlib
+import struct
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import contextlib
+from types import SimpleNamespace
+from datetime import datetime
+
+import abs
+import audio_ingest
+import ffmpeg_runner
+import combined_dictionary
+import ledger
+import timeline
+
+# Benchmarks the pipeline on synthetic books, eg. python benchmark.py --hours 1 12 40
+# WhisperX and ComfyUI are replaced by stubs and the GPT API is never called, so every step that runs on the CPU
+# (ingest, the text steps, jobvid and the final ffmpeg mux) is timed on the same input on every machine.
+# With --gpt the book gets an API key and a stub answers the GPT requests, so the work of the GPT steps around
+# the requests (parsing, the CSV files and the steps that only run with GPT) is timed too.
+# The run ledger and the loudness cache of a benchmark live in a temporary folder, not in books/.
+
+FIRST_NAMES = ["Theodora", "Moxie", "Ellington", "Pip", "Harvey", "Mimi", "Stu", "Clara", "Jonah", "Beatrix", "Silas",
+               "Marguerite", "Otto", "Rosalind", "Felix", "Imogen", "Caspian", "Delphine", "Rufus", "Odette"]
+LAST_NAMES = ["Faint", "Mitchum", "Snicket", "Hargrove", "Whitlock", "Pembrook", "Ashdown", "Quill", "Marlowe", "Vance"]
+WORDS = ("the a house ran quickly over dark road she he her him it was cold and then they went into town with bright "
+         "lights window door table morning night voice hand face eyes slowly never always little old young long "
+         "under behind across river forest city street car phone letter money waited turned opened closed").split()
+
+def write_srt(path, hours, seed=1, dialogue=0.4):
+    """
+    Writes a WhisperX-like .srt covering the given hours: short cues about 2.5 seconds apart, with a named
+    speaker and a speech verb in the given fraction of them. Returns the number of cues.
+    """
+    rng = random.Random(seed)
+    characters = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(12)] + FIRST_NAMES[:8]
+    end_ms = int(hours * 3600 * 1000)
+    time_ms, number = 0, 0
+    with open(path, 'w', encoding='utf-8') as file:
+        while time_ms < end_ms:
+            number += 1
+            duration = rng.randint(500, 4000)
+            text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 14)))
+            if rng.random() < dialogue:
+                text = f"{rng.choice(characters)} {rng.choice(combined_dictionary.SPEECH_VERBS)} {text}"
+            if rng.random() < 0.3:
+                text = text.capitalize() + rng.choice(['.', '?', '!', ''])
+            file.write(f"{number}\n{timeline.format_time(time_ms)} --> {timeline.format_time(time_ms + duration)}\n{text}\n\n")
+            time_ms += duration + rng.randint(0, 300)
+    return number
+
+def write_tone(path, seconds):
+    """A mono sine tone mp3 made by ffmpeg; small and quick to create even for a 40 hour book."""
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi",
+               "-i", f"sine=frequency=220:sample_rate=22050:duration={seconds}", "-ac", "1", "-b:a", "32k", path]
+    if not ffmpeg_runner.call(command, f"tone {os.path.basename(path)}"):
+        raise RuntimeError(f"ffmpeg could not write {path}")
+
+def placeholder_png(width, height):
+    """A single colour RGB PNG, written without an image library."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    row = b'\x00' + b'\x40\x60\x80' * width
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(row * height, 9))
+            + chunk(b'IEND', b''))
+
+def stub_transcribe(book):
+    """Stands in for WhisperX: the synthetic subtitles written with the book."""
+    shutil.copyfile(book.path('_synthetic.srt'), book.path('.srt'))
+    return True
+
+def stub_generate_images(book):
+    """Stands in for ComfyUI: one placeholder PNG per prompt, named by its timestamp like the renamed images."""
+    folder = book.images_path()
+    os.makedirs(folder, exist_ok=True)
+    png = placeholder_png(int(book.config.get('image_width', 768)), int(book.config.get('image_height', 512)))
+    with open(book.path('_merged_names.txt'), 'r', encoding='utf-8') as file:
+        for line in file:
+            tag, ms = timeline.find_tag(line)
+            if tag:
+                with open(os.path.join(folder, f"{timeline.format_stamp(ms)}.png"), 'wb') as image:
+                    image.write(png)
+    return True
+
+STUBS = {'transcribe': stub_transcribe, 'generate_images': stub_generate_images}
+
+CLOTHING = ["a grey wool coat", "a red dress", "a denim jacket", "a dark suit", "a yellow raincoat", "overalls"]
+ACTIVITIES = ["walking", "sitting at a table", "opening a door", "talking on the phone", "looking out of a window"]
+ROOMS = ["dim kitchen", "crowded train station", "quiet library", "rain soaked street", "small office", "forest clearing"]
+DETAILS = ["a wooden table and two chairs", "tall windows", "a flickering street lamp", "shelves of old books",
+           "a worn leather sofa", "puddles reflecting neon signs"]
+
+def stub_completion(model=None, prompt='', **kwargs):
+    """
+    Stands in for openai.Completion.create with answers shaped like GPT's: a character line for gen_prompts and a
+    set design for extract_scene. The answer is chosen from the prompt, so every run gets the same answers.
+    """
+    rng = random.Random(zlib.crc32(prompt.encode('utf-8')))
+    if 'set designer' in prompt:
+        text = f"A {rng.choice(ROOMS)} with {rng.choice(DETAILS)} and {rng.choice(DETAILS)}, lit softly."
+    else:
+        line = prompt.rsplit('\n\n', 1)[-1]
+        name = next((name for name in FIRST_NAMES if name in line), None)
+        if name:
+            gender = 'female' if zlib.crc32(name.encode('utf-8')) % 2 else 'male'
+            text = f"[{name}], {{{gender}}}, ({rng.randint(18, 70)}), <{rng.choice(CLOTHING)}>, {rng.choice(ACTIVITIES)}."
+        else:
+            text = f"[PROPER NAME], {{GENDER}}, (AGE), <CLOTHING>, {rng.choice(ACTIVITIES)}."
+    return SimpleNamespace(choices=[SimpleNamespace(text=text)],
+                           usage=SimpleNamespace(total_tokens=len(prompt.split()) + len(text.split())))
+
+@contextlib.contextmanager
+def stub_gpt(enabled):
+    """Answers the GPT requests with stub_completion while the benchmark runs."""
+    if not enabled:
+        yield
+        return
+    import openai  # Deferred: only needed with --gpt
+    create = openai.Completion.create
+    openai.Completion.create = stub_completion
+    try:
+        yield
+    finally:
+        openai.Completion.create = create
+
+@contextlib.contextmanager
+def private_state():
+    """
+    Points the run ledger and the loudness cache at a temporary folder while the benchmark runs, so the synthetic
+    books never show up in abs stats and the loudness of their audio is measured, not found in the cache.
+    """
+    folder = tempfile.mkdtemp(prefix='abs_benchmark_')
+    saved = ledger.LEDGER_FILE, audio_ingest.LOUDNESS_CACHE
+    ledger.LEDGER_FILE = os.path.join(folder, os.path.basename(ledger.LEDGER_FILE))
+    audio_ingest.LOUDNESS_CACHE = os.path.join(folder, os.path.basename(audio_ingest.LOUDNESS_CACHE))
+    try:
+        yield folder
+    finally:
+        ledger.LEDGER_FILE, audio_ingest.LOUDNESS_CACHE = saved
+        shutil.rmtree(folder, ignore_errors=True)
+
+def benchmark_steps(until=None):
+    """The pipeline with the GPU steps replaced by stubs, ending with the step named until."""
+    steps = []
+    for step in abs.PIPELINE:
+        if step.name in STUBS:
+            step = copy.copy(step)
+            step.func = STUBS[step.name]
+            step.script = None
+            step.version = 'benchmark stub'
+        steps.append(step)
+        if step.name == until:
+            break
+    return steps
+
+def build_book(bookname, hours, seed, dialogue, files, lufs_target):
+    """Creates books/<bookname> with its config, synthetic subtitles and the tone track split into files."""
+    book_folder = os.path.join('books', bookname)
+    shutil.rmtree(book_folder, ignore_errors=True)
+    audio_folder = os.path.join(book_folder, 'audio')
+    os.makedirs(audio_folder)
+
+    config = {
+        'image_generator': 'ComfyUI',
+        'path_to_comfyui': os.path.join(book_folder, 'images'),
+        'path_to_workflow': os.path.join(abs.SCRIPT_PATH, 'Photon_1Face_Api.json'),
+        'actors': os.path.join(abs.SCRIPT_PATH, 'actors', 'male.csv'),
+        'actresses': os.path.join(abs.SCRIPT_PATH, 'actors', 'female.csv'),
+        # The WhisperX stub writes only the .srt
+        'keep_word_json': 0,
+    }
+    if lufs_target is not None:
+        config['LUFS_target'] = lufs_target
+    with open(os.path.join(book_folder, f"{bookname}.yaml"), 'w') as file:
+        json.dump(config, file, indent=1)  # JSON is valid YAML
+
+    cues = write_srt(os.path.join(book_folder, f"{bookname}_synthetic.srt"), hours, seed, dialogue)
+    seconds = hours * 3600 / files
+    for number in range(files):
+        write_tone(os.path.join(audio_folder, f"part{number + 1:03d}.mp3"), seconds)
+    return audio_folder, cues
+
+def run_benchmark(hours, seed=1, dialogue=0.4, files=1, lufs_target=None, until=None, keep=False, gpt=False):
+    """Builds and runs one synthetic book. Returns its results, with the per-step costs from the profiler."""
+    bookname = f"benchmark_{hours:g}h"
+    logging.info("Building %s", bookname)
+    audio_folder, cues = build_book(bookname, hours, seed, dialogue, files, lufs_target)
+
+    with private_state(), stub_gpt(gpt):
+        book = abs.open_book(bookname, audio_folder, api_key='benchmark' if gpt else None, interactive=False)
+        # One step at a time, so the CPU and I/O figures of a step are its own
+        ok = bool(abs.run_pipeline(book, benchmark_steps(until), workers=1))
+    ts_lines = abs.count_lines(book.path('_ts.srt')) if os.path.exists(book.path('_ts.srt')) else None
+
+    result = {'hours': hours, 'cues': cues, 'ts_lines': ts_lines, 'audio_files': files, 'gpt': gpt, 'finished': ok,
+              'steps': book.profile_records}
+    if not keep:
+        shutil.rmtree(book.folder, ignore_errors=True)
+    return result
+
+def compare(results, baseline_file):
+    """Logs the wall time of each step against an earlier results file."""
+    with open(baseline_file, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)
+    for size, book in results['books'].items():
+        old_book = baseline['books'].get(size)
+        if old_book is None:
+            continue
+        logging.info("%s compared with %s (%s):", size, baseline_file, baseline.get('version'))
+        for name, record in book['steps'].items():
+            old = old_book['steps'].get(name)
+            if old and old.get('wall_s'):
+                logging.info("  %-16s %9.2fs -> %9.2fs  x%.2f", name, old['wall_s'], record['wall_s'],
+                             record['wall_s'] / old['wall_s'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic audio books')
+    parser.add_argument('--hours', type=float, nargs='+', default=[1, 12, 40], help='Book lengths to benchmark (default 1 12 40)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic subtitles')
+    parser.add_argument('--dialogue', type=float, default=0.4, help='Fraction of subtitles with a named speaker')
+    parser.add_argument('--files', type=int, default=1, help='Number of audio files the tone track is split into')
+    parser.add_argument('--lufs', type=float, default=None, help='LUFS_target, to include the loudness check')
+    parser.add_argument('--until', default=None, help='Last step to run, eg. prune_actors to leave out the video steps')
+    parser.add_argument('--output', default=None, help='Results file (default benchmarks/<version>_<date>.json)')
+    parser.add_argument('--compare', default=None, help='Earlier results file to compare with')
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic books in the books folder')
+    parser.add_argument('--gpt', action='store_true', help='Run the GPT steps, with a stub answering their requests')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    version = abs.get_version_and_description_from_setup()['version']
+    results = {'version': version, 'created': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+               'books': {}}
+    for hours in args.hours:
+        results['books'][f"{hours:g}h"] = run_benchmark(hours, args.seed, args.dialogue, args.files, args.lufs,
+                                                        args.until, args.keep, args.gpt)
+
+    output = args.output or os.path.join('benchmarks', f"{version}_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=1)
+    logging.info("Benchmark results: %s", output)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+from collections import Counter
+
+import benchmark
+import combined_dictionary
+import fix_srt
+import make_prompts
+import timeline
+
+# Benchmarks of the text algorithms against the versions they replaced, on the synthetic subtitles of benchmark.py,
+# eg. python benchmark_text.py fix_srt --hours 1 12 40. Each run also checks that both versions give the same output.
+
+def best_time(func, repeat):
+    """Fastest of repeat runs of func, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def same_file(first, second):
+    with open(first, 'rb') as file1, open(second, 'rb') as file2:
+        return file1.read() == file2.read()
+
+# The versions the text steps replaced, as they were in the steps: the reference of the benchmarks and the tests.
+# The pipeline does not use them.
+
+def process_pass(input_file, output_file, char_limit):
+    """One pass of the original fix_srt.py joiner: every pair of cues that fits in char_limit is joined once."""
+    with open(input_file, 'r', encoding='utf-8') as file:
+        lines = file.readlines()
+
+    # Correct the first timestamp if needed
+    # Search for the first occurrence of "-->" at position 14
+    for i, line in enumerate(lines):
+        if line.strip().find("-->") == 13:  # 13 because indexing starts at 0
+            start_time, end_time = line.split(' --> ')
+            if start_time != '00:00:00,000':
+                lines[i] = '00:00:00,000 --> ' + end_time + '\n'
+            break
+
+    new_lines = []
+    buffer_line = ""
+    buffer_start_time = ""
+    buffer_end_time = ""
+    current_index = 1
+    combined_any = False
+
+    for i in range(0, len(lines) - 3, 4):
+        index_line = lines[i].strip()
+        time_line = lines[i + 1].strip()
+        text_line = lines[i + 2].strip()
+
+        # Apply preprocessing only to text lines
+        preprocessed_text_line = fix_srt.preprocess_text(text_line)
+
+        if not buffer_line:  # If buffer is empty, set the start time
+            buffer_start_time = time_line.split('-->')[0].strip()
+
+        if buffer_line and len(buffer_line + ' ' + preprocessed_text_line) <= char_limit:
+            # Combine lines
+            buffer_end_time = time_line.split('-->')[1].strip()
+            combined_time = f"{buffer_start_time} --> {buffer_end_time}"
+            new_lines.append(f"{current_index}\n{combined_time}\n{buffer_line} {preprocessed_text_line}\n\n")
+            current_index += 1
+            buffer_line = ""  # Clear the buffer after combining
+            combined_any = True
+        else:
+            if buffer_line:
+                # Add buffered line as is
+                buffer_end_time = buffer_time.split('-->')[1].strip()
+                combined_time = f"{buffer_start_time} --> {buffer_end_time}"
+                new_lines.append(f"{current_index}\n{combined_time}\n{buffer_line}\n\n")
+                current_index += 1
+
+            buffer_line = preprocessed_text_line
+            buffer_start_time = time_line.split('-->')[0].strip()
+            buffer_end_time = time_line.split('-->')[1].strip()
+            buffer_time = time_line
+
+    # Add the last buffered line if it exists
+    if buffer_line:
+        combined_time = f"{buffer_start_time} --> {buffer_end_time}"
+        new_lines.append(f"{current_index}\n{combined_time}\n{buffer_line}\n\n")
+
+    with open(output_file, 'w', encoding='utf-8') as file:
+        file.writelines(new_lines)
+
+    return combined_any
+
+def join_subtitles_passes(input_file, output_file, char_limit):
+    """The original fix_srt.py: process_pass over the whole file until a pass joins nothing."""
+    with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.srt', encoding='utf-8') as temp:
+        temp_file = temp.name
+        combined_any = process_pass(input_file, temp_file, char_limit)
+
+        while combined_any:
+            combined_any = process_pass(temp_file, temp_file, char_limit)
+
+        # Rewind the temporary file to read its content
+        temp.seek(0)
+        final_content = temp.readlines()
+
+    # Copy the final output to the desired output file
+    with open(output_file, 'w', encoding='utf-8') as file:
+        file.writelines(final_content)
+
+    # Remove the temporary file
+    try:
+        os.remove(temp_file)
+    except OSError as e:
+        print(f"Error: {e.filename} - {e.strerror}.")
+
+def process_file_paragraphs(input_file, output_file):
+    """The original make_prompts.py, splitting the whole file on blank lines with regexes."""
+    with open(input_file, 'r', encoding='utf-8') as f_in:
+        content = f_in.read()
+
+    # Remove comment lines
+    content = re.sub(r'^#.*\r?\n', '', content, flags=re.MULTILINE)
+
+    # Merge lines between empty lines
+    paragraphs = re.split(r'\r?\n\r?\n', content)
+
+    # Process each paragraph
+    with open(output_file, 'w', encoding='utf-8') as f_out:
+        for paragraph in paragraphs:
+            if paragraph:  # check that paragraph is not empty
+                index, timestamp, *text = paragraph.split('\n')
+                index = index.zfill(5)
+                text = ' '.join(text).strip()
+
+                # Extract and format start timestamp
+                start_timestamp = re.match(r'\d\d:\d\d:\d\d,\d\d\d', timestamp).group()
+                start_timestamp = re.sub(r'[:,\s]', '', start_timestamp)
+                start_timestamp = f'{{ts={start_timestamp}}}'
+
+                # Format and escape text
+                text = text.replace('"', '\\"').replace("'", "''")
+
+                f_out.write(f'"{start_timestamp}"\t"{text}"\n')
+
+def preprocess_counts_per_term(csv_file, unique_words, strict=0):
+    """The original combined_dictionary.preprocess_counts, one regex per term and line."""
+    counts = Counter()
+    male_counts = Counter()
+    female_counts = Counter()
+
+    male_pattern = re.compile(r'\b(?:he|him)\b')
+    female_pattern = re.compile(r'\b(?:she|her)\b')
+
+    with open(csv_file, "r", newline="", encoding='utf-8-sig') as infile:
+        for line in infile:
+            contains_male = bool(male_pattern.search(line))
+            contains_female = bool(female_pattern.search(line))
+
+            # Normalize line for non-strict comparison
+            line_lower = line.lower()
+            for term in unique_words:
+                # Determine if term needs to be case-sensitive
+                term_to_count = term if strict and term[0].isupper() else term.lower()
+
+                if ' ' in term:  # Handle multi-word terms
+                    term_count = line.count(term) if strict and term[0].isupper() else line_lower.count(term.lower())
+                else:  # Handle single-word terms
+                    # Use regex to match whole words, considering strict flag for capitalization
+                    pattern = re.compile(r'\b{}\b'.format(re.escape(term)), re.IGNORECASE if not strict or not term[0].isupper() else 0)
+                    term_count = len(pattern.findall(line if strict and term[0].isupper() else line_lower))
+
+                counts[term] += term_count
+                if contains_male:
+                    male_counts[term] += term_count
+                if contains_female:
+                    female_counts[term] += term_count
+
+    top_terms = {term: (counts[term], male_counts[term], female_counts[term]) for term in unique_words if counts[term] > 0}
+
+    return top_terms
+
+def find_matches_per_term(csv_file, unique_words, top_terms):
+    """The original combined_dictionary.find_matches, one regex per term and line."""
+    matches = {}
+    try:
+        with open(csv_file, "r", encoding='utf-8-sig') as infile:
+            for line_number, line in enumerate(infile, 1):
+                timestamp = timeline.find_tag(line)[0] or "unknown"
+                lowest_count_term = None
+                lowest_count = None
+                for term in unique_words:
+                    # Match terms based on their exact case
+                    if re.search(r'\b' + re.escape(term) + r'\b', line):
+                        count, male_count, female_count = top_terms.get(term, (0, 0, 0))
+                        # Update the term with the lowest count if this is the first term checked or if its count is lower than the current lowest
+                        if lowest_count is None or count < lowest_count:
+                            lowest_count_term = f"{term}_{count}_{male_count}_{female_count}"
+                            lowest_count = count
+                if lowest_count_term:  # If there's a term with the lowest count for this timestamp
+                    matches[timestamp] = [lowest_count_term]
+                else:
+                    matches[timestamp] = []
+    except FileNotFoundError:
+        print(f"Error: CSV file '{csv_file}' not found.")
+        sys.exit(1)
+    return matches
+
+def bench_fix_srt(hours, char_limit, repeat, folder):
+    """Step 5: the single pass joiner against the process_pass loop."""
+    srt_file = os.path.join(folder, f"{hours:g}h.srt")
+    cues = benchmark.write_srt(srt_file, hours)
+    new_file, old_file = os.path.join(folder, 'new.srt'), os.path.join(folder, 'old.srt')
+    new = best_time(lambda: fix_srt.join_subtitles(srt_file, new_file, char_limit), repeat)
+    old = best_time(lambda: join_subtitles_passes(srt_file, old_file, char_limit), repeat)
+    return cues, old, new, same_file(new_file, old_file)
+
+def bench_prompts(hours, char_limit, repeat, folder):
+    """
+    Steps 5 and 6: _m300.srt and _ts.srt in one pass against the versions they replaced, the process_pass
+    loop followed by the original make_prompts.py (join_subtitles_passes, process_file_paragraphs).
+    """
+    srt_file = os.path.join(folder, f"{hours:g}h.srt")
+    cues = benchmark.write_srt(srt_file, hours)
+    new_files = [os.path.join(folder, name) for name in ('new_m300.srt', 'new_ts.srt')]
+    old_files = [os.path.join(folder, name) for name in ('old_m300.srt', 'old_ts.srt')]
+
+    def separate():
+        join_subtitles_passes(srt_file, old_files[0], char_limit)
+        process_file_paragraphs(old_files[0], old_files[1])
+
+    new = best_time(lambda: fix_srt.run(srt_file, new_files[0], char_limit, new_files[1]), repeat)
+    old = best_time(separate, repeat)
+    return cues, old, new, all(same_file(new_file, old_file) for new_file, old_file in zip(new_files, old_files))
+
+def prompt_table(hours, char_limit, folder):
+    """The _ts.srt of a synthetic book and the character name candidates Step 7 finds in it."""
+    srt_file = os.path.join(folder, f"{hours:g}h.srt")
+    cues = benchmark.write_srt(srt_file, hours)
+    ts_file = os.path.join(folder, f"{hours:g}h_ts.srt")
+    fix_srt.run(srt_file, os.path.join(folder, f"{hours:g}h_m300.srt"), char_limit, ts_file)
+    dictionary = combined_dictionary.load_dictionary('tokenizer_vocab_2.txt')
+    unique_words, _ = combined_dictionary.process_file(ts_file, dictionary, combined_dictionary.SPEECH_VERBS)
+    return cues, ts_file, unique_words
+
+def bench_counts(hours, char_limit, repeat, folder):
+    """Step 7: the name counts of preprocess_counts against one regex per term and line."""
+    cues, ts_file, unique_words = prompt_table(hours, char_limit, folder)
+    results = {}
+    new = best_time(lambda: results.update(new=combined_dictionary.preprocess_counts(ts_file, unique_words, 1)), repeat)
+    old = best_time(lambda: results.update(old=preprocess_counts_per_term(ts_file, unique_words, 1)), repeat)
+    return cues, old, new, results['new'] == results['old']
+
+def bench_matches(hours, char_limit, repeat, folder):
+    """Step 7: the lowest count name of each line from the line index of the terms against one regex per term and line."""
+    cues, ts_file, unique_words = prompt_table(hours, char_limit, folder)
+    top_terms = combined_dictionary.preprocess_counts(ts_file, unique_words, 1)
+    results = {}
+    new = best_time(lambda: results.update(new=combined_dictionary.find_matches(ts_file, unique_words, top_terms)), repeat)
+    old = best_time(lambda: results.update(old=find_matches_per_term(ts_file, unique_words, top_terms)), repeat)
+    return cues, old, new, results['new'] == results['old']
+
+def bench_shards(hours, char_limit, repeat, folder):
+    """Step 7: character detection sharded over one process per CPU core (at least two) against one process."""
+    cues, ts_file, _ = prompt_table(hours, char_limit, folder)
+    new_file, old_file = os.path.join(folder, 'new_ts_p.srt'), os.path.join(folder, 'old_ts_p.srt')
+    workers = max(2, os.cpu_count() or 1)
+    run = combined_dictionary.run
+    new = best_time(lambda: run('tokenizer_vocab_2.txt', None, ts_file, new_file, 1, workers), repeat)
+    old = best_time(lambda: run('tokenizer_vocab_2.txt', None, ts_file, old_file, 1), repeat)
+    return cues, old, new, same_file(new_file, old_file)
+
+BENCHMARKS = {'fix_srt': bench_fix_srt, 'prompts': bench_prompts, 'counts': bench_counts, 'matches': bench_matches,
+              'shards': bench_shards}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark text steps against the versions they replaced')
+    parser.add_argument('name', choices=sorted(BENCHMARKS), help='What to benchmark')
+    parser.add_argument('--hours', type=float, nargs='+', default=[1, 12, 40], help='Book lengths (default 1 12 40)')
+    parser.add_argument('--chars', type=int, default=300, help='Characters per line for fix_srt (default 300)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each version; the fastest counts (default 3)')
+    args = parser.parse_args()
+
+    print(f"{'Book':>6}{'Cues':>9}{'Old s':>10}{'New s':>10}{'Speedup':>9}  Same output")
+    with tempfile.TemporaryDirectory() as folder:
+        for hours in args.hours:
+            cues, old, new, same = BENCHMARKS[args.name](hours, args.chars, args.repeat, folder)
+            print(f"{hours:>5g}h{cues:>9}{old:>10.3f}{new:>10.3f}{old / new:>8.1f}x  {'yes' if same else 'NO'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import json
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import abs
+import audio_ingest
+import ffmpeg_runner
+import timeline
+import transcribe
+
+# Step 21: one video per chapter in books/<bookname>/chapters, each with the slides, audio and subtitles of its
+# part of the book. Chapters are rendered at the same time on a process pool, and a chapter whose slides, times
+# and subtitles did not change is not rendered again, so fixing one image re-renders one chapter.
+
+FPS = 30
+INDEX_NAME = 'index.json'
+
+def book_chapters(book):
+    """
+    [(start, end, title)] in seconds: the chapters of chapters.json (written by Step 3, or now from the book audio).
+    With chapter_minutes, a book without chapters is cut at the silence nearest every chapter_minutes minutes.
+    """
+    path = abs.chapters_file(book)
+    if not os.path.exists(path):
+        audio_ingest.write_chapters([abs.book_audio(book)], path)
+    with open(path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    chapters = [(chapter['start'], chapter['end'], chapter['title']) for chapter in data['chapters']]
+
+    minutes = float(book.config.get('chapter_minutes', 0) or 0)
+    if len(chapters) <= 1 and minutes and data['duration'] > minutes * 90:
+        duration = data['duration']
+        silences = transcribe.find_silences(abs.book_audio(book), book.config.get('silence_noise', '-35dB'),
+                                            float(book.config.get('silence_seconds', 0.5)))
+        points = [0.0] + transcribe.cut_points(duration, silences, round(duration / 60 / minutes)) + [duration]
+        chapters = [(points[i], points[i + 1], f"Part {i + 1}") for i in range(len(points) - 1)]
+    return chapters
+
+def image_times(folder):
+    """(ms, path) of the renamed slides, HHMMSSmmm.png, in time order; the first image of a timestamp wins like in jobvid."""
+    images = []
+    seen = set()
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.png') and name[:9].isdigit() and name[:9] not in seen:
+            seen.add(name[:9])
+            images.append((timeline.parse_stamp(name[:9]), os.path.join(folder, name)))
+    return images
+
+def chapter_slides(images, start_ms, end_ms):
+    """
+    (image path, frames) for the chapter: the slide showing at its start, then every slide inside it, each
+    until the next one or the end of the chapter. Frames are rounded on the chapter clock so they never drift.
+    """
+    if not images:
+        return []
+    showing = [index for index, (ms, _) in enumerate(images) if ms <= start_ms]
+    first = showing[-1] if showing else 0
+    inside = [images[first]] + [image for image in images[first + 1:] if image[0] < end_ms]
+    slides = []
+    for number, (ms, path) in enumerate(inside):
+        slide_start = max(ms, start_ms) if number else start_ms
+        slide_end = inside[number + 1][0] if number + 1 < len(inside) else end_ms
+        frames = round((slide_end - start_ms) * FPS / 1000) - round((slide_start - start_ms) * FPS / 1000)
+        if frames > 0:
+            slides.append((path, frames))
+    return slides
+
+def chapter_subtitles(subtitles, start_ms, end_ms):
+    """The subtitles (a timeline.Timeline) overlapping the chapter, moved to the chapter clock and cut to its length."""
+    return [(max(start, start_ms) - start_ms, min(end, end_ms) - start_ms, text)
+            for start, end, text in subtitles.overlapping(start_ms, end_ms)]
+
+def signature(job):
+    """Everything a chapter video depends on: slides (by name, size and mtime), frames, times, subtitles and audio."""
+    digest = hashlib.sha256()
+    for path, frames in job['slides']:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{frames}\n".encode('utf-8'))
+    audio = os.stat(job['audio'])
+    digest.update(json.dumps([job['start'], job['end'], job['cues'], job['video_format'], audio.st_size, audio.st_mtime_ns]).encode('utf-8'))
+    return digest.hexdigest()
+
+def render_chapter(job):
+    """Renders the silent slides of one chapter and muxes them with its audio and subtitles. Runs in a worker process."""
+    import jobvid  # Deferred: imports cv2
+
+    video_format = job['video_format']
+    silent_video = os.path.splitext(job['output'])[0] + f"_silent.{video_format}"
+    srt_file = os.path.splitext(job['output'])[0] + '.srt'
+    timeline.write_srt(srt_file, job['cues'])
+    if not jobvid.render(job['slides'], silent_video, video_format):
+        return False
+
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', silent_video,
+               '-ss', f"{job['start']:.3f}", '-to', f"{job['end']:.3f}", '-i', job['audio']]
+    if video_format == 'mp4' and job['cues']:
+        command += ['-sub_charenc', 'UTF-8', '-i', srt_file, '-map', '0:v:0', '-map', '1:a:0', '-map', '2:s:0',
+                    '-c:v', 'copy', '-c:a', 'copy', '-c:s', 'mov_text']
+    else:
+        command += ['-map', '0:v:0', '-map', '1:a:0', '-c:v', 'copy', '-c:a', 'copy']
+    command.append(job['output'])
+    try:
+        ok = ffmpeg_runner.call(command, f"chapter {job['number']}")
+    finally:
+        if os.path.exists(silent_video):
+            os.remove(silent_video)
+    return ok and os.path.exists(job['output'])
+
+def chapter_jobs(book):
+    """One render job per chapter, in order."""
+    video_format = book.video_format()
+    images = image_times(book.images_path())
+    subtitles = timeline.Timeline.load(book.path('.srt'))
+    jobs = []
+    for number, (start, end, title) in enumerate(book_chapters(book), 1):
+        start_ms, end_ms = int(round(start * 1000)), int(round(end * 1000))
+        jobs.append({'number': number, 'title': title, 'start': start, 'end': end, 'video_format': video_format,
+                     'slides': chapter_slides(images, start_ms, end_ms), 'audio': abs.book_audio(book),
+                     'cues': chapter_subtitles(subtitles, start_ms, end_ms),
+                     'output': os.path.join(abs.chapter_videos_folder(book), f"{book.name}_{number:03d}.{video_format}")})
+    return jobs
+
+def run(book, only=None, workers=None):
+    """
+    Renders the chapter videos of a book whose inputs changed since they were rendered, or the chapter numbers
+    in only. In batch mode the book's shared process pool is used. Returns True when every chapter exists.
+    """
+    folder = abs.chapter_videos_folder(book)
+    os.makedirs(folder, exist_ok=True)
+    index_path = os.path.join(folder, INDEX_NAME)
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as file:
+            index = json.load(file)
+
+    jobs = chapter_jobs(book)
+    if not jobs or not any(job['slides'] for job in jobs):
+        logging.error("No slides found for the chapters of %s in %s", book.name, book.images_path())
+        return False
+    pending = []
+    for job in jobs:
+        job['signature'] = signature(job)
+        recorded = index.get(str(job['number']), {})
+        if only is not None:
+            if job['number'] in only:
+                pending.append(job)
+        elif recorded.get('signature') != job['signature'] or not os.path.exists(job['output']):
+            pending.append(job)
+    logging.info("Rendering %d of %d chapters of %s", len(pending), len(jobs), book.name)
+
+    pool = book.process_pool or ProcessPoolExecutor(max_workers=workers or int(book.config.get('chapter_workers', 2)))
+    try:
+        futures = [(job, pool.submit(render_chapter, job)) for job in pending]
+        ok = True
+        for job, future in futures:
+            if future.result():
+                index[str(job['number'])] = {'title': job['title'], 'start': job['start'], 'end': job['end'],
+                                             'file': os.path.basename(job['output']), 'signature': job['signature']}
+            else:
+                logging.error("Failed to render chapter %d of %s", job['number'], book.name)
+                index.pop(str(job['number']), None)
+                ok = False
+    finally:
+        if pool is not book.process_pool:
+            pool.shutdown()
+
+    # Chapters left over from an earlier, longer chapter list
+    for number in [key for key in index if int(key) > len(jobs)]:
+        stale = os.path.join(folder, index.pop(number)['file'])
+        for path in [stale, os.path.splitext(stale)[0] + '.srt']:
+            if os.path.exists(path):
+                os.remove(path)
+    with open(index_path, 'w', encoding='utf-8') as file:
+        json.dump(index, file, indent=1)
+    return ok and all(os.path.exists(job['output']) for job in jobs)
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='abs chapters', description='Render the chapter videos of a book')
+    parser.add_argument('bookname', help='Name of the book')
+    parser.add_argument('--chapter', type=int, nargs='+', default=None, help='Render only these chapter numbers, even if unchanged')
+    parser.add_argument('--list', action='store_true', help='List the chapters and their slides without rendering')
+    parser.add_argument('--workers', type=int, default=None, help='Chapters rendered at the same time (default chapter_workers)')
+    args = parser.parse_args(argv)
+
+    book = abs.open_book(args.bookname, interactive=False)
+    if book is None:
+        return False
+    if args.list:
+        for job in chapter_jobs(book):
+            start, end = (timeline.format_time(int(round(seconds * 1000))) for seconds in (job['start'], job['end']))
+            print(f"{job['number']:>4}  {start} - {end}  "
+                  f"{len(job['slides']):>5} slides {len(job['cues']):>6} subtitles  {job['title']}")
+        return True
+    return run(book, args.chapter, args.workers)
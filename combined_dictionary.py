@@ -2,10 +2,14 @@ import sys
 import re
 import argparse
 from tqdm import tqdm
-import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from collections import Counter
+from bisect import bisect_right
 import string
 
+import timeline
+
 # Function to preprocess words
 def preprocess_word(word):
     return word.lower(), word
@@ -25,106 +29,203 @@ def remove_trailing_punctuation(word):
 
 
 def process_file(csv_file, dictionary, speech_verbs, strict=1):
+    with open(csv_file, 'r', encoding='utf-8-sig') as infile:
+        return find_candidates(infile, dictionary, speech_verbs)
+
+def find_candidates(lines, dictionary, speech_verbs, first_line=1):
+    """The candidate names of process_file, in the order they first appear, from lines numbered from first_line."""
     unique_words = {}
     speech_verb_flags = {}
-    with open(csv_file, 'r', encoding='utf-8-sig') as infile:
-        for line_number, line in enumerate(infile, 1):
-            # Ignore lines that do not contain the expected tab separation (e.g., timestamps)
-            if '\t' in line:
-                _, text = line.split('\t', 1)
-                text = text.strip('"')
+    for line_number, line in enumerate(lines, first_line):
+        # Ignore lines that do not contain the expected tab separation (e.g., timestamps)
+        if '\t' in line:
+            _, text = line.split('\t', 1)
+            text = text.strip('"')
+        else:
+            continue  # Skip lines without proper format
+
+        words = text.split()
+        buffer = []
+        last_was_capitalized = False
+
+        for i, word in enumerate(words):
+            # Exclude words with apostrophes, digits, or internal punctuation
+            if "'" in word or word[0].isdigit() or any(c in string.punctuation for c in word.strip(string.punctuation)):
+                buffer = []
+                last_was_capitalized = False
+                continue
+
+            processed_word, original_word = preprocess_word(word)
+            cleaned_word = remove_trailing_punctuation(processed_word)
+
+            if word[0].isupper() and not is_part_in_dictionary(processed_word, dictionary) and not is_part_in_dictionary(cleaned_word, dictionary):
+                buffer.append(original_word)
+                last_was_capitalized = True
             else:
-                continue  # Skip lines without proper format
-
-            words = text.split()
-            buffer = []
-            last_was_capitalized = False
-
-            for i, word in enumerate(words):
-                # Exclude words with apostrophes, digits, or internal punctuation
-                if "'" in word or word[0].isdigit() or any(c in string.punctuation for c in word.strip(string.punctuation)):
-                    buffer = []
-                    last_was_capitalized = False
-                    continue
-
-                processed_word, original_word = preprocess_word(word)
-                cleaned_word = remove_trailing_punctuation(processed_word)
-
-                if word[0].isupper() and not is_part_in_dictionary(processed_word, dictionary) and not is_part_in_dictionary(cleaned_word, dictionary):
-                    buffer.append(original_word)
-                    last_was_capitalized = True
-                else:
-                    buffer = []
-                    last_was_capitalized = False
-                    continue  # Skip appending and reset for the next word
-
-                # Commit the buffer if the end of a sentence is reached or if followed by a speech verb
-                if buffer and (i == len(words) - 1 or words[i + 1].strip(",.?!") in speech_verbs):
-                    phrase = ' '.join(buffer)
-                    if phrase not in unique_words:
-                        unique_words[phrase] = line_number
-                        speech_verb_flags[phrase] = 0  # Keeping the speech_verb_flag logic, though it's not updated in this snippet
-                    buffer = []  # Clear the buffer for new accumulation
-                    last_was_capitalized = False
+                buffer = []
+                last_was_capitalized = False
+                continue  # Skip appending and reset for the next word
+
+            # Commit the buffer if the end of a sentence is reached or if followed by a speech verb
+            if buffer and (i == len(words) - 1 or words[i + 1].strip(",.?!") in speech_verbs):
+                phrase = ' '.join(buffer)
+                if phrase not in unique_words:
+                    unique_words[phrase] = line_number
+                    speech_verb_flags[phrase] = 0  # Keeping the speech_verb_flag logic, though it's not updated in this snippet
+                buffer = []  # Clear the buffer for new accumulation
+                last_was_capitalized = False
 
     return unique_words, speech_verb_flags
 
-def preprocess_counts(csv_file, unique_words, strict=0):
-    counts = Counter()
-    male_counts = Counter()
-    female_counts = Counter()
+# Lowercase letters that re.IGNORECASE also matches to an ASCII letter
+IGNORECASE_FOLD = str.maketrans({'\u0131': 'i', '\u017f': 's'})
+WORD = re.compile(r'\w+')
+
+def is_word_char(char):
+    """The \\w of re for str patterns."""
+    return char.isalnum() or char == '_'
+
+def find_word(text, term):
+    """Positions of re.finditer(r'\\b' + re.escape(term) + r'\\b', text) without a regex: str.find and a look at both ends."""
+    starts_word, ends_word = is_word_char(term[0]), is_word_char(term[-1])
+    position = text.find(term)
+    while position >= 0:
+        end = position + len(term)
+        if (position > 0 and is_word_char(text[position - 1])) != starts_word and \
+                (end < len(text) and is_word_char(text[end])) != ends_word:
+            yield position
+            position = text.find(term, end)
+        else:
+            position = text.find(term, position + 1)
+
+def count_word(text, term):
+    """len(re.findall(r'\\b' + re.escape(term) + r'\\b', text))."""
+    return sum(1 for _ in find_word(text, term))
+
+class TermCounter:
+    """
+    Counts every candidate term in a block of lines with the rules of the original, one regex per term and line
+    (preprocess_counts_per_term in benchmark_text.py), but reads the text once: words made only of word
+    characters are looked up in a count of all words of the text, other
+    terms are counted with str.find or str.count over the whole block instead of line by line. No term contains
+    a line break, so counting the joined lines gives the sum of the counts of the lines.
+    lines_with answers the other question of Step 7, which lines hold a term, from the same text.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.text = ''.join(lines)
+        self.lower = ''.join(line.lower() for line in lines)
+        self.words = None
+        self.folded = None
+        self.folded_words = None
+        self.word_lines = None
+        self.line_starts = None
+
+    def count(self, term, case_sensitive):
+        if ' ' in term:  # Multi-word terms are counted as plain substrings
+            return self.text.count(term) if case_sensitive else self.lower.count(term.lower())
+        pure_word = (term.replace('_', 'a')).isalnum()
+        if case_sensitive:
+            if pure_word:
+                if self.words is None:
+                    self.words = Counter(WORD.findall(self.text))
+                return self.words[term]
+            return count_word(self.text, term)
+        if not term.isascii():
+            # re.IGNORECASE has its own idea of case for these; let re do it
+            return len(re.findall(r'\b{}\b'.format(re.escape(term)), self.lower, re.IGNORECASE))
+        if self.folded is None:
+            self.folded = self.lower.translate(IGNORECASE_FOLD)
+        if pure_word:
+            if self.folded_words is None:
+                self.folded_words = Counter(WORD.findall(self.folded))
+            return self.folded_words[term.lower()]
+        return count_word(self.folded, term.lower())
+
+    def lines_with(self, term):
+        """
+        Numbers (from 1) of the lines where re.search(r'\\b' + re.escape(term) + r'\\b', line) matches: words
+        are looked up in an index of the lines of every word, other terms are found in the whole text.
+        """
+        if (term.replace('_', 'a')).isalnum():
+            if self.word_lines is None:
+                self.word_lines = {}
+                for number, line in enumerate(self.lines, 1):
+                    for word in set(WORD.findall(line)):
+                        self.word_lines.setdefault(word, []).append(number)
+            return self.word_lines.get(term, [])
+        if self.line_starts is None:
+            self.line_starts = [0]
+            for line in self.lines:
+                self.line_starts.append(self.line_starts[-1] + len(line))
+        numbers = []
+        for position in find_word(self.text, term):
+            number = bisect_right(self.line_starts, position)
+            if not numbers or numbers[-1] != number:
+                numbers.append(number)
+        return numbers
+
+def preprocess_counts(csv_file, unique_words, strict=0, term_lines=None):
+    """
+    Total, male and female counts of every term: how often it appears in the whole file, in the lines that
+    mention he or him, and in the lines that mention she or her. The file is read once and every term is
+    counted on the whole text; the per line original is kept in benchmark_text.py.
+    Given a term_lines dict, it is filled with the line numbers of every term for find_matches.
+    """
+    with open(csv_file, "r", newline="", encoding='utf-8-sig') as infile:
+        return count_terms(infile.readlines(), unique_words, strict, term_lines)
 
+def count_terms(lines, unique_words, strict=0, term_lines=None):
+    """preprocess_counts of a list of lines, read with newline=''."""
     male_pattern = re.compile(r'\b(?:he|him)\b')
     female_pattern = re.compile(r'\b(?:she|her)\b')
 
-    with open(csv_file, "r", newline="", encoding='utf-8-sig') as infile:
-        for line in infile:
-            contains_male = bool(male_pattern.search(line))
-            contains_female = bool(female_pattern.search(line))
-
-            # Normalize line for non-strict comparison
-            line_lower = line.lower()
-            for term in unique_words:
-                # Determine if term needs to be case-sensitive
-                term_to_count = term if strict and term[0].isupper() else term.lower()
-
-                if ' ' in term:  # Handle multi-word terms
-                    term_count = line.count(term) if strict and term[0].isupper() else line_lower.count(term.lower())
-                else:  # Handle single-word terms
-                    # Use regex to match whole words, considering strict flag for capitalization
-                    pattern = re.compile(r'\b{}\b'.format(re.escape(term)), re.IGNORECASE if not strict or not term[0].isupper() else 0)
-                    term_count = len(pattern.findall(line if strict and term[0].isupper() else line_lower))
-
-                counts[term] += term_count
-                if contains_male:
-                    male_counts[term] += term_count
-                if contains_female:
-                    female_counts[term] += term_count
-
-    top_terms = {term: (counts[term], male_counts[term], female_counts[term]) for term in unique_words if counts[term] > 0}
-
+    male_lines = [line for line in lines if male_pattern.search(line)]
+    female_lines = [line for line in lines if female_pattern.search(line)]
+
+    counters = [TermCounter(part) for part in (lines, male_lines, female_lines)]
+    top_terms = {}
+    for term in unique_words:
+        # Determine if term needs to be case-sensitive
+        case_sensitive = bool(strict and term[0].isupper())
+        term_counts = tuple(counter.count(term, case_sensitive) for counter in counters)
+        if term_counts[0] > 0:
+            top_terms[term] = term_counts
+        if term_lines is not None:
+            term_lines[term] = counters[0].lines_with(term)
     return top_terms
 
+def index_terms(csv_file, unique_words):
+    """The line numbers of every term, as preprocess_counts fills term_lines."""
+    with open(csv_file, "r", newline="", encoding='utf-8-sig') as infile:
+        counter = TermCounter(infile.readlines())
+    return {term: counter.lines_with(term) for term in unique_words}
 
-def find_matches(csv_file, unique_words, top_terms):
+def find_matches(csv_file, unique_words, top_terms, term_lines=None):
     """Finds matches for unique_words terms in the context of speech verbs and compiles associated counts.
-    Only includes the term with the smallest count for each timestamp."""
+    Only includes the term with the smallest count for each timestamp. The terms of a line come from term_lines,
+    the line numbers of every term (made by preprocess_counts, or here), instead of a regex per term and line."""
     matches = {}
     try:
+        if term_lines is None:
+            term_lines = index_terms(csv_file, unique_words)
+        # Inverted: the terms on each line, in the order of unique_words so that ties go to the same term
+        line_terms = {}
+        for term in unique_words:
+            for number in term_lines.get(term, ()):
+                line_terms.setdefault(number, []).append(term)
         with open(csv_file, "r", encoding='utf-8-sig') as infile:
             for line_number, line in enumerate(infile, 1):
-                timestamp_match = re.search(r"({ts=\d+})", line)
-                timestamp = timestamp_match.group(1) if timestamp_match else "unknown"
+                timestamp = timeline.find_tag(line)[0] or "unknown"
                 lowest_count_term = None
                 lowest_count = None
-                for term in unique_words:
-                    # Match terms based on their exact case
-                    if re.search(r'\b' + re.escape(term) + r'\b', line):
-                        count, male_count, female_count = top_terms.get(term, (0, 0, 0))
-                        # Update the term with the lowest count if this is the first term checked or if its count is lower than the current lowest
-                        if lowest_count is None or count < lowest_count:
-                            lowest_count_term = f"{term}_{count}_{male_count}_{female_count}"
-                            lowest_count = count
+                for term in line_terms.get(line_number, ()):
+                    count, male_count, female_count = top_terms.get(term, (0, 0, 0))
+                    # Update the term with the lowest count if this is the first term checked or if its count is lower than the current lowest
+                    if lowest_count is None or count < lowest_count:
+                        lowest_count_term = f"{term}_{count}_{male_count}_{female_count}"
+                        lowest_count = count
                 if lowest_count_term:  # If there's a term with the lowest count for this timestamp
                     matches[timestamp] = [lowest_count_term]
                 else:
@@ -134,7 +235,6 @@ def find_matches(csv_file, unique_words, top_terms):
         sys.exit(1)
     return matches
 
-
 def write_output(output_file, matches, top_terms):
     with open(output_file, 'w', encoding='utf-8') as file:
         for keyname, term_tuple_list in matches.items():
@@ -179,7 +279,144 @@ def write_output(output_file, matches, top_terms):
             file.write(output_line)
 
 
-import argparse
+def universal_newline(line):
+    """A line read with newline='' as it reads without, \r\n and \r turned into \n."""
+    if line.endswith('\r\n'):
+        return line[:-2] + '\n'
+    if line.endswith('\r'):
+        return line[:-1] + '\n'
+    return line
+
+def shard_candidates(lines, first_line, dictionary, speech_verbs):
+    return find_candidates([universal_newline(line) for line in lines], dictionary, speech_verbs, first_line)
+
+def shard_counts(lines, unique_words, strict):
+    term_lines = {}
+    counts = count_terms(lines, unique_words, strict, term_lines)
+    return counts, {term: numbers for term, numbers in term_lines.items() if numbers}
+
+def detect_sharded(csv_file, dictionary, speech_verbs, strict, workers):
+    """
+    process_file and preprocess_counts (with its term_lines) on a pool of workers processes, each over one range
+    of lines of csv_file. The shards are merged in file order: a candidate keeps its first line, counts are
+    summed and line numbers shifted and joined, so the results are the ones of the serial functions.
+    Returns (unique_words, speech_verb_flags, top_terms, term_lines).
+    """
+    with open(csv_file, "r", newline="", encoding='utf-8-sig') as infile:
+        lines = infile.readlines()
+    size = max(1, -(-len(lines) // workers))
+    firsts = list(range(0, len(lines), size))
+    shards = [lines[first:first + size] for first in firsts]
+
+    unique_words, speech_verb_flags = {}, {}
+    totals, term_lines = {}, {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for words, flags in pool.map(shard_candidates, shards, [first + 1 for first in firsts], repeat(dictionary), repeat(speech_verbs)):
+            for phrase, line_number in words.items():
+                if phrase not in unique_words:
+                    unique_words[phrase] = line_number
+                    speech_verb_flags[phrase] = flags[phrase]
+
+        for first, (counts, numbers) in zip(firsts, pool.map(shard_counts, shards, repeat(unique_words), repeat(strict))):
+            for term, term_counts in counts.items():
+                totals[term] = tuple(total + count for total, count in zip(totals.get(term, (0, 0, 0)), term_counts))
+            for term, shard_numbers in numbers.items():
+                term_lines.setdefault(term, []).extend(first + number for number in shard_numbers)
+
+    top_terms = {term: totals[term] for term in unique_words if term in totals}
+    return unique_words, speech_verb_flags, top_terms, term_lines
+
+def load_dictionary(dict_file):
+    """Reads the tokenizer_vocab_2.txt style dictionary; a missing file disables the dictionary check."""
+    try:
+        with open(dict_file, 'r') as file:
+            return {line.strip().lower() for line in file}
+    except FileNotFoundError:
+        print(f"No dictionary found ({dict_file}), skipping dictionary check.")
+        return set()  # Initialize dictionary as an empty set if file not found
+
+
+def run(dict_file, m300_file, csv_file, output_file, strict=1, workers=1):
+    """
+    Detects character names in csv_file (_ts.srt) and writes the _ts_p.srt character table. With workers > 1
+    the finding and counting of the names is shared out over that many processes, for very large books.
+    """
+    dictionary = load_dictionary(dict_file)
+
+    if workers > 1:
+        unique_words, speech_verb_flags, top_terms, term_lines = detect_sharded(csv_file, dictionary, SPEECH_VERBS, strict, workers)
+    else:
+        unique_words, speech_verb_flags = process_file(csv_file, dictionary, SPEECH_VERBS, strict)
+        #print(unique_words)
+        term_lines = {}
+        top_terms = preprocess_counts(csv_file, unique_words, strict, term_lines)
+    #print(top_terms)
+    matches = find_matches(csv_file, unique_words, top_terms, term_lines)
+    #print(matches)
+    write_output(output_file, matches, top_terms)
+    return True
+
+
+SPEECH_VERBS = [
+    "acknowledged", "added", "admitted", "advised", "affirmed", "agreed", "announced", "appeared", "argued", "asked",
+    "barely", "battling", "began", "begged", "believed", "boiled", "bounced", "bubbled", "burned", "buzzed",
+    "calculated", "called", "captured", "chopped", "claimed", "closed", "collapsed", "combined", "commanded", "concluded",
+    "confessed", "constricted", "continued", "countered", "covered", "crawled", "cried", "crossed", "crouched", "curled",
+    "dealt", "declared", "denied", "described", "desired", "desperately", "did", "died", "disagreed", "discouraged",
+    "dodged", "doubted", "dove", "drew", "dropped", "drove", "encouraged", "engulfed", "exclaimed", "explained",
+    "faced", "feared", "fell", "felt", "finds", "flew", "flexed", "flipped", "flowed", "flung",
+    "followed", "forgot", "formed", "fought", "found", "frowned", "furiously", "gave", "gestured", "glanced",
+    "got", "grabbed", "granted", "guessed", "had", "hesitated", "hit", "hoped", "hopped", "hung",
+    "indicated", "insisted", "intended", "interrupted", "invaded", "invited", "jerked", "jogged", "joined", "joked",
+    "jumped", "just", "keeps", "kept", "kicked", "killed", "knelt", "knew", "knocked", "lapped",
+    "lashed", "latched", "laughed", "lay", "leaned", "leapt", "left", "lifted", "liked", "looked",
+    "lost", "lowered", "lunged", "made", "maintained", "marked", "mentioned", "might", "motioned", "moved",
+    "murmured", "mused", "must", "narrated", "nodded", "noted", "noticed", "nudged", "objected", "offered",
+    "ordered", "peeled", "pieced", "placed", "planned", "plastered", "pleaded", "pointed", "pounded", "poured",
+    "promised", "protected", "protested", "pulled", "pushed", "put", "questioned", "raised", "ran", "rattled",
+    "reached", "realized", "reared", "recalled", "refused", "released", "relented", "remained", "remarked", "remembered",
+    "replied", "resisted", "responded", "retreated", "rippled", "rode", "rolled", "rose", "said", "sailed",
+    "sat", "saw", "scanned", "screamed", "sent", "set", "shifted", "shook", "shot", "shouted",
+    "simply", "slammed", "slapped", "slid", "slung", "smashed", "smiled", "sought", "spawned", "spilled",
+    "spotted", "sprawled", "spun", "squeezed", "staggered", "stared", "stated", "stayed", "stepped", "still", "stood",
+    "stopped", "strained", "stretched", "strode", "struggled", "studied", "stumbled", "suddenly", "suggested", "swirled",
+    "swooped", "swung", "teased", "thought", "thrashed", "threatened", "tickled", "tilted", "took", "tore",
+    "tossed", "trapped", "trickled", "tried", "trusted", "tugged", "tumbled", "turned", "twisted", "twitched",
+    "unfurled", "unspooled", "urged", "used", "walked", "wanted", "warned", "was", "watched", "whispered",
+    "widened", "wielded", "wished", "wondered", "wove", "wrapped", "wrenched", "writhed", "yanked", "here","is",
+    "accepted", "accompanied", "accomplished", "accounted", "accustomed", "activities", "acts", "address", "addressed", "advertised", "affected", "aided", "aids", "aligned", "alleged", "allotted",
+    "altered", "always", "answered", "anticipated", "appreciated", "appropriated", "approved", "armed", "assigned", "assisted", "assured", "attached", "attended", "attributed", "authorized",
+    "backhanded", "baked", "banks", "barred", "batted", "betrothed", "bleached", "bleed", "blessed", "blotted", "bobbed", "bothered", "bowed", "bragged", "branded", "bred",
+    "bridled", "bullshitted", "cantered", "capped", "challenged", "changed", "charged", "charted", "chipped", "chugged", "clapped", "clipped", "clubbed", "collected", "colored",
+    "committed", "compelled", "compensated", "completed", "compounded", "compressed", "concealed", "concurred", "conferred", "confined", "confirmed", "connected", "considered",
+    "consumed", "controlled", "convinced", "cooked", "corrected", "counted", "cropped", "crowded", "crowned", "cupped", "cured", "cursed", "dabbed", "damaged", "dated",
+    "deadpanned", "decided", "defeated", "defended", "deferred", "delighted", "delivered", "departed", "deserved", "detected", "determined", "developed", "devoted", "differentiated",
+    "digested", "dimmed", "dipped", "discharged", "disconnected", "discovered", "disguised", "dispelled", "disposed", "dissolved", "distracted", "disturbed", "divided",
+    "documented", "does", "donned", "dragged", "dreamed", "dripped", "drummed", "drys", "dunned", "earned", "eavesdropped", "edited", "educated", "embedded", "emitted", "equipped",
+    "excelled", "excess", "excused", "experiences", "explored", "exposed", "expressed", "fanned", "fed", "feed", "feigned", "fielded", "fields", "filings", "filled", "filtered",
+    "finished", "fitted", "fixed", "flagged", "flapped", "flitted", "flopped", "fluxed", "focused", "forced", "formatted", "founded", "framed", "frequented", "fretted", "fulfilled",
+    "furnished", "gagged", "glued", "goes", "graded", "grinned", "gritted", "grovelled", "guarded", "guided", "gunned", "gutted", "hammed", "handed", "hardened", "harmed",
+    "harness", "harvested", "hatched", "healed", "heated", "heed", "heeded", "heralded", "hiss", "hugged", "hummed", "hurried", "identified", "implemented", "impressed",
+    "improved", "incorporated", "influenced", "informed", "inhabited", "initiated", "injured", "inspired", "instructed", "interested", "interpreted", "involved", "jabbed", "jammed",
+    "jared", "jotted", "kidnapped", "kiss", "knitted", "knotted", "labeled", "lagged", "laughs", "layered", "lettered", "licensed", "lied", "lighted", "limited", "lined", "listed",
+    "lobbed", "logged", "loved", "lugged", "mapped", "marks", "married", "masters", "matched", "measured", "merited", "mimicked", "minded", "missed", "mixed", "modified",
+    "moped", "mopped", "motivated", "mounted", "mourned", "mouths", "nagged", "named", "needed", "nipped", "numbered", "observed", "occupied", "opened", "opposed",
+    "organized", "padded", "painted", "paired", "panicked", "paralleled", "parks", "patted", "paved", "payed", "pegged", "penned", "perceived", "performed", "permitted", "persuaded",
+    "petted", "pinned", "plodded", "plopped", "plotted", "plugged", "popped", "populated", "positioned", "possess", "potted", "practiced", "precious", "preferred", "prepared", "prepped", "pressed",
+    "prized", "proceed", "proceeds", "processed", "professed", "programmed", "prompted", "propelled", "propped", "proved", "provided", "punished", "purported", "qualified", "quested",
+    "quipped", "quizzed", "ragged", "rammed", "rapped", "rated", "ratted", "recognized", "reconstructed", "recorded", "referred", "reformed", "regards", "registered", "regretted",
+    "repeated", "reported", "represented", "reserved", "resigned", "resolved", "restrained", "restricted", "revealed", "revved", "rewarded", "rigged", "ripped", "rivaled",
+    "robbed", "rotted", "rubbed", "ruffled", "sacred", "sagged", "salted", "sapped", "satisfied", "saved", "scammed", "scarred", "scented", "schooled", "scratched", "scripted",
+    "scrubbed", "seasoned", "sectioned", "secured", "segmented", "shaped", "shed", "shields", "shipped", "shred", "shredded", "shrugged", "shucks", "sidestepped", "sifted",
+    "sighs", "signed", "sipped", "skidded", "skimmed", "skipped", "sled", "slipped", "slotted", "slurred", "smooths", "snagged", "snapped", "snipped", "sobbed", "soiled",
+    "solved", "sorted", "spanned", "sparred", "spears", "specified", "sped", "speed", "spirited", "splatted", "spoiled", "spurred", "squatted", "stabbed", "stained", "states", "stirred",
+    "stomachs", "strapped", "stressed", "stripped", "strutted", "stunned", "submitted", "substantiated", "succeed", "summons", "supported", "supposed", "suppressed", "suspected",
+    "swabbed", "swapped", "swatted", "swayed", "swigged", "tagged", "tamed", "tapped", "tarnished", "tarred", "tasted", "tended", "tested", "texted", "throbbed", "thudded",
+    "tipped", "topped", "toss", "touched", "trafficked", "trained", "transferred", "translated", "transmitted", "traveled", "treated", "trekked", "trialed", "tripped", "triumphs", "trotted",
+    "tutored", "tutted", "varnished", "verified", "versioned", "viced", "voiced", "wadded", "wagged", "warranted", "warred", "washed", "weighs", "weighted", "whipped",
+    "whirred", "whizzed", "winded", "witness", "works", "worms", "worried", "wrinkled", "yaws", "yeahs", "zigzagged", "zipped"
+]
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process some files.')
@@ -188,89 +425,8 @@ if __name__ == "__main__":
     parser.add_argument('csv_file', help='_ts.srt m300 with timestamps input file')
     parser.add_argument('output_file', help='_ts_p.srt Output file')
     parser.add_argument('--strict', type=int, choices=[0, 1], default=1, help='Strict mode (default: 1)')
+    parser.add_argument('--workers', type=int, default=1, help='Processes to share the lines over (default: 1)')
 
     args = parser.parse_args()
 
-    # Attempt to read the dictionary file
-    try:
-        with open(args.dict_file, 'r') as file:
-            dictionary = {line.strip().lower() for line in file}
-    except FileNotFoundError:
-        print(f"No dictionary found ({args.dict_file}), skipping dictionary check.")
-        dictionary = set()  # Initialize dictionary as an empty set if file not found
-
-    m300_file = args.m300_file
-    csv_file = args.csv_file
-    output_file = args.output_file
-    strict = args.strict
-
-    speech_verbs = [
-        "acknowledged", "added", "admitted", "advised", "affirmed", "agreed", "announced", "appeared", "argued", "asked",
-        "barely", "battling", "began", "begged", "believed", "boiled", "bounced", "bubbled", "burned", "buzzed",
-        "calculated", "called", "captured", "chopped", "claimed", "closed", "collapsed", "combined", "commanded", "concluded",
-        "confessed", "constricted", "continued", "countered", "covered", "crawled", "cried", "crossed", "crouched", "curled",
-        "dealt", "declared", "denied", "described", "desired", "desperately", "did", "died", "disagreed", "discouraged",
-        "dodged", "doubted", "dove", "drew", "dropped", "drove", "encouraged", "engulfed", "exclaimed", "explained",
-        "faced", "feared", "fell", "felt", "finds", "flew", "flexed", "flipped", "flowed", "flung",
-        "followed", "forgot", "formed", "fought", "found", "frowned", "furiously", "gave", "gestured", "glanced",
-        "got", "grabbed", "granted", "guessed", "had", "hesitated", "hit", "hoped", "hopped", "hung",
-        "indicated", "insisted", "intended", "interrupted", "invaded", "invited", "jerked", "jogged", "joined", "joked",
-        "jumped", "just", "keeps", "kept", "kicked", "killed", "knelt", "knew", "knocked", "lapped",
-        "lashed", "latched", "laughed", "lay", "leaned", "leapt", "left", "lifted", "liked", "looked",
-        "lost", "lowered", "lunged", "made", "maintained", "marked", "mentioned", "might", "motioned", "moved",
-        "murmured", "mused", "must", "narrated", "nodded", "noted", "noticed", "nudged", "objected", "offered",
-        "ordered", "peeled", "pieced", "placed", "planned", "plastered", "pleaded", "pointed", "pounded", "poured",
-        "promised", "protected", "protested", "pulled", "pushed", "put", "questioned", "raised", "ran", "rattled",
-        "reached", "realized", "reared", "recalled", "refused", "released", "relented", "remained", "remarked", "remembered",
-        "replied", "resisted", "responded", "retreated", "rippled", "rode", "rolled", "rose", "said", "sailed",
-        "sat", "saw", "scanned", "screamed", "sent", "set", "shifted", "shook", "shot", "shouted",
-        "simply", "slammed", "slapped", "slid", "slung", "smashed", "smiled", "sought", "spawned", "spilled",
-        "spotted", "sprawled", "spun", "squeezed", "staggered", "stared", "stated", "stayed", "stepped", "still", "stood",
-        "stopped", "strained", "stretched", "strode", "struggled", "studied", "stumbled", "suddenly", "suggested", "swirled",
-        "swooped", "swung", "teased", "thought", "thrashed", "threatened", "tickled", "tilted", "took", "tore",
-        "tossed", "trapped", "trickled", "tried", "trusted", "tugged", "tumbled", "turned", "twisted", "twitched",
-        "unfurled", "unspooled", "urged", "used", "walked", "wanted", "warned", "was", "watched", "whispered",
-        "widened", "wielded", "wished", "wondered", "wove", "wrapped", "wrenched", "writhed", "yanked", "here","is",
-        "accepted", "accompanied", "accomplished", "accounted", "accustomed", "activities", "acts", "address", "addressed", "advertised", "affected", "aided", "aids", "aligned", "alleged", "allotted",
-        "altered", "always", "answered", "anticipated", "appreciated", "appropriated", "approved", "armed", "assigned", "assisted", "assured", "attached", "attended", "attributed", "authorized",
-        "backhanded", "baked", "banks", "barred", "batted", "betrothed", "bleached", "bleed", "blessed", "blotted", "bobbed", "bothered", "bowed", "bragged", "branded", "bred",
-        "bridled", "bullshitted", "cantered", "capped", "challenged", "changed", "charged", "charted", "chipped", "chugged", "clapped", "clipped", "clubbed", "collected", "colored",
-        "committed", "compelled", "compensated", "completed", "compounded", "compressed", "concealed", "concurred", "conferred", "confined", "confirmed", "connected", "considered",
-        "consumed", "controlled", "convinced", "cooked", "corrected", "counted", "cropped", "crowded", "crowned", "cupped", "cured", "cursed", "dabbed", "damaged", "dated",
-        "deadpanned", "decided", "defeated", "defended", "deferred", "delighted", "delivered", "departed", "deserved", "detected", "determined", "developed", "devoted", "differentiated",
-        "digested", "dimmed", "dipped", "discharged", "disconnected", "discovered", "disguised", "dispelled", "disposed", "dissolved", "distracted", "disturbed", "divided",
-        "documented", "does", "donned", "dragged", "dreamed", "dripped", "drummed", "drys", "dunned", "earned", "eavesdropped", "edited", "educated", "embedded", "emitted", "equipped",
-        "excelled", "excess", "excused", "experiences", "explored", "exposed", "expressed", "fanned", "fed", "feed", "feigned", "fielded", "fields", "filings", "filled", "filtered",
-        "finished", "fitted", "fixed", "flagged", "flapped", "flitted", "flopped", "fluxed", "focused", "forced", "formatted", "founded", "framed", "frequented", "fretted", "fulfilled",
-        "furnished", "gagged", "glued", "goes", "graded", "grinned", "gritted", "grovelled", "guarded", "guided", "gunned", "gutted", "hammed", "handed", "hardened", "harmed",
-        "harness", "harvested", "hatched", "healed", "heated", "heed", "heeded", "heralded", "hiss", "hugged", "hummed", "hurried", "identified", "implemented", "impressed",
-        "improved", "incorporated", "influenced", "informed", "inhabited", "initiated", "injured", "inspired", "instructed", "interested", "interpreted", "involved", "jabbed", "jammed",
-        "jared", "jotted", "kidnapped", "kiss", "knitted", "knotted", "labeled", "lagged", "laughs", "layered", "lettered", "licensed", "lied", "lighted", "limited", "lined", "listed",
-        "lobbed", "logged", "loved", "lugged", "mapped", "marks", "married", "masters", "matched", "measured", "merited", "mimicked", "minded", "missed", "mixed", "modified",
-        "moped", "mopped", "motivated", "mounted", "mourned", "mouths", "nagged", "named", "needed", "nipped", "numbered", "observed", "occupied", "opened", "opposed",
-        "organized", "padded", "painted", "paired", "panicked", "paralleled", "parks", "patted", "paved", "payed", "pegged", "penned", "perceived", "performed", "permitted", "persuaded",
-        "petted", "pinned", "plodded", "plopped", "plotted", "plugged", "popped", "populated", "positioned", "possess", "potted", "practiced", "precious", "preferred", "prepared", "prepped", "pressed",
-        "prized", "proceed", "proceeds", "processed", "professed", "programmed", "prompted", "propelled", "propped", "proved", "provided", "punished", "purported", "qualified", "quested",
-        "quipped", "quizzed", "ragged", "rammed", "rapped", "rated", "ratted", "recognized", "reconstructed", "recorded", "referred", "reformed", "regards", "registered", "regretted",
-        "repeated", "reported", "represented", "reserved", "resigned", "resolved", "restrained", "restricted", "revealed", "revved", "rewarded", "rigged", "ripped", "rivaled",
-        "robbed", "rotted", "rubbed", "ruffled", "sacred", "sagged", "salted", "sapped", "satisfied", "saved", "scammed", "scarred", "scented", "schooled", "scratched", "scripted",
-        "scrubbed", "seasoned", "sectioned", "secured", "segmented", "shaped", "shed", "shields", "shipped", "shred", "shredded", "shrugged", "shucks", "sidestepped", "sifted",
-        "sighs", "signed", "sipped", "skidded", "skimmed", "skipped", "sled", "slipped", "slotted", "slurred", "smooths", "snagged", "snapped", "snipped", "sobbed", "soiled",
-        "solved", "sorted", "spanned", "sparred", "spears", "specified", "sped", "speed", "spirited", "splatted", "spoiled", "spurred", "squatted", "stabbed", "stained", "states", "stirred",
-        "stomachs", "strapped", "stressed", "stripped", "strutted", "stunned", "submitted", "substantiated", "succeed", "summons", "supported", "supposed", "suppressed", "suspected",
-        "swabbed", "swapped", "swatted", "swayed", "swigged", "tagged", "tamed", "tapped", "tarnished", "tarred", "tasted", "tended", "tested", "texted", "throbbed", "thudded",
-        "tipped", "topped", "toss", "touched", "trafficked", "trained", "transferred", "translated", "transmitted", "traveled", "treated", "trekked", "trialed", "tripped", "triumphs", "trotted",
-        "tutored", "tutted", "varnished", "verified", "versioned", "viced", "voiced", "wadded", "wagged", "warranted", "warred", "washed", "weighs", "weighted", "whipped",
-        "whirred", "whizzed", "winded", "witness", "works", "worms", "worried", "wrinkled", "yaws", "yeahs", "zigzagged", "zipped"
-    ]
-
-    unique_words, speech_verb_flags = process_file(csv_file, dictionary, speech_verbs, strict)
-    #print(unique_words)
-    top_terms = preprocess_counts(csv_file, unique_words, strict)
-    #print(top_terms)
-    matches = find_matches(csv_file, unique_words, top_terms)
-    #print(matches)
-    write_output(output_file, matches, top_terms)
-
-
-
+    run(args.dict_file, args.m300_file, args.csv_file, args.output_file, args.strict, args.workers)
@@ -1,11 +1,14 @@
 import sys
 import openai
 import csv
-import re
 import os
 from joblib import Parallel, delayed
 import time
 
+import api_limit
+import ledger
+import timeline
+
 def generate_response(prompt, api_key):
     openai.api_key = api_key
     max_retries = 5
@@ -13,13 +16,14 @@ def generate_response(prompt, api_key):
 
     for attempt in range(max_retries):
         try:
-            response = openai.Completion.create(
-                model="gpt-3.5-turbo-instruct-0914",
-                prompt=prompt,
-                temperature=0,
-                max_tokens=250
-            )
-            return response.choices[0].text.strip()
+            with api_limit.slots:
+                response = openai.Completion.create(
+                    model="gpt-3.5-turbo-instruct-0914",
+                    prompt=prompt,
+                    temperature=0,
+                    max_tokens=250
+                )
+            return response.choices[0].text.strip(), ledger.response_tokens(response)
         except openai.error.RateLimitError as e:
             if attempt < max_retries - 1:
                 time.sleep(retry_delay)
@@ -29,20 +33,21 @@ def generate_response(prompt, api_key):
 
 def generate_response(prompt, api_key):
     openai.api_key = api_key
-    response = openai.Completion.create(
-        model="gpt-3.5-turbo-instruct-0914",
-        prompt=prompt,
-        temperature=0,
-        max_tokens=250
-    )
-    return response.choices[0].text.strip()
+    with api_limit.slots:
+        response = openai.Completion.create(
+            model="gpt-3.5-turbo-instruct-0914",
+            prompt=prompt,
+            temperature=0,
+            max_tokens=250
+        )
+    return response.choices[0].text.strip(), ledger.response_tokens(response)
 
 def process_line(line, idx, total, api_key, default_scene):
-    timestamp_match = re.search(r"({ts=\d+})", line)
-    if timestamp_match:
-        timestamp = timestamp_match.group(1)
+    timestamp, _ = timeline.find_tag(line)
+    if timestamp:
         user_query = line.replace(timestamp, "").strip().replace("\n", "\\n")
 
+        tokens = 0
         if not api_key:
             # Simply return the original script line without extra formatting
             response = user_query
@@ -52,7 +57,7 @@ def process_line(line, idx, total, api_key, default_scene):
                 + default_scene + "\n\n" + user_query
             )
             prompt = f"{system_message}"
-            response = generate_response(prompt, api_key)
+            response, tokens = generate_response(prompt, api_key)
 
             # Update default scene if new scene is described.
             if "Default Scene=" not in response:
@@ -69,9 +74,9 @@ def process_line(line, idx, total, api_key, default_scene):
                 sys.stdout.write('.')
                 sys.stdout.flush()
 
-        return result_line
+        return result_line, tokens
 
-    return None
+    return None, 0
 
 
 def main(input_file, output_file, api_key):
@@ -82,16 +87,19 @@ def main(input_file, output_file, api_key):
 
     default_scene = "[((Default View=A warm intimate recording studio with state-of-the-art equipment, soundproofing panels, large clear windows, a cozy narrator's booth bathed in soft light.))]"
     results = []
+    tokens = 0
 
     if api_key:
         # Use parallel processing when API key is available
         sys.stdout.write('[' + ' ' * 100 + ']\r[')  # Initialize progress bar for parallel processing
-        results = Parallel(n_jobs=5)(delayed(process_line)(line, idx, total_lines, api_key, "") for idx, line in enumerate(lines))
+        responses = Parallel(n_jobs=5, prefer='threads')(delayed(process_line)(line, idx, total_lines, api_key, "") for idx, line in enumerate(lines))
+        results = [result for result, _ in responses]
+        tokens = sum(line_tokens for _, line_tokens in responses)
         sys.stdout.write('\n')  # Move to the next line after progress bar completion
     else:
         # Process lines sequentially without API key
         for idx, line in enumerate(lines):
-            result = process_line(line, idx, total_lines, api_key, "")
+            result, _ = process_line(line, idx, total_lines, api_key, "")
             if result:
                 results.append(result)
 
@@ -106,6 +114,11 @@ def main(input_file, output_file, api_key):
             if result_line:
                 corrected_result_line = [element.replace('\t', '') for element in result_line]
                 writer.writerow(corrected_result_line)
+    return tokens
+
+def run(input_file, output_file, api_key=None):
+    """Returns the GPT usage for the run ledger, {'llm_tokens': n}."""
+    return {'llm_tokens': main(input_file, output_file, api_key)}
 
 if __name__ == "__main__":
     if len(sys.argv) != 3:
@@ -0,0 +1,176 @@
+import os
+import time
+import logging
+import threading
+import subprocess
+
+try:
+    import fcntl
+except ImportError:  # Windows: the job limit holds within one abs process only
+    fcntl = None
+
+# Every ffmpeg and ffprobe run of the pipeline goes through run(). It takes argument lists (no shell), reads
+# -progress pipe:1 into progress events, stops jobs that run too long, stall or are cancelled, and holds one of
+# a fixed number of job slots while ffmpeg runs. The slots are lock files in books/.abs_ffmpeg, so the limit
+# holds for all abs processes on a machine (batch workers, abs watch and a second abs run alike).
+
+SLOT_FOLDER = os.path.join('books', '.abs_ffmpeg')
+# Defaults, set for child processes too by configure()
+MAX_JOBS = int(os.environ.get('ABS_FFMPEG_JOBS') or max(2, (os.cpu_count() or 4) // 2))
+TIMEOUT_SECONDS = float(os.environ.get('ABS_FFMPEG_TIMEOUT') or 0)
+STALL_SECONDS = float(os.environ.get('ABS_FFMPEG_STALL') or 600)
+# Seconds between the progress lines logged for a long job
+LOG_SECONDS = 60
+
+local_slots = threading.BoundedSemaphore(MAX_JOBS)
+running = set()
+running_lock = threading.Lock()
+cancel_event = threading.Event()
+
+def configure(config):
+    """Sets the job limit and time limits from the ffmpeg_* keys of a book or the default config."""
+    global MAX_JOBS, TIMEOUT_SECONDS, STALL_SECONDS, local_slots
+    MAX_JOBS = int(config.get('ffmpeg_jobs') or MAX_JOBS)
+    TIMEOUT_SECONDS = float(config.get('ffmpeg_timeout_minutes') or 0) * 60
+    STALL_SECONDS = float(config.get('ffmpeg_stall_minutes') or 0) * 60
+    local_slots = threading.BoundedSemaphore(MAX_JOBS)
+    os.environ['ABS_FFMPEG_JOBS'] = str(MAX_JOBS)
+    os.environ['ABS_FFMPEG_TIMEOUT'] = str(TIMEOUT_SECONDS)
+    os.environ['ABS_FFMPEG_STALL'] = str(STALL_SECONDS)
+
+class Slot:
+    """One of MAX_JOBS ffmpeg job slots; waits until one is free."""
+
+    def __enter__(self):
+        if fcntl is None:
+            local_slots.acquire()
+            self.file = None
+            return self
+        os.makedirs(SLOT_FOLDER, exist_ok=True)
+        while True:
+            for number in range(MAX_JOBS):
+                file = open(os.path.join(SLOT_FOLDER, f"slot_{number}.lock"), 'a')
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self.file = file
+                    return self
+                except OSError:
+                    file.close()
+            time.sleep(0.2)
+
+    def __exit__(self, *exc):
+        if self.file is None:
+            local_slots.release()
+        else:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+
+def cancel_all():
+    """Stops every running ffmpeg job of this process and makes new ones fail at once."""
+    cancel_event.set()
+    with running_lock:
+        for process in list(running):
+            process.kill()
+
+def parse_progress(lines):
+    """One progress event from the key=value lines ffmpeg writes for -progress, eg. {'out_time_ms': 1500000, ...}."""
+    event = {}
+    for line in lines:
+        key, _, value = line.partition('=')
+        value = value.strip()
+        if key in ('frame', 'out_time_us', 'out_time_ms', 'total_size'):
+            event[key] = int(value) if value.lstrip('-').isdigit() else None
+        elif key in ('fps', 'bitrate', 'speed', 'out_time', 'progress'):
+            event[key] = value
+    if event.get('out_time_us') is not None:
+        event['seconds'] = event['out_time_us'] / 1000000
+    return event
+
+def log_progress(description):
+    """A progress callback that logs how far a long job got every LOG_SECONDS."""
+    last = [time.time()]
+
+    def report(event):
+        if time.time() - last[0] >= LOG_SECONDS and event.get('out_time'):
+            last[0] = time.time()
+            logging.info("%s: %s done, speed %s", description, event['out_time'].split('.')[0], event.get('speed'))
+    return report
+
+def read_lines(stream, lines):
+    for line in iter(stream.readline, ''):
+        lines.append(line)
+    stream.close()
+
+def run(command, progress=None, timeout=None, cancel=None, description=None):
+    """
+    Runs an ffmpeg or ffprobe argument list in a job slot and returns a subprocess.CompletedProcess with the
+    output as text. progress is called with every progress event of ffmpeg. The job is killed when it runs
+    longer than timeout (default TIMEOUT_SECONDS), writes no progress for STALL_SECONDS, or when cancel (a
+    threading.Event) or cancel_all() is set; its returncode is then negative.
+    """
+    description = description or os.path.basename(command[0])
+    use_progress = os.path.basename(command[0]).startswith('ffmpeg')
+    if use_progress:
+        command = [command[0], '-progress', 'pipe:1', '-nostats'] + list(command[1:])
+        progress = progress or log_progress(description)
+    timeout = TIMEOUT_SECONDS if timeout is None else timeout
+
+    stdout_lines, stderr_lines = [], []
+    with Slot():
+        if cancel_event.is_set() or (cancel is not None and cancel.is_set()):
+            return subprocess.CompletedProcess(command, -1, '', 'cancelled before start')
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True, encoding='utf-8', errors='replace')
+        with running_lock:
+            running.add(process)
+        readers = [threading.Thread(target=read_lines, args=(process.stdout, stdout_lines), daemon=True),
+                   threading.Thread(target=read_lines, args=(process.stderr, stderr_lines), daemon=True)]
+        for reader in readers:
+            reader.start()
+
+        started = last_progress = time.time()
+        seen = 0
+        stopped = None
+        while process.poll() is None:
+            time.sleep(0.1)
+            if use_progress:
+                # A progress event ends with a progress=continue or progress=end line
+                ends = [i for i in range(seen, len(stdout_lines)) if stdout_lines[i].startswith('progress=')]
+                for end in ends:
+                    progress(parse_progress(stdout_lines[seen:end + 1]))
+                    seen = end + 1
+                    last_progress = time.time()
+            now = time.time()
+            if cancel_event.is_set() or (cancel is not None and cancel.is_set()):
+                stopped = 'cancelled'
+            elif timeout and now - started > timeout:
+                stopped = f"timed out after {timeout / 60:.0f} minutes"
+            elif use_progress and STALL_SECONDS and now - last_progress > STALL_SECONDS:
+                stopped = f"made no progress for {STALL_SECONDS / 60:.0f} minutes"
+            if stopped:
+                process.kill()
+                process.wait()
+                break
+        for reader in readers:
+            reader.join()
+        with running_lock:
+            running.discard(process)
+
+    stdout = ''.join(stdout_lines)
+    if use_progress:
+        # Leave only what ffmpeg itself wrote to stdout
+        stdout = ''.join(line for line in stdout_lines[seen:] if '=' not in line)
+    if stopped:
+        logging.error("%s %s: %s", description, stopped, subprocess.list2cmdline(command))
+        return subprocess.CompletedProcess(command, process.returncode if process.returncode < 0 else -1,
+                                           stdout, ''.join(stderr_lines))
+    return subprocess.CompletedProcess(command, process.returncode, stdout, ''.join(stderr_lines))
+
+def call(command, description=None, progress=None, timeout=None, cancel=None):
+    """Runs a command like run() and logs it; returns True if ffmpeg succeeded. For encodes and muxes."""
+    logging.info("Executing command: %s", subprocess.list2cmdline(command))
+    result = run(command, progress, timeout, cancel, description)
+    if result.returncode != 0:
+        logging.error("Command failed with code %s: %s", result.returncode, result.stderr.strip()[-2000:])
+        return False
+    return True
@@ -1,99 +1,103 @@
 import os
 import sys
 import re
-import tempfile
-import shutil
+
+import make_prompts
+import timeline
+
+SENTENCE_END = re.compile(r"[.?!\"]\s*$")
+FIRST_START = '00:00:00,000'
 
 def preprocess_text(text):
     """ Appends a period to the end of text if it does not end with sentence-ending punctuation. """
-    if text and not re.search(r"[.?!\"]\s*$", text):
+    if text and not SENTENCE_END.search(text):
         return text + '.'
     return text
 
-def process_pass(input_file, output_file, char_limit):
-    with open(input_file, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-
-    # Correct the first timestamp if needed
-    # Search for the first occurrence of "-->" at position 14
-    for i, line in enumerate(lines):
-        if line.strip().find("-->") == 13:  # 13 because indexing starts at 0
-            start_time, end_time = line.split(' --> ')
-            if start_time != '00:00:00,000':
-                lines[i] = '00:00:00,000 --> ' + end_time + '\n'
-            break
-
-    new_lines = []
-    buffer_line = ""
-    buffer_start_time = ""
-    buffer_end_time = ""
-    current_index = 1
-    combined_any = False
-
-    for i in range(0, len(lines) - 3, 4):
-        index_line = lines[i].strip()
-        time_line = lines[i + 1].strip()
-        text_line = lines[i + 2].strip()
-
-        # Apply preprocessing only to text lines
-        preprocessed_text_line = preprocess_text(text_line)
-
-        if not buffer_line:  # If buffer is empty, set the start time
-            buffer_start_time = time_line.split('-->')[0].strip()
-
-        if buffer_line and len(buffer_line + ' ' + preprocessed_text_line) <= char_limit:
+
+class JoinLevel:
+    """
+    One pass of the original joiner (process_pass in benchmark_text.py) over a stream of cues. Each level that
+    joins a pair feeds its output to a new level, like the next pass, so the whole fixed point is reached in one
+    pass over the input. Times are the .srt text, as process_pass copies them; they are never parsed.
+    """
+
+    def __init__(self, char_limit, first_level=True):
+        self.char_limit = char_limit
+        # Text a level emits already ends with punctuation, so only the first level needs preprocess_text
+        self.preprocess = first_level
+        self.next_level = None
+        self.held = []  # output of this level while it has joined nothing
+        self.combined_any = False
+        self.first_cue = True
+        self.buffer_line = ""
+        self.buffer_start_time = FIRST_START
+        self.buffer_end_time = FIRST_START
+
+    def emit(self, start_time, end_time, text):
+        # The next pass reads the written line back stripped
+        if self.next_level is not None:
+            self.next_level.push(start_time, end_time, text.strip())
+        else:
+            self.held.append((start_time, end_time, text.strip()))
+
+    def push(self, start_time, end_time, text_line):
+        if self.first_cue:
+            # Every pass starts its first timestamp at 00:00:00,000
+            self.first_cue = False
+            start_time = FIRST_START
+        preprocessed_text_line = preprocess_text(text_line) if self.preprocess else text_line
+        if not self.buffer_line:
+            self.buffer_start_time = start_time
+
+        if self.buffer_line and len(self.buffer_line) + 1 + len(preprocessed_text_line) <= self.char_limit:
             # Combine lines
-            buffer_end_time = time_line.split('-->')[1].strip()
-            combined_time = f"{buffer_start_time} --> {buffer_end_time}"
-            new_lines.append(f"{current_index}\n{combined_time}\n{buffer_line} {preprocessed_text_line}\n\n")
-            current_index += 1
-            buffer_line = ""  # Clear the buffer after combining
-            combined_any = True
+            if not self.combined_any:
+                # This pass changes something, so there is a next pass: replay what this one wrote so far
+                self.combined_any = True
+                self.next_level = JoinLevel(self.char_limit, first_level=False)
+                for cue in self.held:
+                    self.next_level.push(*cue)
+                self.held = []
+            self.emit(self.buffer_start_time, end_time, f"{self.buffer_line} {preprocessed_text_line}")
+            self.buffer_line = ""
         else:
-            if buffer_line:
-                # Add buffered line as is
-                buffer_end_time = buffer_time.split('-->')[1].strip()
-                combined_time = f"{buffer_start_time} --> {buffer_end_time}"
-                new_lines.append(f"{current_index}\n{combined_time}\n{buffer_line}\n\n")
-                current_index += 1
-
-            buffer_line = preprocessed_text_line
-            buffer_start_time = time_line.split('-->')[0].strip()
-            buffer_end_time = time_line.split('-->')[1].strip()
-            buffer_time = time_line
-
-    # Add the last buffered line if it exists
-    if buffer_line:
-        combined_time = f"{buffer_start_time} --> {buffer_end_time}"
-        new_lines.append(f"{current_index}\n{combined_time}\n{buffer_line}\n\n")
-
-    with open(output_file, 'w', encoding='utf-8') as file:
-        file.writelines(new_lines)
-
-    return combined_any
-
-
-def join_subtitles(input_file, output_file, char_limit):
-	with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.srt', encoding='utf-8') as temp:
-		temp_file = temp.name
-		combined_any = process_pass(input_file, temp_file, char_limit)
-
-		while combined_any:
-			combined_any = process_pass(temp_file, temp_file, char_limit)
-
-		# Rewind the temporary file to read its content
-		temp.seek(0)
-		final_content = temp.readlines()
-
-	# Copy the final output to the desired output file
-	with open(output_file, 'w', encoding='utf-8') as file:
-		file.writelines(final_content)
-
-	# Remove the temporary file
-	try:
-		os.remove(temp_file)
-	except OSError as e:
-		print(f"Error: {e.filename} - {e.strerror}.")
+            if self.buffer_line:
+                self.emit(self.buffer_start_time, self.buffer_end_time, self.buffer_line)
+            self.buffer_line = preprocessed_text_line
+            self.buffer_start_time = start_time
+            self.buffer_end_time = end_time
+
+    def finish(self):
+        """Ends the input of this level and of the levels after it; returns the cues of the last level."""
+        if self.buffer_line:
+            self.emit(self.buffer_start_time, self.buffer_end_time, self.buffer_line)
+            self.buffer_line = ""
+        return self.next_level.finish() if self.next_level is not None else self.held
+
+def join_cues(cues, char_limit):
+    first_level = JoinLevel(char_limit)
+    for cue in cues:
+        first_level.push(*cue)
+    return first_level.finish()
+
+def join_subtitles(input_file, output_file, char_limit, ts_file=None):
+    """
+    Joins the cues of input_file up to char_limit characters in a single pass over the cues as they are read,
+    with the same result as repeating process_pass until nothing joins (join_subtitles_passes, kept in
+    benchmark_text.py). A cue with several text lines is joined into one line. With ts_file, the prompt table of
+    make_prompts.py is written too.
+    """
+    cues = ((start, end, text.replace('\n', ' ')) for start, end, text in timeline.read_srt(input_file, parse_times=False))
+    if ts_file:
+        make_prompts.write_with_table(join_cues(cues, char_limit), output_file, ts_file)
+    else:
+        timeline.write_srt(output_file, join_cues(cues, char_limit))
+
+def run(input_file, output_file, char_limit=300, ts_file=None):
+    """ Joins subtitle cues in input_file into cues of up to char_limit characters, and writes ts_file if given. """
+    join_subtitles(input_file, output_file, char_limit, ts_file)
+    return os.path.exists(output_file) and (not ts_file or os.path.exists(ts_file))
 
 def main():
     if len(sys.argv) < 5 or sys.argv[1] != '-join':
@@ -104,7 +108,7 @@ def main():
     input_file = sys.argv[3]
     output_file = sys.argv[4]
 
-    join_subtitles(input_file, output_file, char_limit)
+    run(input_file, output_file, char_limit)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,11 +1,14 @@
 import sys
 import openai
 import csv
-import re
 import os
 from joblib import Parallel, delayed
 import time
 
+import api_limit
+import ledger
+import timeline
+
 def generate_response(prompt, api_key):
     openai.api_key = api_key
     max_retries = 5
@@ -13,13 +16,14 @@ def generate_response(prompt, api_key):
 
     for attempt in range(max_retries):
         try:
-            response = openai.Completion.create(
-                model="gpt-3.5-turbo-instruct-0914",
-                prompt=prompt,
-                temperature=0,
-                max_tokens=250
-            )
-            return response.choices[0].text.strip()
+            with api_limit.slots:
+                response = openai.Completion.create(
+                    model="gpt-3.5-turbo-instruct-0914",
+                    prompt=prompt,
+                    temperature=0,
+                    max_tokens=250
+                )
+            return response.choices[0].text.strip(), ledger.response_tokens(response)
         except openai.error.RateLimitError as e:
             if attempt < max_retries - 1:
                 time.sleep(retry_delay)
@@ -28,15 +32,14 @@ def generate_response(prompt, api_key):
                 raise e
 
 def process_line(line, idx, total, api_key):
-    timestamp_match = re.search(r"({ts=\d+})", line)
-    if timestamp_match:
-        timestamp = timestamp_match.group(1)
+    timestamp, _ = timeline.find_tag(line)
+    if timestamp:
         user_query = line.replace(timestamp, "").strip().replace("\n", "\\n")
 
         system_message = "You will analyze a line from the a film script. Identify these elements from the script and return the results in this format; [proper name], {gender}, (age), <clothing>, physical activity.  If an element can not be identified from the script, return these place-holders exactly as written here; [PROPER NAME], {GENDER}, (AGE), <CLOTHING> ."
         prompt = f"{system_message}\n\n{user_query}"
 
-        response = generate_response(prompt, api_key)
+        response, tokens = generate_response(prompt, api_key)
         result_line = [timestamp, response.replace('\n', ' ')]
 
         # Calculate the interval for updating the progress bar
@@ -47,9 +50,9 @@ def process_line(line, idx, total, api_key):
             sys.stdout.write('.')
             sys.stdout.flush()
 
-        return result_line
+        return result_line, tokens
 
-    return None
+    return None, 0
 
 def main(input_file, output_file, num_jobs, api_key):
     with open(input_file, "r", newline="", encoding="utf-8-sig") as infile:
@@ -59,15 +62,21 @@ def main(input_file, output_file, num_jobs, api_key):
     sys.stdout.write('[' + ' ' * 100 + ']\r[')
     sys.stdout.flush()
 
-    results = Parallel(n_jobs=num_jobs)(delayed(process_line)(line, idx, total_lines, api_key) for idx, line in enumerate(lines))
+    results = Parallel(n_jobs=num_jobs, prefer='threads')(delayed(process_line)(line, idx, total_lines, api_key) for idx, line in enumerate(lines))
+    tokens = sum(line_tokens for _, line_tokens in results)
 
     sys.stdout.write('\n')  # Move to the next line after progress bar completion
 
     with open(output_file, "w", newline="", encoding="utf-8") as outfile:
         writer = csv.writer(outfile, delimiter="\t", quoting=csv.QUOTE_ALL)
-        for result_line in results:
+        for result_line, _ in results:
             if result_line:
                 writer.writerow(result_line)
+    return tokens
+
+def run(input_file, output_file, api_key, num_jobs=5):
+    """Returns the GPT usage for the run ledger, {'llm_tokens': n}."""
+    return {'llm_tokens': main(input_file, output_file, num_jobs, api_key)}
 
 if __name__ == "__main__":
     if len(sys.argv) != 3:
@@ -52,6 +52,11 @@ def process_input(input_file, output_file):
     except Exception as e:
         print("An error occurred:", str(e))
 
+def run(input_file, output_file):
+    """Counts named characters in _ts_p.srt and writes the _ts_p_characters.srt summary."""
+    process_input(input_file, output_file)
+    return True
+
 if __name__ == "__main__":
     if len(sys.argv) != 3:
         print("Usage: python get_characters.py _ts_p.srt _ts_p_characters.srt")
@@ -60,4 +65,4 @@ if __name__ == "__main__":
     input_file = sys.argv[1]
     output_file = sys.argv[2]
 
-    process_input(input_file, output_file)
+    run(input_file, output_file)
@@ -5,6 +5,11 @@ import sys
 import fnmatch
 import time
 import platform
+import shutil
+import tempfile
+
+import ffmpeg_runner
+import timeline
 
 def process_image(image_file, output_folder, frame_count, idx, total, video_format):
     img = cv2.imread(image_file)
@@ -31,7 +36,8 @@ def process_image(image_file, output_folder, frame_count, idx, total, video_form
         sys.stdout.write('.')
         sys.stdout.flush()
 
-def main(input_wildcard, output_video, video_format='avi'):
+def run(input_wildcard, output_video, video_format='avi'):
+    """Renders one clip per timestamped PNG and concatenates them into output_video. Returns True on success."""
 
     start_time = time.time()
     if os.path.dirname(input_wildcard):
@@ -53,9 +59,8 @@ def main(input_wildcard, output_video, video_format='avi'):
             duplicate_images.append(img)
 
 
-    output_folder = "temp_output"
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    # A private scratch folder next to the output, so parallel renders never share clip files
+    output_folder = tempfile.mkdtemp(prefix="temp_output_", dir=os.path.dirname(os.path.abspath(output_video)))
 
     timestamps = set()
     processed_images = []
@@ -75,21 +80,9 @@ def main(input_wildcard, output_video, video_format='avi'):
     frame_counts = []
     accumulated_fraction = 0.0
     for i in range(len(images) - 1):
-        # Extract HHMMSSmmm from the filename
-        current_time_str = os.path.splitext(images[i])[0]
-        next_time_str = os.path.splitext(images[i + 1])[0]
-
-        # print("current_time_str ", current_time_str)
-        # Convert HHMMSSmmm to total milliseconds
-        current_time = (int(current_time_str[:2]) * 60 * 60 * 1000 +
-            int(current_time_str[2:4]) * 60 * 1000 +
-            int(current_time_str[4:6]) * 1000 +
-            int(current_time_str[6:]))
-
-        next_time = (int(next_time_str[:2]) * 60 * 60 * 1000 +
-             int(next_time_str[2:4]) * 60 * 1000 +
-            int(next_time_str[4:6]) * 1000 +
-            int(next_time_str[6:]))
+        # Convert the HHMMSSmmm at the start of the filename to total milliseconds
+        current_time = timeline.parse_stamp(images[i][:9])
+        next_time = timeline.parse_stamp(images[i + 1][:9])
 
         # Extract seconds and milliseconds from the timestamps
         current_seconds = current_time // 1000
@@ -125,46 +118,53 @@ def main(input_wildcard, output_video, video_format='avi'):
     # Add frames for last image
     frame_counts.append(30)  # Default to 1 second for the last image
 
+    # Print duplicate filenames only if there are any
+    if duplicate_images:
+        print("\nDuplicate filenames:")
+        for dup in duplicate_images:
+            print(dup)
+
+    return render([(os.path.join(image_folder, img), frame_count) for img, frame_count in zip(images, frame_counts)],
+                  output_video, video_format, output_folder)
+
+def render(slides, output_video, video_format='avi', output_folder=None):
+    """
+    Renders one clip per (image path, frame count) in slides and concatenates them into output_video.
+    Returns True on success. Used by run and for the slides of a single chapter.
+    """
+    if output_folder is None:
+        output_folder = tempfile.mkdtemp(prefix="temp_output_", dir=os.path.dirname(os.path.abspath(output_video)))
+    total_images = len(slides)
+
     sys.stdout.write('[' + ' ' * 100 + ']')
     sys.stdout.flush()
     sys.stdout.write('\b' * 101)
 
-    Parallel(n_jobs=-1, backend="threading")(delayed(process_image)(os.path.join(image_folder, img), output_folder, frame_count, idx, total_images, video_format) for idx, (img, frame_count) in enumerate(zip(images, frame_counts)))
+    Parallel(n_jobs=-1, backend="threading")(delayed(process_image)(image_file, output_folder, frame_count, idx, total_images, video_format) for idx, (image_file, frame_count) in enumerate(slides))
 
     sys.stdout.write('\n')  # Move to the next line after progress bar completion
 
-    # Determine the operating system
-    os_name = platform.system()
-
     # Create file list for ffmpeg. Full paths for Linux
     file_list = os.path.join(output_folder, 'file_list.txt')
     with open(file_list, 'w') as f:
-        for img in images:
-            video_file = os.path.basename(img).replace('png', video_format)
+        for image_file, _ in slides:
+            video_file = os.path.basename(image_file).replace('png', video_format)
             video_file_abs_path = os.path.abspath(os.path.join(output_folder, video_file))
             f.write(f"file '{video_file_abs_path}'\n")
 
-    # Print duplicate filenames only if there are any
-    if duplicate_images:
-        print("\nDuplicate filenames:")
-        for dup in duplicate_images:
-            print(dup)
-    # Print the elapsed time
-    elapsed_time = time.time() - start_time
-    elapsed_time_formatted = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
-
     q = '"' if platform.system() == 'Windows' else "'"
 
     # automatic ffmpeg invocation and cleanup
-    print(f"\nffmpeg -hide_banner -f concat -safe 0 -i {file_list} -c copy {q}{output_video}{q}")
-    os.system(f"ffmpeg  -hide_banner -f concat -safe 0 -i {file_list} -c copy {q}{output_video}{q}")
+    ffmpeg_runner.call(['ffmpeg', '-hide_banner', '-y', '-f', 'concat', '-safe', '0', '-i', file_list, '-c', 'copy', output_video],
+                       f"jobvid {os.path.basename(output_video)}")
 
     # Check if the output_video file exists
     if os.path.exists(output_video):
-        os.system(f"rm -r {q}{output_folder}{q}")
+        shutil.rmtree(output_folder, ignore_errors=True)
+        return True
     else:
         print(f"Error: The output video file {q}{output_video}{q} does not exist.")
-        sys.exit(1)
+        return False
 
 if __name__ == "__main__":
     if len(sys.argv) < 3 or len(sys.argv) > 4:
@@ -178,4 +178,5 @@ if __name__ == "__main__":
     if len(sys.argv) == 4:
         video_format = sys.argv[3]
 
-    main(input_wildcard, output_video, video_format)
\ No newline at end of file
+    if not run(input_wildcard, output_video, video_format):
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,128 @@
+import os
+import socket
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+# Every step execution of every book, for abs stats: books/abs_ledger.sqlite
+LEDGER_FILE = os.path.join('books', 'abs_ledger.sqlite')
+
+COLUMNS = ['book', 'step', 'number', 'started', 'finished', 'status', 'wall_s', 'cpu_s', 'children_cpu_s', 'peak_rss_mb',
+           'input_bytes', 'output_bytes', 'input_lines', 'output_lines', 'llm_tokens', 'images', 'host', 'version']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS step_runs (
+    id INTEGER PRIMARY KEY,
+    book TEXT NOT NULL,
+    step TEXT NOT NULL,
+    number TEXT,
+    started TEXT NOT NULL,
+    finished TEXT NOT NULL,
+    status TEXT NOT NULL,
+    wall_s REAL,
+    cpu_s REAL,
+    children_cpu_s REAL,
+    peak_rss_mb REAL,
+    input_bytes INTEGER,
+    output_bytes INTEGER,
+    input_lines INTEGER,
+    output_lines INTEGER,
+    llm_tokens INTEGER,
+    images INTEGER,
+    host TEXT,
+    version TEXT
+);
+CREATE INDEX IF NOT EXISTS step_runs_started ON step_runs (started);
+CREATE INDEX IF NOT EXISTS step_runs_book ON step_runs (book, step);
+"""
+
+def response_tokens(response):
+    """Tokens billed for a GPT completion, as reported by the API, for the llm_tokens column."""
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'total_tokens', 0) if usage else 0
+
+def connect(path=None):
+    """Opens the ledger (default LEDGER_FILE), creating it if needed. Connections are cheap; every write opens its own so threads never share one."""
+    path = path or LEDGER_FILE
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+def record(run, path=None):
+    """Adds one step execution (a dict with keys from COLUMNS). A ledger that can not be written never stops a book."""
+    path = path or LEDGER_FILE
+    run = dict(run, host=run.get('host') or socket.gethostname())
+    try:
+        connection = connect(path)
+        try:
+            with connection:
+                connection.execute(f"INSERT INTO step_runs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                                   [run.get(column) for column in COLUMNS])
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logging.error("Error writing run ledger %s: %s", path, e)
+
+def step_throughput(connection, since):
+    return connection.execute("""
+        SELECT step, MIN(number) AS number, COUNT(*) AS runs, SUM(status != 'ok') AS failed,
+               SUM(wall_s) AS wall_s, AVG(wall_s) AS avg_s, SUM(input_bytes) AS input_bytes,
+               SUM(input_lines) AS input_lines, SUM(llm_tokens) AS llm_tokens, SUM(images) AS images
+        FROM step_runs WHERE started >= ? GROUP BY step ORDER BY MIN(number), step""", (since,)).fetchall()
+
+def slowest_books(connection, since, limit):
+    return connection.execute("""
+        SELECT book, COUNT(*) AS runs, SUM(wall_s) AS wall_s, SUM(status != 'ok') AS failed, MAX(finished) AS last
+        FROM step_runs WHERE started >= ? GROUP BY book ORDER BY SUM(wall_s) DESC LIMIT ?""", (since, limit)).fetchall()
+
+def book_history(connection, book, limit):
+    return connection.execute("""
+        SELECT * FROM step_runs WHERE book = ? ORDER BY started DESC, id DESC LIMIT ?""", (book, limit)).fetchall()
+
+def rate(amount, seconds, scale=1):
+    return f"{amount / scale / seconds:.1f}" if amount and seconds else '-'
+
+def print_stats(connection, days, limit):
+    since = (datetime.now() - timedelta(days=days)).isoformat(timespec='seconds')
+    print(f"Steps over the last {days:g} days")
+    print(f"{'Step':<6}{'Name':<18}{'Runs':>6}{'Failed':>8}{'Avg s':>10}{'Total h':>9}{'MB/s':>9}{'Lines/s':>9}{'Tokens':>10}{'Images':>8}")
+    for row in step_throughput(connection, since):
+        print(f"{row['number'] or '':<6}{row['step'][:17]:<18}{row['runs']:>6}{row['failed']:>8}{row['avg_s'] or 0:>10.1f}"
+              f"{(row['wall_s'] or 0) / 3600:>9.2f}{rate(row['input_bytes'], row['wall_s'], 1024 * 1024):>9}"
+              f"{rate(row['input_lines'], row['wall_s']):>9}{row['llm_tokens'] or 0:>10}{row['images'] or 0:>8}")
+
+    print(f"\nSlowest books over the last {days:g} days")
+    print(f"{'Book':<30}{'Steps':>6}{'Failed':>8}{'Total h':>9}  Last run")
+    for row in slowest_books(connection, since, limit):
+        print(f"{row['book'][:29]:<30}{row['runs']:>6}{row['failed']:>8}{(row['wall_s'] or 0) / 3600:>9.2f}  {row['last']}")
+
+def print_history(connection, book, limit):
+    print(f"Last {limit} step runs of {book}")
+    print(f"{'Started':<21}{'Step':<18}{'Status':<8}{'Wall s':>9}{'Lines in':>10}{'Lines out':>10}{'Tokens':>9}{'Images':>8}")
+    for row in book_history(connection, book, limit):
+        print(f"{row['started']:<21}{row['step'][:17]:<18}{row['status']:<8}{row['wall_s'] or 0:>9.1f}"
+              f"{row['input_lines'] or 0:>10}{row['output_lines'] or 0:>10}{row['llm_tokens'] or 0:>9}{row['images'] or 0:>8}")
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='abs stats', description='Throughput per step and slowest books from the run ledger')
+    parser.add_argument('--days', type=float, default=30, help='Period to summarize (default 30 days)')
+    parser.add_argument('--book', default=None, help='Show the step history of one book instead')
+    parser.add_argument('--limit', type=int, default=10, help='Number of books or runs to list (default 10)')
+    parser.add_argument('--ledger', default=LEDGER_FILE, help=f'Ledger database (default {LEDGER_FILE})')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.ledger):
+        logging.error("No run ledger yet: %s", args.ledger)
+        return False
+    connection = connect(args.ledger)
+    try:
+        if args.book:
+            print_history(connection, args.book, args.limit)
+        else:
+            print_stats(connection, args.days, args.limit)
+    finally:
+        connection.close()
+    return True
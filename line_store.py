@@ -0,0 +1,225 @@
+import os
+import sqlite3
+import logging
+import argparse
+
+import timeline
+
+# books/<bookname>/<bookname>_lines.sqlite: one row per line of bookname_ts.srt and one column per text
+# product of the pipeline, so the text, character, scene and prompt of a line are one indexed lookup away
+# instead of a scan of six tab separated files. The files stay what the steps read and write (and what you
+# edit by hand); a column is reloaded from its file whenever the file changed, and `abs lines` exports them.
+
+STORE_SUFFIX = '_lines.sqlite'
+
+# column: (file suffix, where the {ts=} key is). 'first' and 'last' are tab separated fields keyed by the
+# quoted tag; 'inline' lines carry the tag at the end of the prompt.
+PRODUCTS = {
+    'text': ('_ts.srt', 'first'),
+    'character': ('_ts_p.srt', 'first'),
+    'scene': ('_ts_p_ns.srt', 'first'),
+    'merged': ('_merged.txt', 'last'),
+    'actors': ('_merged_names_dup.txt', 'inline'),
+    'prompt': ('_merged_names.txt', 'inline'),
+}
+
+# Stores made with another schema are dropped and loaded again from the files (PRAGMA user_version)
+SCHEMA_VERSION = 2
+
+# A line is its time and seq, which numbers the lines that share a time in the order of the file (0 for the
+# first): the products keep the lines of bookname_ts.srt in order, so the second line at a time in one file
+# is the second line at that time in the others.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lines (
+    ms INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT,
+    character TEXT,
+    scene TEXT,
+    merged TEXT,
+    actors TEXT,
+    prompt TEXT,
+    PRIMARY KEY (ms, seq)
+);
+CREATE INDEX IF NOT EXISTS lines_position ON lines (position);
+CREATE TABLE IF NOT EXISTS sources (
+    product TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    newline TEXT NOT NULL
+);
+"""
+
+def store_path(book):
+    return book.path(STORE_SUFFIX)
+
+def connect(book):
+    """Opens the store of a book, creating it if needed. Every caller opens its own connection, like ledger.py."""
+    connection = sqlite3.connect(store_path(book), timeout=30)
+    connection.row_factory = sqlite3.Row
+    if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # The store only holds copies of the files, so an old one is simply built again
+        connection.executescript(f"DROP TABLE IF EXISTS lines; DROP TABLE IF EXISTS sources; "
+                                 f"PRAGMA user_version = {SCHEMA_VERSION};")
+    connection.executescript(SCHEMA)
+    return connection
+
+def parse_line(line, layout):
+    """(key, value) of one line of a product file; key is the quoted "{ts=...}" field, or None for other lines."""
+    line = line.rstrip('\r\n')
+    if layout == 'inline':
+        tag, _ = timeline.find_tag(line)
+        return (f'"{tag}"' if tag else None), line
+    if layout == 'first':
+        key, tab, value = line.lstrip().partition('\t')
+    else:
+        value, tab, key = line.rstrip().rpartition('\t')
+    return (key if tab and timeline.find_tag(key)[0] else None), value
+
+def format_line(key, value, layout, newline='\n'):
+    if layout == 'inline':
+        return f"{value}{newline}"
+    return f"{key}\t{value}{newline}" if layout == 'first' else f"{value}\t{key}{newline}"
+
+def load(connection, product, path):
+    """
+    Replaces a column with the lines of its file. Loading the text column (bookname_ts.srt) starts the table
+    over, since every other product is made from it. Returns the number of lines loaded.
+    """
+    layout = PRODUCTS[product][1]
+    records = []
+    seqs = {}
+    newline = '\n'
+    # The files written with the csv module end their lines with \r\n; export writes them back the same way
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        for position, line in enumerate(file):
+            if position == 0 and line.endswith('\r\n'):
+                newline = '\r\n'
+            key, value = parse_line(line, layout)
+            if key is not None:
+                ms = timeline.find_tag(key)[1]
+                seqs[ms] = seqs.get(ms, -1) + 1
+                records.append((ms, seqs[ms], key, position, value))
+
+    stat = os.stat(path)
+    with connection:
+        if product == 'text':
+            connection.execute("DELETE FROM lines")
+            connection.execute("DELETE FROM sources")
+        else:
+            connection.execute(f"UPDATE lines SET {product} = NULL")
+        # Lines missing from bookname_ts.srt are added after it
+        offset = connection.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM lines").fetchone()[0] if product != 'text' else 0
+        connection.executemany(f"INSERT INTO lines (ms, seq, key, position, {product}) VALUES (?, ?, ?, ?, ?) "
+                               f"ON CONFLICT (ms, seq) DO UPDATE SET {product} = excluded.{product}",
+                               [(ms, seq, key, offset + position, value) for ms, seq, key, position, value in records])
+        connection.execute("INSERT OR REPLACE INTO sources (product, size, mtime_ns, newline) VALUES (?, ?, ?, ?)",
+                           (product, stat.st_size, stat.st_mtime_ns, newline))
+    return len(records)
+
+def sync(book, connection=None, force=()):
+    """
+    Reloads every product whose file changed (by size and mtime) since it was loaded, and the products in force.
+    A removed file empties its column.
+    """
+    own = connection is None
+    connection = connection or connect(book)
+    try:
+        loaded = {row['product']: (row['size'], row['mtime_ns']) for row in connection.execute("SELECT * FROM sources")}
+        # The text column first: it decides which rows exist
+        for product, (suffix, _) in PRODUCTS.items():
+            path = book.path(suffix)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                if product in force or loaded.get(product) != (stat.st_size, stat.st_mtime_ns):
+                    load(connection, product, path)
+                    if product == 'text':
+                        # The table started over, so every other column is loaded again
+                        loaded = {}
+            elif product in loaded:
+                with connection:
+                    connection.execute(f"UPDATE lines SET {product} = NULL")
+                    connection.execute("DELETE FROM sources WHERE product = ?", (product,))
+    finally:
+        if own:
+            connection.close()
+
+def update(book):
+    """Brings the store up to date after a step wrote its files. A store that can not be written never stops a book."""
+    try:
+        sync(book)
+    except (sqlite3.Error, OSError) as e:
+        logging.error("Error updating line store %s: %s", store_path(book), e)
+
+def rows(connection, *products):
+    """(key, values...) of the lines that have all the given products, in the order of bookname_ts.srt."""
+    condition = ' AND '.join(f"{product} IS NOT NULL" for product in products)
+    return connection.execute(f"SELECT key, {', '.join(products)} FROM lines WHERE {condition} ORDER BY position").fetchall()
+
+def export(book, folder, products=None):
+    """Writes the product files from the store into folder, named like in the book folder. Returns the paths."""
+    os.makedirs(folder, exist_ok=True)
+    connection = connect(book)
+    try:
+        sync(book, connection)
+        newlines = {row['product']: row['newline'] for row in connection.execute("SELECT * FROM sources")}
+        paths = []
+        for product in products or PRODUCTS:
+            suffix, layout = PRODUCTS[product]
+            path = os.path.join(folder, os.path.basename(book.path(suffix)))
+            with open(path, 'w', encoding='utf-8', newline='') as file:
+                for key, value in rows(connection, product):
+                    file.write(format_line(key, value, layout, newlines.get(product, '\n')))
+            paths.append(path)
+        return paths
+    finally:
+        connection.close()
+
+def show(book, start_ms, end_ms):
+    """Prints every product of the lines between two times."""
+    connection = connect(book)
+    try:
+        sync(book, connection)
+        for row in connection.execute("SELECT * FROM lines WHERE ms BETWEEN ? AND ? ORDER BY ms, seq", (start_ms, end_ms)):
+            print(f"{timeline.format_time(row['ms'])}")
+            for product in PRODUCTS:
+                if row[product] is not None:
+                    print(f"  {product:>9}: {row[product]}")
+    finally:
+        connection.close()
+
+def cli(argv=None):
+    import abs  # Deferred: abs imports this module
+
+    parser = argparse.ArgumentParser(prog='abs lines', description='Look up or export the text products of a book by timestamp')
+    parser.add_argument('bookname', help='Name of the book')
+    parser.add_argument('--at', metavar='[HH:]MM:SS', default=None, help='Show every product of the lines from this time')
+    parser.add_argument('--seconds', type=float, default=30, help='How many seconds of lines --at shows (default 30)')
+    parser.add_argument('--export', metavar='FOLDER', default=None, help='Write the product files from the store into FOLDER')
+    parser.add_argument('--product', nargs='+', choices=list(PRODUCTS), default=None, help='Products to export (default all)')
+    args = parser.parse_args(argv)
+
+    book = abs.open_book(args.bookname, interactive=False)
+    if book is None:
+        return False
+    if args.export:
+        for path in export(book, args.export, args.product):
+            print(path)
+    if args.at:
+        try:
+            seconds = sum(float(part) * 60 ** power for power, part in enumerate(reversed(args.at.split(':'))))
+        except ValueError:
+            parser.error(f"--at {args.at} is not a time")
+        show(book, int(seconds * 1000), int((seconds + args.seconds) * 1000))
+    if not args.export and not args.at:
+        connection = connect(book)
+        try:
+            sync(book, connection)
+            for product in PRODUCTS:
+                count = connection.execute(f"SELECT COUNT({product}) FROM lines").fetchone()[0]
+                print(f"{product:>10} {count:>7} lines  {book.path(PRODUCTS[product][0])}")
+        finally:
+            connection.close()
+    return True
@@ -1,33 +1,40 @@
 import sys
-import re
 
-def process_file(input_file, output_file):
-    with open(input_file, 'r', encoding='utf-8') as f_in:
-        content = f_in.read()
-
-    # Remove comment lines
-    content = re.sub(r'^#.*\r?\n', '', content, flags=re.MULTILINE)
+import timeline
 
-    # Merge lines between empty lines
-    paragraphs = re.split(r'\r?\n\r?\n', content)
-
-    # Process each paragraph
-    with open(output_file, 'w', encoding='utf-8') as f_out:
-        for paragraph in paragraphs:
-            if paragraph:  # check that paragraph is not empty
-                index, timestamp, *text = paragraph.split('\n')
-                index = index.zfill(5)
-                text = ' '.join(text).strip()
+def table_line(start, text):
+    """The prompt table line of a cue. Text lines starting with # are comments; the others are merged into one."""
+    text = ' '.join(line for line in text.split('\n') if not line.startswith('#'))
 
-                # Extract and format start timestamp
-                start_timestamp = re.match(r'\d\d:\d\d:\d\d,\d\d\d', timestamp).group()
-                start_timestamp = re.sub(r'[:,\s]', '', start_timestamp)
-                start_timestamp = f'{{ts={start_timestamp}}}'
+    # Format and escape text
+    text = text.replace('"', '\\"').replace("'", "''")
 
-                # Format and escape text
-                text = text.replace('"', '\\"').replace("'", "''")
+    return f'"{timeline.ts_tag(start)}"\t"{text}"\n'
 
-                f_out.write(f'"{start_timestamp}"\t"{text}"\n')
+def process_file(input_file, output_file):
+    with open(output_file, 'w', encoding='utf-8') as f_out:
+        for start, _, text in timeline.read_srt(input_file, skip_comments=True):
+            f_out.write(table_line(start, text))
+
+def write_with_table(cues, srt_file, ts_file):
+    """
+    Writes a stream of cues to srt_file and, cue by cue, the prompt table process_file would make of srt_file
+    to ts_file: Steps 5 and 6 in one pass, without reading the joined .srt back.
+    """
+    with open(ts_file, 'w', encoding='utf-8') as table:
+        def tee():
+            for cue in cues:
+                # Times kept as text (fix_srt.py) are parsed here, for the joined cues only
+                start = timeline.parse_time(cue[0]) if isinstance(cue[0], str) else cue[0]
+                if start is not None:
+                    table.write(table_line(start, cue[2]))
+                yield cue
+        return timeline.write_srt(srt_file, tee())
+
+def run(input_file, output_file):
+    """ Converts a joined .srt file into the "{ts=HHMMSSmmm}"<tab>"text" prompt table. """
+    process_file(input_file, output_file)
+    return True
 
 if __name__ == '__main__':
     if len(sys.argv) < 3:
@@ -37,4 +44,4 @@ if __name__ == '__main__':
     input_file = sys.argv[1]
     output_file = sys.argv[2]
 
-    process_file(input_file, output_file)
+    run(input_file, output_file)
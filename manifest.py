@@ -0,0 +1,124 @@
+import os
+import json
+import hashlib
+import logging
+import importlib.util
+from datetime import datetime
+
+# Per-book record of what each pipeline step was built from: books/<bookname>/.abs_manifest.json
+MANIFEST_NAME = '.abs_manifest.json'
+MANIFEST_VERSION = 1
+
+def manifest_path(book_folder):
+    return os.path.join(book_folder, MANIFEST_NAME)
+
+def load_manifest(book_folder):
+    """Reads the build manifest of a book. A missing or unreadable manifest starts empty."""
+    path = manifest_path(book_folder)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+            logging.info("Ignoring build manifest with unknown version: %s", path)
+        except (OSError, ValueError) as e:
+            logging.error("Error reading build manifest %s: %s", path, e)
+    return {'version': MANIFEST_VERSION, 'steps': {}, 'files': {}}
+
+def save_manifest(book_folder, manifest):
+    """Writes the manifest atomically so an interrupted run never leaves a truncated file."""
+    path = manifest_path(book_folder)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def hash_file(path, manifest, read=True):
+    """
+    Returns the sha256 of a file. Hashes are cached in the manifest by size and mtime, so an unchanged
+    multi-gigabyte mp3 is only read once. With read=False a file missing from the cache is not read (abs plan):
+    it gets a stand-in made of its size and mtime, which differs from any recorded hash.
+    """
+    stat = os.stat(path)
+    cached = manifest['files'].get(path)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['sha256']
+    if not read:
+        return f"stat:{stat.st_size}:{stat.st_mtime_ns}"
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+    manifest['files'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+    return sha256
+
+def hash_folder(path):
+    """Fingerprints a folder (e.g. the generated images) by the names, sizes and mtimes of its files."""
+    digest = hashlib.sha256()
+    for entry in sorted(os.scandir(path), key=lambda e: e.name):
+        if entry.is_file():
+            stat = entry.stat()
+            digest.update(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return 'dir:' + digest.hexdigest()
+
+def hash_path(path, manifest, read=True):
+    """Fingerprint of a file or folder, or None if it does not exist."""
+    if os.path.isdir(path):
+        return hash_folder(path)
+    if os.path.isfile(path):
+        return hash_file(path, manifest, read)
+    return None
+
+_script_versions = {}
+
+def script_version(module_name):
+    """The sha256 of a step script's source. Editing a script makes its step stale."""
+    if module_name not in _script_versions:
+        spec = importlib.util.find_spec(module_name)
+        with open(spec.origin, 'rb') as file:
+            _script_versions[module_name] = hashlib.sha256(file.read()).hexdigest()
+    return _script_versions[module_name]
+
+def fingerprint(config_values, version, input_hashes):
+    return {'config': config_values, 'version': version, 'inputs': input_hashes}
+
+def stale_reasons(record, current, outputs_missing):
+    """
+    Compares the recorded fingerprint of a step with the current one.
+    Returns a list of human readable reasons the step must run; an empty list means it is up to date.
+    """
+    reasons = [f"output missing: {path}" for path in outputs_missing]
+    if record is None:
+        return reasons
+
+    if record.get('version') != current['version']:
+        reasons.append("script changed")
+
+    old_config = record.get('config', {})
+    for key, value in current['config'].items():
+        if old_config.get(key) != value:
+            reasons.append(f"config changed: {key} ({old_config.get(key)!r} -> {value!r})")
+
+    old_inputs = record.get('inputs', {})
+    for path, sha256 in current['inputs'].items():
+        if path not in old_inputs:
+            reasons.append(f"new input: {path}")
+        elif old_inputs[path] != sha256:
+            reasons.append(f"input changed: {path}")
+    for path in old_inputs:
+        if path not in current['inputs']:
+            reasons.append(f"input removed: {path}")
+    return reasons
+
+def record_step(manifest, step_name, current, output_hashes):
+    manifest['steps'][step_name] = dict(current, outputs=output_hashes, finished=datetime.now().isoformat(timespec='seconds'))
+
+def recorded_output_hash(manifest, path):
+    """The hash a step recorded for one of its outputs, used for transient files deleted after use."""
+    for record in manifest['steps'].values():
+        if path in record.get('outputs', {}):
+            return record['outputs'][path]
+    return None
@@ -0,0 +1,175 @@
+import os
+import glob
+import json
+import argparse
+import tempfile
+
+import abs
+import profiler
+import fix_srt
+import resegment
+import timeline
+
+# jobvid.py renders 30 frames per second and one second for the last image
+FPS = 30
+
+def measured_rates(books_root='books'):
+    """
+    Seconds per input byte and output bytes per input byte of each step, from the abs_profile.json of every
+    book, so a step that took an hour on a 500 MB mp3 is expected to take two on a 1 GB one.
+    """
+    totals = {}
+    for path in glob.glob(os.path.join(books_root, '*', profiler.PROFILE_NAME)):
+        for name, record in profiler.load_profile(os.path.dirname(path))['steps'].items():
+            if not record.get('input_bytes'):
+                continue
+            total = totals.setdefault(name, {'seconds': 0.0, 'bytes': 0, 'sized_bytes': 0, 'output_bytes': 0, 'runs': 0})
+            total['seconds'] += record.get('wall_s', 0)
+            total['bytes'] += record['input_bytes']
+            total['runs'] += 1
+            if 'output_bytes' in record:
+                total['sized_bytes'] += record['input_bytes']
+                total['output_bytes'] += record['output_bytes']
+
+    rates = {}
+    for name, total in totals.items():
+        rates[name] = {'seconds_per_byte': total['seconds'] / total['bytes'], 'runs': total['runs'],
+                       'output_ratio': total['output_bytes'] / total['sized_bytes'] if total['sized_bytes'] else None}
+    return rates
+
+def read_timeline(ts_file):
+    """(line count, first timestamp in ms, last timestamp in ms) of a bookname_ts.srt file."""
+    lines, first, last = 0, None, None
+    for ms, _ in timeline.read_ts(ts_file):
+        lines += 1
+        first = ms if first is None else first
+        last = ms
+    return lines, first, last
+
+def book_timeline(book):
+    """
+    The timeline of bookname_ts.srt. Before Steps 5 and 6 have run it is built from the .srt in a temporary
+    folder outside the book (both are fast text transforms); None before the book is transcribed.
+    """
+    if os.path.exists(book.path('_ts.srt')):
+        return read_timeline(book.path('_ts.srt'))
+    if not os.path.exists(book.path('.srt')):
+        return None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        m300_file = os.path.join(temp_dir, 'plan_m300.srt')
+        ts_file = os.path.join(temp_dir, 'plan_ts.srt')
+        chars, seconds = abs.segment_limits(book)
+        if abs.word_json(book):
+            resegment.run(abs.word_json(book), m300_file, chars, seconds, ts_file)
+        else:
+            fix_srt.run(book.path('.srt'), m300_file, chars, ts_file)
+        return read_timeline(ts_file)
+
+def format_duration(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def plan(book, steps=abs.PIPELINE):
+    """
+    Walks the steps of a book like abs.main without running them. A step runs if the build manifest finds
+    it stale or a step it depends on runs. Returns a dict with one entry per step and the totals.
+    """
+    steps = [step for step in steps if step.when is None or step.when(book)]
+    dependencies = abs.step_dependencies(book, steps)
+    rates = measured_rates()
+    producers = {path: step.name for step in steps for path in step.output_paths(book)}
+    sizes = {}
+    runs = set()
+    rows = []
+
+    for step in steps:
+        current, reasons = abs.step_status(book, step, steps, adopt=False)
+        upstream = [name for name in dependencies[step.name] if name in runs]
+        if upstream and not reasons:
+            reasons = [f"after {', '.join(upstream)}"]
+        waiting = [path for path in step.input_paths(book) if not os.path.exists(path) and path not in producers]
+        if reasons:
+            runs.add(step.name)
+
+        # Input size: what is on disk, or what the producing step is expected to write
+        input_bytes = 0
+        for path in step.input_paths(book):
+            size = sizes.get(path) if path in sizes else profiler.path_size(path) or None
+            input_bytes = None if size is None or input_bytes is None else input_bytes + size
+
+        rate = rates.get(step.name)
+        seconds = None
+        if reasons and rate and input_bytes:
+            seconds = rate['seconds_per_byte'] * input_bytes
+        for path in step.output_paths(book):
+            if reasons:
+                ratio = rate['output_ratio'] if rate else None
+                sizes[path] = input_bytes * ratio / len(step.output_paths(book)) if input_bytes and ratio else None
+
+        rows.append({'number': step.number, 'step': step.name, 'runs': bool(reasons), 'reasons': reasons,
+                     'waiting_for': waiting, 'seconds': seconds, 'measured': bool(rate)})
+
+    book_tl = book_timeline(book)
+    lines = book_tl[0] if book_tl else None
+    llm_requests = {}
+    if 'gen_prompts' in runs:
+        llm_requests['gen_prompts'] = lines
+    if 'extract_scene' in runs and abs.uses_gpt(book)['use_gpt']:
+        llm_requests['extract_scene'] = lines
+
+    comfyui_prompts = None
+    if 'generate_images' in runs and book.config.get('image_generator') == 'ComfyUI':
+        comfyui_prompts = int(book.config.get('image_count') or 0) or lines
+
+    frames = None
+    if 'render_video' in runs and book_tl and book_tl[1] is not None:
+        frames = round((book_tl[2] - book_tl[1]) * FPS / 1000) + FPS
+
+    unmeasured = [row['step'] for row in rows if row['runs'] and row['seconds'] is None]
+    return {'book': book.name, 'steps': rows, 'ts_lines': lines, 'llm_requests': llm_requests,
+            'comfyui_prompts': comfyui_prompts, 'frames': frames,
+            'seconds': sum(row['seconds'] or 0 for row in rows), 'unmeasured': unmeasured}
+
+def print_plan(result):
+    print(f"Plan for {result['book']}")
+    print(f"{'Step':<6}{'Name':<18}{'Est. time':>10}  Action")
+    for row in result['steps']:
+        if not row['runs']:
+            action = "up to date"
+        else:
+            action = "run: " + "; ".join(row['reasons'])
+            if row['waiting_for']:
+                action += " (waits for " + ", ".join(row['waiting_for']) + ")"
+        estimate = format_duration(row['seconds']) if row['runs'] else ''
+        print(f"{row['number']:<6}{row['step']:<18}{estimate:>10}  {action}")
+
+    lines = result['ts_lines']
+    print(f"\nPrompt lines (_ts.srt): {lines if lines is not None else 'known after transcription'}")
+    for name, count in result['llm_requests'].items():
+        print(f"LLM requests by {name}: {count if count is not None else '?'}")
+    if result['comfyui_prompts'] is not None:
+        print(f"ComfyUI prompts queued: {result['comfyui_prompts']}")
+    if result['frames'] is not None:
+        print(f"Frames encoded by jobvid: {result['frames']} ({format_duration(result['frames'] / FPS)} of video)")
+    print(f"Estimated time of the steps that run, one after another: {format_duration(result['seconds'])}")
+    if result['unmeasured']:
+        print(f"No measurements yet for: {', '.join(result['unmeasured'])} (run them once to record abs_profile.json)")
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='abs plan', description='Show what abs would run for a book, without running it')
+    parser.add_argument('bookname', help='Name of the book')
+    parser.add_argument('wildcard_path', nargs='?', default=None, help='Wildcard path to audio files')
+    parser.add_argument('--json', action='store_true', help='Print the plan as JSON')
+    args = parser.parse_args(argv)
+
+    book = abs.open_book(args.bookname, args.wildcard_path, api_key=abs.read_api_key(), interactive=False, dry_run=True)
+    if book is None:
+        return False
+    result = plan(book)
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        print_plan(result)
+    return True
@@ -94,6 +94,12 @@ def process_directory(directory, part, overwrite):
     print()  # Print newline after progress bar completion
 
 
+def run(directory, part='both', overwrite=False):
+    """Extracts the tEXt comment of every PNG in directory to a .tEXt.txt file beside it."""
+    process_directory(directory, part, overwrite)
+    return True
+
+
 def main():
     if len(sys.argv) < 2:
         print('Usage: {} <png_file or directory> [-r [book|gen|both]] [-o] or {} -w <png_file>'.format(sys.argv[0], sys.argv[0]))
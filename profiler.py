@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+import logging
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module; CPU and memory figures are left out there
+    resource = None
+
+# Per-book record of what the last run of each step cost: books/<bookname>/abs_profile.json
+PROFILE_NAME = 'abs_profile.json'
+
+def read_io_counters():
+    """Bytes read and written by this process and its finished children, from /proc/self/io (Linux only)."""
+    try:
+        with open('/proc/self/io', 'r') as file:
+            counters = dict(line.split(':', 1) for line in file if ':' in line)
+        return {key: int(value) for key, value in counters.items()}
+    except (OSError, ValueError):
+        return {}
+
+def maxrss_mb(usage):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def process_rss():
+    """Resident memory of this process in bytes, from /proc/self/statm (Linux only); None elsewhere."""
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def children_rss():
+    """Resident memory in bytes of all processes descended from this one (ffmpeg, whisperx and their children)."""
+    parents, rss = {}, {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat', 'r') as file:
+                    fields = file.read().rpartition(')')[2].split()
+                parents[int(name)] = int(fields[1])
+                rss[int(name)] = int(fields[21]) * PAGE_SIZE
+            except (OSError, ValueError, IndexError):
+                continue  # The process ended while we looked
+    total, pending = 0, [os.getpid()]
+    children = {}
+    for pid, parent in parents.items():
+        children.setdefault(parent, []).append(pid)
+    while pending:
+        for pid in children.get(pending.pop(), ()):
+            total += rss[pid]
+            pending.append(pid)
+    return total
+
+class MemorySampler:
+    """
+    Peak resident memory of this process and of its child processes during one step, sampled from /proc every
+    interval seconds by a background thread. ru_maxrss can not give this: it is the peak over the whole life of the
+    process (a pool worker's earlier books included). Without /proc, available is False and nothing is sampled.
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.available = process_rss() is not None
+        self.peak = 0
+        self.children_peak = 0
+        self.stop = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        self.peak = max(self.peak, process_rss() or 0)
+        self.children_peak = max(self.children_peak, children_rss())
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        if self.available:
+            self.sample()
+            self.thread = threading.Thread(target=self.run, name='memory-sampler', daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+            self.sample()
+        return False
+
+def snapshot():
+    snap = {'wall': time.perf_counter(), 'io': read_io_counters()}
+    if resource is not None:
+        # RUSAGE_THREAD keeps the CPU time of steps running side by side apart where the OS offers it
+        who = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+        snap['self'] = resource.getrusage(who)
+        snap['process'] = resource.getrusage(resource.RUSAGE_SELF)
+        snap['children'] = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return snap
+
+def cpu_seconds(start, end):
+    return max(0.0, round(end.ru_utime + end.ru_stime - start.ru_utime - start.ru_stime, 3))
+
+def difference(start, end, memory=None):
+    """
+    The cost of the work between two snapshots. CPU time of child processes (ffmpeg, whisperx), memory and the
+    I/O counters are process wide, so when steps overlap each step also counts its neighbours' children,
+    memory and I/O; run with --workers 1 for exact figures. Peak RSS is the peak a MemorySampler saw during the
+    step, for abs and, separately, for all its child processes together. Without one (no /proc) only the growth
+    of the lifetime peak ru_maxrss is known, and it is kept as peak_rss_growth_mb.
+    """
+    metrics = {'wall_s': round(end['wall'] - start['wall'], 3)}
+    if memory is not None and memory.available:
+        metrics['peak_rss_mb'] = round(memory.peak / (1024 * 1024), 1)
+        metrics['children_peak_rss_mb'] = round(memory.children_peak / (1024 * 1024), 1)
+    if 'self' in start:
+        metrics['cpu_s'] = cpu_seconds(start['self'], end['self'])
+        metrics['children_cpu_s'] = cpu_seconds(start['children'], end['children'])
+        if 'peak_rss_mb' not in metrics:
+            metrics['peak_rss_growth_mb'] = round(maxrss_mb(end['process']) - maxrss_mb(start['process']), 1)
+    for key, name in (('rchar', 'read_bytes'), ('wchar', 'write_bytes'),
+                      ('read_bytes', 'disk_read_bytes'), ('write_bytes', 'disk_write_bytes')):
+        if key in start['io'] and key in end['io']:
+            metrics[name] = end['io'][key] - start['io'][key]
+    return metrics
+
+def measure(func, *args, profile_file=None):
+    """
+    Calls func(*args) and returns (result, metrics). With profile_file the call runs under cProfile and
+    the stats are dumped there (read them with python -m pstats). Module level so a process pool can run it.
+    """
+    with MemorySampler() as memory:
+        start = snapshot()
+        if profile_file is None:
+            result = func(*args)
+        else:
+            profile = cProfile.Profile()
+            try:
+                result = profile.runcall(func, *args)
+            finally:
+                os.makedirs(os.path.dirname(profile_file), exist_ok=True)
+                profile.dump_stats(profile_file)
+        end = snapshot()
+    return result, difference(start, end, memory)
+
+def path_size(path):
+    """Size in bytes of a file, or of the files in a folder (eg. the images). 0 if it does not exist."""
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return 0
+
+def load_profile(book_folder):
+    path = os.path.join(book_folder, PROFILE_NAME)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error("Error reading step profile %s: %s", path, e)
+    return {'steps': {}}
+
+def save_profile(book_folder, records):
+    """Merges the records of the steps that ran into abs_profile.json; steps that did not run keep their last record."""
+    if not records:
+        return
+    profile = load_profile(book_folder)
+    profile['steps'].update(records)
+    profile['updated'] = datetime.now().isoformat(timespec='seconds')
+    path = os.path.join(book_folder, PROFILE_NAME)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(profile, file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def format_mb(value):
+    return '-' if value is None else f"{value / (1024 * 1024):.1f}"
+
+def summary_table(records):
+    """A one-screen table of the steps that ran, in the order they finished."""
+    lines = [f"{'Step':<6}{'Name':<18}{'Wall s':>9}{'CPU s':>9}{'Child s':>9}{'RSS MB':>9}{'Read MB':>10}{'Write MB':>10}"]
+    total = 0.0
+    for name, record in records.items():
+        total += record.get('wall_s', 0)
+        if 'peak_rss_mb' in record:
+            peak = f"{max(record['peak_rss_mb'], record.get('children_peak_rss_mb', 0)):.0f}"
+        else:
+            # Only the growth of the lifetime peak is known
+            peak = f"+{record.get('peak_rss_growth_mb', 0):.0f}"
+        lines.append(f"{record.get('number', ''):<6}{name[:17]:<18}{record.get('wall_s', 0):>9.1f}"
+                     f"{record.get('cpu_s', 0):>9.1f}{record.get('children_cpu_s', 0):>9.1f}{peak:>9}"
+                     f"{format_mb(record.get('read_bytes')):>10}{format_mb(record.get('write_bytes')):>10}")
+    lines.append(f"{'':<6}{'total':<18}{total:>9.1f}")
+    return "\n".join(lines)
@@ -135,6 +135,11 @@ def remove_duplicate_patterns(filename, log_file, output_file, config, encoding,
                 seen_lines.add(line)
                 output_file.write(line)
 
+def run(file_pattern, output_file, config, log_file_path):
+    """Prunes actors beyond keep_actors from each line, logging the removals to log_file_path."""
+    process_files(file_pattern, output_file, log_file_path, config)
+    return True
+
 def main():
     if DEBUG2:
         print("Script started")  # Immediate feedback when the script runs
@@ -156,8 +161,7 @@ def main():
         print(f"Configuration loaded: {config}")
 
     log_file_path = os.path.join(SCRIPT_PATH, 'books', args.bookname, 'remove.log')
-    # Corrected call to process_files with the config argument
-    process_files(args.file_pattern, args.output_file, log_file_path, config)
+    run(args.file_pattern, args.output_file, config, log_file_path)
 
 if __name__ == "__main__":
     try:
@@ -1,6 +1,7 @@
 import argparse
 import os
-import re
+
+import timeline
 
 def generate_new_filename(folder, base_filename):
     counter = 1
@@ -41,9 +42,9 @@ def rename_png_files(folder):
         # Read the .tEXt.txt file to find the timestamp
         with open(txt_path, 'r') as f:
             content = f.read()
-            match = re.search(r"\{ts=(\d{9})\}", content)
-            if match:
-                timestamp = match.group(1)
+            tag, ms = timeline.find_tag(content)
+            if tag:
+                timestamp = timeline.format_stamp(ms)
                 new_png_name = f"{timestamp}.png"
                 new_png_path = os.path.join(folder, new_png_name)
 
@@ -54,12 +55,16 @@ def rename_png_files(folder):
                     new_png_path = os.path.join(folder, generate_new_filename(folder, timestamp))
                     os.rename(os.path.join(folder, png_file), new_png_path)
 
+def run(folder):
+    rename_png_files(folder)
+    return True
+
 def main():
     parser = argparse.ArgumentParser(description='Rename PNG files')
     parser.add_argument('folder', help='Folder containing .tEXt.txt and .png files')
 
     args = parser.parse_args()
-    rename_png_files(args.folder)
+    run(args.folder)
 
 
 if __name__ == '__main__':
@@ -82,6 +82,11 @@ def process_input(characters_file, male_actors_file, female_actors_file, output_
     except Exception as e:
         print("An error occurred:", str(e))
 
+def run(characters_file, male_actors_file, female_actors_file, output_file, depth=4):
+    """Assigns shuffled actors/actresses to characters seen at least depth times and writes _ts_p_actors_EDIT.txt."""
+    process_input(characters_file, male_actors_file, female_actors_file, output_file, depth)
+    return True
+
 if __name__ == "__main__":
     if len(sys.argv) < 5 or len(sys.argv) > 6:
         print("Usage: python replace_actors.py _ts_p_characters.srt <male_actors_file> <female_actors_file> _ts_p_actors_EDIT.txt [depth]")
@@ -93,4 +98,4 @@ if __name__ == "__main__":
     output_file = sys.argv[4]
     depth = int(sys.argv[5]) if len(sys.argv) == 6 else 4
 
-    process_input(characters_file, male_actors_file, female_actors_file, output_file, depth)
\ No newline at end of file
+    run(characters_file, male_actors_file, female_actors_file, output_file, depth)
\ No newline at end of file
@@ -0,0 +1,113 @@
+import sys
+import json
+import argparse
+
+import fix_srt
+import make_prompts
+import timeline
+
+# Rebuilds bookname_m300.srt from the word timings WhisperX writes to bookname.json, so the subtitles can be
+# cut at any length or duration without transcribing again. fix_srt.py can only join whole WhisperX cues.
+
+SENTENCE_END = ('.', '?', '!', '."', '?"', '!"')
+
+def load_words(json_file):
+    """
+    (start, end, word) of every word of a WhisperX JSON file, in seconds. Words WhisperX could not align
+    (often numbers) get the end of the word before them, so every word has a time.
+    """
+    with open(json_file, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+
+    words = []
+    last_end = 0.0
+    for segment in data.get('segments', []):
+        segment_words = segment.get('words')
+        if not segment_words:
+            # No alignment for the whole segment: keep its text with the segment times
+            segment_words = [{'word': segment.get('text', '').strip(), 'start': segment.get('start'), 'end': segment.get('end')}]
+        for word in segment_words:
+            text = word.get('word', '').strip()
+            if not text:
+                continue
+            start = last_end if word.get('start') is None else float(word['start'])
+            end = float(word['end']) if word.get('end') is not None else start
+            words.append((start, max(start, end), text))
+            last_end = max(last_end, end)
+    return words
+
+def split_point(cue, char_limit):
+    """Number of words to keep in a full cue: up to the last sentence end in its second half, or all of it."""
+    length = 0
+    best = None
+    for number, (_, _, text) in enumerate(cue, 1):
+        length += len(text) + (1 if number > 1 else 0)
+        if text.endswith(SENTENCE_END) and length >= char_limit // 2:
+            best = number
+    return best or len(cue)
+
+def segment(words, char_limit=300, max_seconds=0):
+    """
+    Groups words into cues of at most char_limit characters and, with max_seconds, at most that long.
+    A cue that is full ends at its last sentence end when there is one in its second half.
+    """
+    cues = []
+    current = []
+    length = 0  # of the words in current joined by spaces
+    for word in words:
+        while current:
+            # One more character for the period write_srt adds to a cue without end punctuation
+            ending = 0 if fix_srt.preprocess_text(word[2]) == word[2] else 1
+            too_long = length + 1 + len(word[2]) + ending > char_limit
+            too_slow = max_seconds and word[1] - current[0][0] > max_seconds
+            if not (too_long or too_slow):
+                break
+            keep = split_point(current, char_limit)
+            cues.append(current[:keep])
+            current = current[keep:]
+            length = len(' '.join(text for _, _, text in current))
+        current.append(word)
+        length += len(word[2]) + (1 if len(current) > 1 else 0)
+    if current:
+        cues.append(current)
+    return cues
+
+def write_srt(cues, output_file, ts_file=None):
+    """
+    Writes the cues like fix_srt.py does: the first starts at 0 and every text ends with punctuation.
+    With ts_file, the prompt table of make_prompts.py is written too.
+    """
+    def srt_cues():
+        for number, cue in enumerate(cues, 1):
+            start_ms = 0 if number == 1 else int(round(cue[0][0] * 1000))
+            yield start_ms, int(round(cue[-1][1] * 1000)), fix_srt.preprocess_text(' '.join(text for _, _, text in cue))
+    if ts_file:
+        make_prompts.write_with_table(srt_cues(), output_file, ts_file)
+    else:
+        timeline.write_srt(output_file, srt_cues())
+
+def run(json_file, output_file, char_limit=300, max_seconds=0, ts_file=None):
+    """
+    Cuts the words of a WhisperX JSON file into cues of up to char_limit characters (and max_seconds),
+    and writes ts_file if given.
+    """
+    words = load_words(json_file)
+    if not words:
+        return False
+    write_srt(segment(words, char_limit, max_seconds), output_file, ts_file)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild subtitles from WhisperX word timings')
+    parser.add_argument('json_file', help='WhisperX JSON output, eg. books/bookname/bookname.json')
+    parser.add_argument('output_file', help='Subtitle file to write, eg. books/bookname/bookname_m300.srt')
+    parser.add_argument('--chars', type=int, default=300, help='Maximum characters per subtitle (default 300)')
+    parser.add_argument('--seconds', type=float, default=0, help='Maximum seconds per subtitle (default no limit)')
+    args = parser.parse_args()
+
+    if not run(args.json_file, args.output_file, args.chars, args.seconds):
+        print(f"No words found in {args.json_file}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -115,23 +115,16 @@ def load_and_process_config(SCRIPT_PATH, bookname):
 
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Update workflow configuration.')
-    parser.add_argument('--ckpt_name', type=str, help='Model checkpoint name')
-    parser.add_argument('--cfg', type=float, default=1, help='CFG parameter value')
-    parser.add_argument('--steps', type=int, default=4, help='Steps parameter value')
-    parser.add_argument('--filename_prefix', type=str, help='Filename prefix for saving images')
-    parser.add_argument('--sampler_name', type=str, default='euler', help='Sampler name')
-    parser.add_argument('--count', type=int, help='Number of lines to process from the input file')
-    parser.add_argument('--width', type=int, default=768, help='Width for EmptyLatentImage')
-    parser.add_argument('--height', type=int, default=512, help='Height for EmptyLatentImage')
-    parser.add_argument('prompts_file', type=str, help='File containing text prompts')
-    parser.add_argument('config_file', type=str, help='Workflow configuration JSON file')
-    parser.add_argument('--bookname', type=str, default="", help='BookName (optional)')
-    args = parser.parse_args()
+def run(prompts_file, config_file, config, ckpt_name=None, cfg=1, steps=4, count=None, width=768, height=512,
+        filename_prefix=None, sampler_name='euler', bookname=""):
+    """Queues one ComfyUI prompt per line of prompts_file using the workflow in config_file.
 
-    SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
-    config = load_and_process_config(SCRIPT_PATH, args.bookname)
+    config is the merged AudioBookSlides configuration; its Pos/Neg keys override the workflow defaults.
+    """
+    # update_config() matches workflow input names against these attributes, as it did with the CLI arguments
+    args = argparse.Namespace(ckpt_name=ckpt_name, cfg=cfg, steps=steps, filename_prefix=filename_prefix,
+                              sampler_name=sampler_name, count=count, width=width, height=height,
+                              prompts_file=prompts_file, config_file=config_file, bookname=bookname)
 
     prompt_config = load_json_file(args.config_file)
     pos_style, pos_key = get_style_and_key_from_config(prompt_config, "Pos:")
@@ -173,4 +166,28 @@ if __name__ == "__main__":
                         value["inputs"]["seed"] = random.randint(0, 1000000)
 
                 queue_prompt(prompt_config)
-                line_number += 1
\ No newline at end of file
+                line_number += 1
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Update workflow configuration.')
+    parser.add_argument('--ckpt_name', type=str, help='Model checkpoint name')
+    parser.add_argument('--cfg', type=float, default=1, help='CFG parameter value')
+    parser.add_argument('--steps', type=int, default=4, help='Steps parameter value')
+    parser.add_argument('--filename_prefix', type=str, help='Filename prefix for saving images')
+    parser.add_argument('--sampler_name', type=str, default='euler', help='Sampler name')
+    parser.add_argument('--count', type=int, help='Number of lines to process from the input file')
+    parser.add_argument('--width', type=int, default=768, help='Width for EmptyLatentImage')
+    parser.add_argument('--height', type=int, default=512, help='Height for EmptyLatentImage')
+    parser.add_argument('prompts_file', type=str, help='File containing text prompts')
+    parser.add_argument('config_file', type=str, help='Workflow configuration JSON file')
+    parser.add_argument('--bookname', type=str, default="", help='BookName (optional)')
+    args = parser.parse_args()
+
+    SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
+    config = load_and_process_config(SCRIPT_PATH, args.bookname)
+
+    run(args.prompts_file, args.config_file, config, ckpt_name=args.ckpt_name, cfg=args.cfg, steps=args.steps,
+        count=args.count, width=args.width, height=args.height, filename_prefix=args.filename_prefix,
+        sampler_name=args.sampler_name, bookname=args.bookname)
@@ -0,0 +1,85 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class Task:
+    """
+    A unit of work for the Scheduler.
+
+    deps: names of tasks that must succeed before this one starts.
+    resources: names of limited resources (eg. 'api') the task holds while it runs.
+    group: tasks of a group stop being started once one of them fails (one group per book).
+    """
+
+    def __init__(self, name, func, deps=(), resources=(), group=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.resources = list(resources)
+        self.group = group
+
+class Scheduler:
+    """
+    Runs a dependency graph of tasks on a thread pool. A task starts as soon as its dependencies have
+    succeeded, a worker is free and every resource it needs is below its limit. Ready tasks start in the
+    order they were given, so with one worker the tasks run exactly in list order.
+    """
+
+    def __init__(self, workers=1, limits=None):
+        self.workers = max(1, int(workers))
+        self.limits = dict(limits or {})
+        self.in_use = {name: 0 for name in self.limits}
+
+    def has_capacity(self, task):
+        return all(self.in_use.get(r, 0) < self.limits[r] for r in task.resources if r in self.limits)
+
+    def acquire(self, task):
+        for r in task.resources:
+            if r in self.limits:
+                self.in_use[r] += 1
+
+    def release(self, task):
+        for r in task.resources:
+            if r in self.limits:
+                self.in_use[r] -= 1
+
+    def run(self, tasks):
+        """
+        Runs the tasks and returns {name: True | False | None}: succeeded, failed, or never started because
+        a dependency or an earlier task of the same group failed.
+        """
+        status = {task.name: None for task in tasks}
+        pending = list(tasks)
+        failed_groups = set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                for task in list(pending):
+                    if task.group in failed_groups or any(status.get(dep) is False for dep in task.deps):
+                        pending.remove(task)
+                        continue
+                    if len(running) >= self.workers:
+                        break
+                    if any(status.get(dep) is not True for dep in task.deps) or not self.has_capacity(task):
+                        continue
+                    pending.remove(task)
+                    self.acquire(task)
+                    running[pool.submit(task.func)] = task
+
+                if not running:
+                    # Remaining tasks wait on dependencies that will never run
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    self.release(task)
+                    try:
+                        ok = future.result() is not False
+                    except Exception as e:
+                        logging.error("Task %s failed: %s", task.name, e)
+                        ok = False
+                    status[task.name] = ok
+                    if not ok and task.group is not None:
+                        failed_groups.add(task.group)
+        return status
@@ -10,7 +10,9 @@ setup(
     author='Ken Selvia',
     author_email='gotaudio@gmail.com',
     url='https://github.com/GotAudio/AudioBookSlides/',
-    py_modules=['abs'],
+    py_modules=['abs', 'audio_ingest', 'ffmpeg_runner', 'ledger', 'line_store', 'manifest', 'profiler', 'scheduler', 'timeline', 'transcribe', 'transcript_cache', 'watch_inbox', 'plan_book', 'fix_srt', 'resegment', 'make_prompts', 'combined_dictionary', 'gen_prompts', 'get_characters',
+                'extract_scene', 'replace_actors', 'apply_actors', 'remove_all_other_actors', 'png_text',
+                'rename_png_files_int', 'jobvid', 'chapter_videos', 'run_comfy_wf_api'],
     install_requires=[
         'opencv-python',
         'openai==0.28',
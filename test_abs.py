@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import abs
+import manifest
+
+def make_book(tmp_path, monkeypatch, files, **config):
+    """A book folder under tmp_path/books holding files ({suffix: text}), opened with the default config."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('books', 'old'))
+    for suffix, text in files.items():
+        with open(os.path.join('books', 'old', f"old{suffix}"), 'w', encoding='utf-8') as file:
+            file.write(text)
+    return abs.Book('old', dict(abs.load_default_config(), **config), interactive=False)
+
+def step(name):
+    return next(step for step in abs.PIPELINE if step.name == name)
+
+SRT = "1\n00:00:00,000 --> 00:00:02,000\nHello there.\n\n"
+
+def test_upgrade_adopts_a_transcript_made_before_the_manifest(tmp_path, monkeypatch):
+    book = make_book(tmp_path, monkeypatch, {'.mp3': 'audio', '.srt': SRT})
+    assert abs.step_status(book, step('transcribe'), abs.PIPELINE) == (abs.step_fingerprint(book, step('transcribe')), [])
+    assert 'transcribe' in book.manifest['steps']
+
+def test_upgrade_keeps_a_transcript_recorded_before_the_word_json(tmp_path, monkeypatch):
+    book = make_book(tmp_path, monkeypatch, {'.mp3': 'audio', '.srt': SRT, '_m300.srt': SRT})
+    # Steps 4 and 5 as they were recorded before keep_word_json and the segment settings existed
+    mp3, srt, m300 = book.path('.mp3'), book.path('.srt'), book.path('_m300.srt')
+    manifest.record_step(book.manifest, 'transcribe',
+                         manifest.fingerprint({abs.WHISPERX_KEY: book.config[abs.WHISPERX_KEY]}, 1,
+                                              {mp3: manifest.hash_file(mp3, book.manifest)}),
+                         {srt: manifest.hash_file(srt, book.manifest)})
+    manifest.record_step(book.manifest, 'fix_srt',
+                         manifest.fingerprint({}, manifest.script_version('fix_srt'),
+                                              {srt: manifest.hash_file(srt, book.manifest)}),
+                         {m300: manifest.hash_file(m300, book.manifest)})
+    manifest.save_manifest(book.folder, book.manifest)
+    book = abs.Book('old', book.config, interactive=False)
+
+    assert abs.step_status(book, step('transcribe'), abs.PIPELINE)[1] == []
+    assert abs.step_status(book, step('fix_srt'), abs.PIPELINE)[1] == []
+
+@pytest.mark.parametrize('setting', [{'keep_word_json': 1}, {'transcribe_shards': 2}])
+def test_turning_on_a_transcription_setting_transcribes_again(tmp_path, monkeypatch, setting):
+    book = make_book(tmp_path, monkeypatch, {'.mp3': 'audio', '.srt': SRT})
+    abs.step_status(book, step('transcribe'), abs.PIPELINE)
+    book = abs.Book('old', dict(book.config, **setting), interactive=False)
+    assert any(reason.startswith('config changed') for reason in abs.step_status(book, step('transcribe'), abs.PIPELINE)[1])
+
+def test_outputs_without_a_record_are_rebuilt_once_the_book_has_a_manifest(tmp_path, monkeypatch):
+    book = make_book(tmp_path, monkeypatch, {'.mp3': 'audio'})
+    manifest.save_manifest(book.folder, book.manifest)
+    with open(book.path('.srt'), 'w', encoding='utf-8') as file:
+        file.write(SRT)
+    book = abs.Book('old', book.config, interactive=False)
+    assert not book.adopt_outputs
+    assert abs.step_status(book, step('transcribe'), abs.PIPELINE)[1] == [f"no build record: {book.path('.srt')}"]
+
+    # Unless an earlier step of this run built them
+    book.prebuilt.add(book.path('.srt'))
+    assert abs.step_status(book, step('transcribe'), abs.PIPELINE)[1] == []
+    assert 'transcribe' in book.manifest['steps'] and not book.prebuilt
+
+def test_changing_a_config_key_of_a_step_makes_it_stale(tmp_path, monkeypatch):
+    book = make_book(tmp_path, monkeypatch, {'.mp3': 'audio', '.srt': SRT})
+    abs.step_status(book, step('transcribe'), abs.PIPELINE)
+    book = abs.Book('old', dict(book.config, **{abs.WHISPERX_KEY: 'whisperx other.mp3'}), interactive=False)
+    reasons = abs.step_status(book, step('transcribe'), abs.PIPELINE)[1]
+    assert [reason.split(' (')[0] for reason in reasons] == [f"config changed: {abs.WHISPERX_KEY}"]
+
+def test_pipeline_tasks_hold_the_api_and_comfyui(tmp_path, monkeypatch):
+    book = make_book(tmp_path, monkeypatch, {'.mp3': 'audio'}, image_generator='ComfyUI')
+    book.api_key = 'key'
+    tasks = {task.name: task for task in abs.pipeline_tasks(book)}
+    assert tasks['old:gen_prompts'].resources == ['api']
+    assert tasks['old:generate_images'].resources == ['comfyui']
+    assert tasks['old:transcribe'].resources == []
+    assert 'old:transcribe' in tasks['old:fix_srt'].deps
+    assert abs.resource_limits(dict(book.config, api_concurrency=3)) == {'api': 3, 'comfyui': 1, 'cprofile': 1}
+
+    # Without a key the GPT steps do not run, and nothing waits for the API budget
+    book.api_key = None
+    tasks = abs.pipeline_tasks(book)
+    assert 'old:gen_prompts' not in [task.name for task in tasks]
+    assert all('api' not in task.resources for task in tasks)
@@ -0,0 +1,59 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import api_limit
+import extract_scene
+import gen_prompts
+import timeline
+
+class FakeCompletion:
+    """Stands in for openai.Completion.create, counting the requests in flight."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = 0
+
+    def create(self, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.requests += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        return SimpleNamespace(choices=[SimpleNamespace(text='[Anna], {female}, (30), <coat>, walking.')],
+                               usage=SimpleNamespace(total_tokens=7))
+
+@pytest.fixture
+def completion(monkeypatch):
+    fake = FakeCompletion()
+    monkeypatch.setattr(openai.Completion, 'create', fake.create)
+    api_limit.configure({'api_requests': 3})
+    yield fake
+    api_limit.configure({'api_requests': 10})
+
+@pytest.fixture
+def ts_file(tmp_path):
+    path = tmp_path / 'book_ts.srt'
+    path.write_text(''.join(f"{timeline.ts_tag(n * 1000)}Line {n} of the book.\n" for n in range(40)), encoding='utf-8')
+    return str(path)
+
+def test_requests_of_parallel_steps_share_the_limit(completion, ts_file, tmp_path):
+    steps = [threading.Thread(target=gen_prompts.run, args=(ts_file, str(tmp_path / 'prompts.srt'), 'key', 8)),
+             threading.Thread(target=extract_scene.run, args=(ts_file, str(tmp_path / 'scenes.srt'), 'key'))]
+    for step in steps:
+        step.start()
+    for step in steps:
+        step.join()
+    assert completion.requests == 80
+    assert completion.peak <= 3
+
+def test_steps_report_the_tokens_of_their_requests(completion, ts_file, tmp_path):
+    assert gen_prompts.run(ts_file, str(tmp_path / 'prompts.srt'), 'key') == {'llm_tokens': 280}
+    assert (tmp_path / 'prompts.srt').read_text(encoding='utf-8').count('\n') == 40
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+
+import line_store
+
+class Book:
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, suffix):
+        return os.path.join(self.folder, f"book{suffix}")
+
+def write(book, suffix, lines):
+    with open(book.path(suffix), 'w', encoding='utf-8') as file:
+        file.writelines(f"{line}\n" for line in lines)
+
+def test_lines_with_the_same_timestamp_are_kept_apart(tmp_path):
+    book = Book(str(tmp_path))
+    write(book, '_ts.srt', ['"{ts=000001000}"\t"one"', '"{ts=000002000}"\t"two"', '"{ts=000002000}"\t"three"'])
+    write(book, '_ts_p.srt', ['"{ts=000001000}"\tAnn', '"{ts=000002000}"\tBob', '"{ts=000002000}"\tCy'])
+    write(book, '_ts_p_ns.srt', ['"{ts=000001000}"\thall', '"{ts=000002000}"\tyard', '"{ts=000002000}"\tbarn'])
+
+    connection = line_store.connect(book)
+    try:
+        line_store.sync(book, connection)
+        rows = [tuple(row) for row in line_store.rows(connection, 'character', 'scene')]
+    finally:
+        connection.close()
+    assert rows == [('"{ts=000001000}"', 'Ann', 'hall'), ('"{ts=000002000}"', 'Bob', 'yard'),
+                    ('"{ts=000002000}"', 'Cy', 'barn')]
+
+    exported = line_store.export(book, str(tmp_path / 'export'), ['text'])
+    with open(exported[0], encoding='utf-8') as file, open(book.path('_ts.srt'), encoding='utf-8') as original:
+        assert file.read() == original.read()
+
+def test_store_with_the_old_schema_is_rebuilt(tmp_path):
+    book = Book(str(tmp_path))
+    write(book, '_ts.srt', ['"{ts=000002000}"\t"two"', '"{ts=000002000}"\t"three"'])
+    connection = sqlite3.connect(line_store.store_path(book))
+    connection.executescript("CREATE TABLE lines (ms INTEGER PRIMARY KEY, key TEXT NOT NULL, position INTEGER NOT NULL, "
+                             "text TEXT); CREATE TABLE sources (product TEXT PRIMARY KEY);")
+    connection.close()
+
+    connection = line_store.connect(book)
+    try:
+        line_store.sync(book, connection)
+        assert [row['text'] for row in line_store.rows(connection, 'text')] == ['"two"', '"three"']
+    finally:
+        connection.close()
@@ -0,0 +1,65 @@
+import os
+
+import manifest
+
+def write(path, text, mtime_ns=None):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def test_hash_is_cached_by_size_and_mtime(tmp_path):
+    path = str(tmp_path / 'book.mp3')
+    write(path, 'audio', 1_000_000_000)
+    book_manifest = manifest.load_manifest(str(tmp_path))
+    sha256 = manifest.hash_file(path, book_manifest)
+    assert book_manifest['files'][path] == {'size': 5, 'mtime_ns': 1_000_000_000, 'sha256': sha256}
+
+    # An unchanged file is not read again: the cached hash is returned as it is
+    book_manifest['files'][path]['sha256'] = 'cached'
+    assert manifest.hash_file(path, book_manifest) == 'cached'
+
+    # Same size, new mtime
+    write(path, 'AUDIO', 2_000_000_000)
+    assert manifest.hash_file(path, book_manifest) not in ('cached', sha256)
+
+    # New size, same mtime
+    book_manifest['files'][path]['sha256'] = 'cached'
+    write(path, 'audio!', 2_000_000_000)
+    assert manifest.hash_file(path, book_manifest) != 'cached'
+
+def test_hash_without_reading_differs_from_any_recorded_hash(tmp_path):
+    path = str(tmp_path / 'book.mp3')
+    write(path, 'audio', 1_000_000_000)
+    book_manifest = manifest.load_manifest(str(tmp_path))
+    assert manifest.hash_file(path, book_manifest, read=False) == 'stat:5:1000000000'
+    assert path not in book_manifest['files']
+    sha256 = manifest.hash_file(path, book_manifest)
+    assert manifest.hash_file(path, book_manifest, read=False) == sha256
+
+def test_manifest_survives_saving(tmp_path):
+    path = str(tmp_path / 'book.mp3')
+    write(path, 'audio')
+    book_manifest = manifest.load_manifest(str(tmp_path))
+    current = manifest.fingerprint({'key': 1}, 'v1', {path: manifest.hash_file(path, book_manifest)})
+    manifest.record_step(book_manifest, 'step', current, {})
+    manifest.save_manifest(str(tmp_path), book_manifest)
+    assert manifest.load_manifest(str(tmp_path)) == book_manifest
+
+def test_stale_reasons():
+    record = manifest.fingerprint({'model': 'large', 'chars': 300}, 'v1', {'a.srt': 'aa', 'b.txt': 'bb'})
+    assert manifest.stale_reasons(record, manifest.fingerprint(dict(record['config']), 'v1', dict(record['inputs'])), []) == []
+
+    reasons = manifest.stale_reasons(record, manifest.fingerprint({'model': 'medium', 'chars': 300}, 'v1', record['inputs']), [])
+    assert reasons == ["config changed: model ('large' -> 'medium')"]
+    # A key the record has no value for is a change too
+    reasons = manifest.stale_reasons(record, manifest.fingerprint(dict(record['config'], shards=2), 'v1', record['inputs']), [])
+    assert reasons == ["config changed: shards (None -> 2)"]
+    # A key dropped from the fingerprint is not
+    assert manifest.stale_reasons(record, manifest.fingerprint({'model': 'large'}, 'v1', record['inputs']), []) == []
+
+    reasons = manifest.stale_reasons(record, manifest.fingerprint(record['config'], 'v2', {'a.srt': 'xx', 'c.txt': 'cc'}),
+                                     ['out.srt'])
+    assert reasons == ["output missing: out.srt", "script changed", "input changed: a.srt", "new input: c.txt",
+                       "input removed: b.txt"]
+    assert manifest.stale_reasons(None, record, ['out.srt']) == ["output missing: out.srt"]
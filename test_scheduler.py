@@ -0,0 +1,83 @@
+import time
+import threading
+
+import scheduler
+
+class Recorder:
+    """Task functions that log their start and end and the peak number of tasks holding each resource."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.holding = {}
+        self.peak = {}
+
+    def task(self, name, deps=(), resources=(), group=None, result=True, seconds=0.02):
+        def run():
+            with self.lock:
+                self.events.append(('start', name))
+                for resource in resources:
+                    self.holding[resource] = self.holding.get(resource, 0) + 1
+                    self.peak[resource] = max(self.peak.get(resource, 0), self.holding[resource])
+            time.sleep(seconds)
+            with self.lock:
+                for resource in resources:
+                    self.holding[resource] -= 1
+                self.events.append(('end', name))
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return scheduler.Task(name, run, deps, resources, group)
+
+    def started(self):
+        return [name for event, name in self.events if event == 'start']
+
+    def ended_before_start(self, first, second):
+        return self.events.index(('end', first)) < self.events.index(('start', second))
+
+def test_one_worker_runs_the_tasks_in_list_order():
+    recorder = Recorder()
+    tasks = [recorder.task(name) for name in 'abcd']
+    assert scheduler.Scheduler(1).run(tasks) == dict.fromkeys('abcd', True)
+    assert recorder.started() == list('abcd')
+
+def test_tasks_start_after_their_dependencies():
+    recorder = Recorder()
+    # A diamond listed in reverse: d needs b and c, which both need a
+    tasks = [recorder.task('d', ['b', 'c']), recorder.task('c', ['a']), recorder.task('b', ['a']), recorder.task('a')]
+    assert scheduler.Scheduler(4).run(tasks) == dict.fromkeys('abcd', True)
+    for first, second in [('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd')]:
+        assert recorder.ended_before_start(first, second)
+
+def test_resource_limits_hold_with_free_workers():
+    recorder = Recorder()
+    limits = {'api': 2, 'comfyui': 1}
+    tasks = ([recorder.task(f"api{n}", resources=['api']) for n in range(5)]
+             + [recorder.task(f"comfy{n}", resources=['comfyui']) for n in range(3)]
+             + [recorder.task(f"cpu{n}") for n in range(3)])
+    status = scheduler.Scheduler(8, limits).run(tasks)
+    assert all(status.values())
+    assert recorder.peak == {'api': 2, 'comfyui': 1}
+
+def test_a_busy_resource_does_not_hold_back_later_tasks():
+    recorder = Recorder()
+    tasks = [recorder.task('images1', resources=['comfyui'], seconds=0.1), recorder.task('images2', resources=['comfyui']),
+             recorder.task('text')]
+    scheduler.Scheduler(2, {'comfyui': 1}).run(tasks)
+    assert recorder.started() == ['images1', 'text', 'images2']
+    assert recorder.ended_before_start('images1', 'images2')
+
+def test_failure_stops_dependents_and_the_group():
+    recorder = Recorder()
+    tasks = [recorder.task('book1:a', group='book1', result=False), recorder.task('book1:b', ['book1:a'], group='book1'),
+             recorder.task('book1:c', group='book1'),
+             recorder.task('book2:a', group='book2', result=RuntimeError('boom')), recorder.task('book2:b', group='book2'),
+             recorder.task('book3:a', group='book3'), recorder.task('book3:b', ['book3:a'], group='book3')]
+    status = scheduler.Scheduler(1).run(tasks)
+    assert status == {'book1:a': False, 'book1:b': None, 'book1:c': None, 'book2:a': False, 'book2:b': None,
+                      'book3:a': True, 'book3:b': True}
+
+def test_unknown_dependency_never_starts():
+    recorder = Recorder()
+    assert scheduler.Scheduler(2).run([recorder.task('a', ['missing'])]) == {'a': None}
+    assert recorder.events == []
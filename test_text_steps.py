@@ -0,0 +1,101 @@
+import random
+
+import pytest
+
+import benchmark
+import benchmark_text
+import combined_dictionary
+import fix_srt
+import timeline
+
+# The text steps against the versions they replaced (kept in benchmark_text.py), on generated subtitles.
+# The names include letters whose case rules differ between str.lower, str.isupper and re.IGNORECASE.
+
+NAMES = ['Anna', 'Mary-Jane', 'O_Neil', 'Jo', 'İlker', 'İSTANBUL', 'Işık', 'Straße', 'STRASSE', '\u212aelvin',
+         'Kelvin', 'Ilik', 'Sam', 'Σοφία', 'ΣΟΦΊΑ', 'Ǆemal', 'ǅemal', 'Ünal', 'ÅSA', 'Zoë Smith', 'Dr Who']
+WORDS = ['the', 'a', 'he', 'she', 'him', 'her', 'went', 'home', 'i̇stanbul', 'ılık', 'ſam', 'straße', 'kelvin', 'σοφία',
+         'ǆemal', 'anna', 'jo-jo', 'o_neil', 'it', "don't", 'x2', 'well,', 'yes!', 'why?', '"ok"', 'and']
+
+def write_book_srt(path, seed, cues=80):
+    """An .srt of short cues mixing the names, speech verbs and ordinary words."""
+    rng = random.Random(seed)
+    time_ms = rng.randint(0, 3000)
+    generated = []
+    for _ in range(cues):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(1, 12))]
+        for _ in range(rng.randint(0, 2)):
+            position = rng.randint(0, len(words))
+            words[position:position] = [rng.choice(NAMES), rng.choice(['said', 'asked', 'replied', 'went'])]
+        if rng.random() < 0.4:
+            words.append(rng.choice(NAMES) + rng.choice(['', '.', '!', ',']))
+        end_ms = time_ms + rng.randint(200, 4000)
+        generated.append((time_ms, end_ms, ' '.join(words)))
+        time_ms = end_ms + rng.randint(0, 500)
+    timeline.write_srt(path, generated)
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+@pytest.fixture(params=range(6))
+def srt_file(request, tmp_path):
+    path = str(tmp_path / 'book.srt')
+    if request.param == 0:
+        benchmark.write_srt(path, 0.2)
+    else:
+        write_book_srt(path, request.param)
+    return path
+
+@pytest.fixture
+def ts_file(srt_file, tmp_path):
+    path = str(tmp_path / 'book_ts.srt')
+    fix_srt.run(srt_file, str(tmp_path / 'book_m300.srt'), 300, path)
+    return path
+
+@pytest.mark.parametrize('char_limit', [20, 60, 120, 300])
+def test_single_pass_joiner_writes_what_the_pass_loop_wrote(srt_file, tmp_path, char_limit):
+    fix_srt.join_subtitles(srt_file, str(tmp_path / 'new.srt'), char_limit)
+    benchmark_text.join_subtitles_passes(srt_file, str(tmp_path / 'old.srt'), char_limit)
+    assert read(tmp_path / 'new.srt') == read(tmp_path / 'old.srt')
+
+@pytest.mark.parametrize('char_limit', [60, 300])
+def test_joiner_writes_the_prompt_table_of_make_prompts(srt_file, tmp_path, char_limit):
+    fix_srt.run(srt_file, str(tmp_path / 'new_m300.srt'), char_limit, str(tmp_path / 'new_ts.srt'))
+    benchmark_text.join_subtitles_passes(srt_file, str(tmp_path / 'old_m300.srt'), char_limit)
+    benchmark_text.process_file_paragraphs(str(tmp_path / 'old_m300.srt'), str(tmp_path / 'old_ts.srt'))
+    assert read(tmp_path / 'new_m300.srt') == read(tmp_path / 'old_m300.srt')
+    assert read(tmp_path / 'new_ts.srt') == read(tmp_path / 'old_ts.srt')
+
+def candidates(ts_file):
+    unique_words, _ = combined_dictionary.process_file(ts_file, set(), combined_dictionary.SPEECH_VERBS)
+    # The candidates, and every name and word as a term too, so that each casing rule is exercised
+    return list(unique_words) + [name for name in NAMES + WORDS if name not in unique_words]
+
+@pytest.mark.parametrize('strict', [0, 1])
+def test_term_counter_counts_what_one_regex_per_term_counted(ts_file, strict):
+    unique_words = candidates(ts_file)
+    assert combined_dictionary.preprocess_counts(ts_file, unique_words, strict) == \
+        benchmark_text.preprocess_counts_per_term(ts_file, unique_words, strict)
+
+@pytest.mark.parametrize('strict', [0, 1])
+def test_line_index_finds_the_matches_of_one_regex_per_term(ts_file, strict):
+    unique_words = candidates(ts_file)
+    top_terms = combined_dictionary.preprocess_counts(ts_file, unique_words, strict)
+    expected = benchmark_text.find_matches_per_term(ts_file, unique_words, top_terms)
+    assert combined_dictionary.find_matches(ts_file, unique_words, top_terms) == expected
+    term_lines = {}
+    combined_dictionary.preprocess_counts(ts_file, unique_words, strict, term_lines)
+    assert combined_dictionary.find_matches(ts_file, unique_words, top_terms, term_lines) == expected
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_sharded_detection_finds_what_one_process_finds(ts_file, tmp_path, workers):
+    combined_dictionary.run('tokenizer_vocab_2.txt', None, ts_file, str(tmp_path / 'one.srt'), 1, 1)
+    combined_dictionary.run('tokenizer_vocab_2.txt', None, ts_file, str(tmp_path / 'sharded.srt'), 1, workers)
+    assert read(tmp_path / 'sharded.srt') == read(tmp_path / 'one.srt')
+
+    dictionary = combined_dictionary.load_dictionary('tokenizer_vocab_2.txt')
+    unique_words, flags = combined_dictionary.process_file(ts_file, dictionary, combined_dictionary.SPEECH_VERBS)
+    term_lines = {}
+    top_terms = combined_dictionary.preprocess_counts(ts_file, unique_words, 1, term_lines)
+    sharded = combined_dictionary.detect_sharded(ts_file, dictionary, combined_dictionary.SPEECH_VERBS, 1, workers)
+    assert sharded == (unique_words, flags, top_terms, {term: lines for term, lines in term_lines.items() if lines})
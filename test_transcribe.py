@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+import audio_ingest
+import transcribe
+
+# Stands in for WhisperX with --output_format all: <command> <output dir> <audio file>
+FAKE_WHISPERX = """import os, sys
+base = os.path.join(sys.argv[1], os.path.splitext(os.path.basename(sys.argv[2]))[0])
+for suffix in ['.srt', '.json', '.txt', '.vtt', '.tsv']:
+    with open(base + suffix, 'w', encoding='utf-8') as file:
+        file.write('1\\n00:00:00,000 --> 00:00:01,000\\nHello.\\n\\n' if suffix == '.srt' else '{}')
+"""
+
+@pytest.mark.parametrize('duration', [60, None])
+def test_one_shard_leaves_only_the_srt_and_json(tmp_path, monkeypatch, duration):
+    monkeypatch.setattr(audio_ingest, 'audio_duration', lambda path: duration)
+    script = tmp_path / 'whisperx.py'
+    script.write_text(FAKE_WHISPERX, encoding='utf-8')
+    audio_file = str(tmp_path / 'book.mp3')
+    open(audio_file, 'wb').close()
+
+    command = f"{sys.executable} {script}"
+    assert transcribe.transcribe_sharded(command, audio_file, str(tmp_path / 'book.srt'), 4, str(tmp_path / 'shards'))
+    assert sorted(os.listdir(tmp_path)) == ['book.json', 'book.mp3', 'book.srt', 'whisperx.py']
@@ -0,0 +1,150 @@
+import re
+from array import array
+from bisect import bisect_left
+
+# Times in every step are integer milliseconds. This module reads and writes the three ways the pipeline writes
+# them: .srt cues (HH:MM:SS,mmm --> HH:MM:SS,mmm), the {ts=HHMMSSmmm} tag of every line of bookname_ts.srt and
+# the files made from it, and the HHMMSSmmm names of the renamed images.
+
+SRT_TIME = re.compile(r'(\d+):(\d+):(\d+)[,.](\d+)')
+TS_TAG = re.compile(r'\{ts=(\d+)\}')
+
+def parse_time(text):
+    """Milliseconds of an .srt time, HH:MM:SS,mmm (a . instead of the comma is accepted); None if it is not one."""
+    text = text.strip()
+    if len(text) == 12 and text[2] == text[5] == ':' and text[8] in ',.' and (text[:2] + text[3:5] + text[6:8] + text[9:]).isdigit():
+        # The usual form, without the regex: a book has two of these per cue
+        return int(text[:2]) * 3600000 + int(text[3:5]) * 60000 + int(text[6:8]) * 1000 + int(text[9:])
+    match = SRT_TIME.match(text)
+    if not match:
+        return None
+    hours, minutes, seconds, milliseconds = match.groups()
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(milliseconds.ljust(3, '0')[:3])
+
+def format_time(ms):
+    return "%02d:%02d:%02d,%03d" % (ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
+
+def parse_stamp(stamp):
+    """Milliseconds of a HHMMSSmmm stamp, as in {ts=} tags and image names."""
+    return ((int(stamp[:-7]) * 60 + int(stamp[-7:-5])) * 60 + int(stamp[-5:-3])) * 1000 + int(stamp[-3:])
+
+def format_stamp(ms):
+    return "%02d%02d%02d%03d" % (ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
+
+def ts_tag(ms):
+    return f"{{ts={format_stamp(ms)}}}"
+
+def find_tag(line):
+    """(tag, ms) of the first {ts=HHMMSSmmm} tag in line, or (None, None)."""
+    match = TS_TAG.search(line)
+    if not match:
+        return None, None
+    return match.group(0), parse_stamp(match.group(1).zfill(9))
+
+def parse_cue(lines, parse_times=True):
+    """
+    (start ms, end ms, text) of the stripped lines of one .srt block; None if it has no timestamp line.
+    With parse_times=False the times are kept as they are written (HH:MM:SS,mmm).
+    """
+    if len(lines) > 1 and '-->' in lines[1]:
+        time_index = 1
+    elif '-->' in lines[0]:
+        time_index = 0
+    else:
+        return None
+    start, _, end = lines[time_index].partition('-->')
+    if not parse_times:
+        start, end = start.strip(), end.strip()
+        return (start, end, '\n'.join(lines[time_index + 1:])) if start and end else None
+    start_ms, end_ms = parse_time(start), parse_time(end)
+    if start_ms is None or end_ms is None:
+        return None
+    return start_ms, end_ms, '\n'.join(lines[time_index + 1:])
+
+def read_srt(srt_file, skip_comments=False, parse_times=True):
+    """
+    Streams the cues of an .srt file as (start ms, end ms, text), the text lines stripped and joined by newlines.
+    The index line is optional and blocks without a timestamp line are skipped, so a damaged file still parses.
+    With skip_comments, lines starting with # are left out, as make_prompts.py always did. parse_times=False
+    keeps the times as text, for a step that only copies them (parsing is most of the time of reading a file).
+    """
+    with open(srt_file, 'r', encoding='utf-8-sig') as file:
+        block = []
+        for line in file:
+            line = line.strip()
+            if line:
+                if not (skip_comments and line.startswith('#')):
+                    block.append(line)
+            elif block:
+                cue = parse_cue(block, parse_times)
+                if cue is not None:
+                    yield cue
+                block = []
+        if block:
+            cue = parse_cue(block, parse_times)
+            if cue is not None:
+                yield cue
+
+def write_srt(srt_file, cues):
+    """
+    Writes (start ms, end ms, text) cues, numbered from 1, and returns how many were written. Times that are
+    already text (read_srt with parse_times=False) are written as they are.
+    """
+    count = 0
+    with open(srt_file, 'w', encoding='utf-8') as file:
+        for count, (start, end, text) in enumerate(cues, 1):
+            if not isinstance(start, str):
+                start, end = format_time(start), format_time(end)
+            file.write(f"{count}\n{start} --> {end}\n{text}\n\n")
+    return count
+
+def read_ts(ts_file):
+    """Streams (ms, rest of the line) of every tagged line of bookname_ts.srt or a file made from it."""
+    with open(ts_file, 'r', encoding='utf-8-sig') as file:
+        for line in file:
+            tag, ms = find_tag(line)
+            if tag is not None:
+                yield ms, line.replace(tag, '', 1).strip()
+
+class Timeline:
+    """
+    The cues of an .srt file held compactly: start and end times in two integer arrays and the texts in a list.
+    Indexing and iterating give (start ms, end ms, text) tuples, like read_srt.
+    """
+    __slots__ = ('starts', 'ends', 'texts')
+
+    def __init__(self, cues=()):
+        self.starts = array('q')
+        self.ends = array('q')
+        self.texts = []
+        for start, end, text in cues:
+            self.append(start, end, text)
+
+    @classmethod
+    def load(cls, srt_file):
+        return cls(read_srt(srt_file))
+
+    def save(self, srt_file):
+        return write_srt(srt_file, self)
+
+    def append(self, start, end, text):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.texts.append(text)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        return self.starts[index], self.ends[index], self.texts[index]
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.texts)
+
+    def overlapping(self, start_ms, end_ms):
+        """The cues that overlap start_ms to end_ms, found by bisection; the cues must be in time order."""
+        first = bisect_left(self.starts, start_ms)
+        while first > 0 and self.ends[first - 1] > start_ms:
+            first -= 1
+        last = bisect_left(self.starts, end_ms, first)
+        return [self[index] for index in range(first, last) if self.ends[index] > start_ms]
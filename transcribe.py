@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import logging
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import audio_ingest
+import ffmpeg_runner
+import timeline
+
+# Step 4 on several cores: the book is cut at silences into shards, WhisperX runs on the shards at the
+# same time, and the shard subtitles are joined into one .srt with their times moved back into place.
+
+# Shards shorter than this are not worth a separate WhisperX model load
+MIN_SHARD_SECONDS = 600
+
+def find_silences(audio_file, noise='-35dB', min_seconds=0.5):
+    """(start, end) in seconds of every silence ffmpeg silencedetect finds in the file."""
+    command = ['ffmpeg', '-hide_banner', '-nostats', '-i', audio_file,
+               '-af', f'silencedetect=noise={noise}:d={min_seconds}', '-f', 'null', '-']
+    result = ffmpeg_runner.run(command, description=f"silence detection {os.path.basename(audio_file)}")
+    starts = [float(value) for value in re.findall(r'silence_start: (-?[\d.]+)', result.stderr)]
+    ends = [float(value) for value in re.findall(r'silence_end: ([\d.]+)', result.stderr)]
+    return list(zip(starts, ends))
+
+def cut_points(duration, silences, shards):
+    """
+    Where to cut the book into shards of about equal length: the middle of the silence closest to each
+    ideal cut, or the ideal cut itself when the book has no silence near it.
+    """
+    points = []
+    for number in range(1, shards):
+        target = duration * number / shards
+        middles = [(start + end) / 2 for start, end in silences]
+        near = [middle for middle in middles if abs(middle - target) < duration / shards / 2]
+        point = min(near, key=lambda middle: abs(middle - target)) if near else target
+        if not points or point > points[-1]:
+            points.append(round(point, 3))
+    return points
+
+def split_audio(audio_file, points, shard_dir):
+    """
+    Writes the shards as 16 kHz mono wav (what WhisperX decodes to anyway), cut exactly at the points.
+    -ss goes before -i so ffmpeg seeks to each shard instead of decoding the book from the start every time
+    (input seeking is sample accurate when transcoding); the end is then a duration (-t), not a time.
+    Returns [(shard file, offset)], or None if ffmpeg failed.
+    """
+    bounds = [0.0] + points + [None]
+    shards = []
+    for number in range(len(bounds) - 1):
+        shard_file = os.path.join(shard_dir, f"shard_{number:03d}.wav")
+        command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-ss', str(bounds[number]), '-i', audio_file]
+        if bounds[number + 1] is not None:
+            command += ['-t', str(round(bounds[number + 1] - bounds[number], 3))]
+        command += ['-ac', '1', '-ar', '16000', shard_file]
+        if not ffmpeg_runner.call(command, f"shard {number}"):
+            return None
+        shards.append((shard_file, bounds[number]))
+    return shards
+
+def with_word_json(whisperx_command):
+    """
+    The WhisperX command with --output_format all instead of srt, so it also writes the JSON with the word
+    timings that resegment.py uses. WhisperX takes one output format, so all is the only way to get both.
+    """
+    return re.sub(r'--output_format\s+srt\b', '--output_format all', whisperx_command)
+
+def writes_word_json(whisperx_command):
+    """True if the WhisperX command writes the .json: --output_format all (the WhisperX default) or json."""
+    match = re.search(r'--output_format\s+(\S+)', whisperx_command)
+    return match is None or match.group(1) in ('all', 'json')
+
+def remove_extra_outputs(audio_file):
+    """Removes the .txt, .vtt and .tsv files --output_format all writes besides the .srt and .json."""
+    base = os.path.splitext(audio_file)[0]
+    for suffix in ['.txt', '.vtt', '.tsv']:
+        if os.path.exists(base + suffix):
+            os.remove(base + suffix)
+
+def run_whisperx(whisperx_command, shard_file):
+    q = '"' if platform.system() == 'Windows' else "'"
+    command = f'{whisperx_command} {q}{os.path.dirname(shard_file)}{q} {q}{shard_file}{q}'
+    logging.info("Executing command: %s", command)
+    try:
+        subprocess.run(command, shell=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logging.error("Command failed: %s", e)
+        return False
+    return os.path.exists(os.path.splitext(shard_file)[0] + '.srt')
+
+def stitch_srt(shard_srts, output_file):
+    """Joins shard subtitles in order, shifting each shard's times by its offset and numbering them again."""
+    def shifted():
+        for srt_file, offset in shard_srts:
+            offset_ms = int(round(offset * 1000))
+            for start, end, text in timeline.read_srt(srt_file):
+                yield start + offset_ms, end + offset_ms, text
+    return timeline.write_srt(output_file, shifted())
+
+def stitch_json(shard_jsons, output_file):
+    """Joins shard WhisperX JSON files like stitch_srt, shifting the segment and word times by the shard offsets."""
+    def shift(item, offset):
+        for key in ['start', 'end']:
+            if item.get(key) is not None:
+                item[key] = round(item[key] + offset, 3)
+
+    segments, word_segments = [], []
+    for json_file, offset in shard_jsons:
+        with open(json_file, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        for segment in data.get('segments', []):
+            shift(segment, offset)
+            for word in segment.get('words', []):
+                shift(word, offset)
+            segments.append(segment)
+        for word in data.get('word_segments', []):
+            shift(word, offset)
+            word_segments.append(word)
+    with open(output_file, 'w', encoding='utf-8') as file:
+        json.dump({'segments': segments, 'word_segments': word_segments}, file, ensure_ascii=False)
+
+def transcribe_sharded(whisperx_command, audio_file, srt_file, shards, shard_dir, noise='-35dB', min_silence=0.5):
+    """
+    Transcribes audio_file into srt_file (and the .json beside it, when WhisperX writes JSON) with up to
+    shards WhisperX processes at once. Returns False if a shard could not be transcribed.
+    """
+    duration = audio_ingest.audio_duration(audio_file)
+    if duration is not None:
+        shards = max(1, min(shards, int(duration // MIN_SHARD_SECONDS)))
+    if duration is None or shards == 1:
+        shard_files = [(audio_file, 0.0)]
+        shard_dir = os.path.dirname(audio_file)
+    else:
+        points = cut_points(duration, find_silences(audio_file, noise, min_silence), shards)
+        logging.info("Transcribing %s in %d shards cut at %s seconds", audio_file, len(points) + 1, points)
+        shard_files = split_audio(audio_file, points, shard_dir)
+        if shard_files is None:
+            return False
+
+    with ThreadPoolExecutor(max_workers=len(shard_files)) as pool:
+        results = list(pool.map(lambda shard: run_whisperx(whisperx_command, shard[0]), shard_files))
+    for shard_file, _ in shard_files:
+        remove_extra_outputs(shard_file)
+    if not all(results):
+        return False
+
+    shard_srts = [(os.path.splitext(shard_file)[0] + '.srt', offset) for shard_file, offset in shard_files]
+    if len(shard_srts) == 1:
+        return os.path.exists(srt_file)
+    subtitles = stitch_srt(shard_srts, srt_file)
+    shard_jsons = [(os.path.splitext(shard_file)[0] + '.json', offset) for shard_file, offset in shard_files]
+    if all(os.path.exists(json_file) for json_file, _ in shard_jsons):
+        stitch_json(shard_jsons, os.path.splitext(srt_file)[0] + '.json')
+    logging.info("Joined %d subtitles from %d shards into %s", subtitles, len(shard_srts), srt_file)
+    return True
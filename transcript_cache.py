@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: the index lock holds within one abs process only
+    fcntl = None
+
+# Step 4 transcripts by content, shared by all books: books/.abs_transcripts/<key>/
+# The key is the sha256 of the book mp3 and the WhisperX command line, so a book run again under another
+# name (other actors, a test cut of the images) gets its subtitles without transcribing the same audio again.
+CACHE_FOLDER = os.path.join('books', '.abs_transcripts')
+INDEX_NAME = 'index.json'
+LOCK_NAME = 'index.lock'
+cache_lock = threading.Lock()
+
+@contextlib.contextmanager
+def index_lock(root=CACHE_FOLDER):
+    """
+    Holds the cache for one lookup or store: a lock file in the cache folder, like ffmpeg_runner's slots, so
+    abs watch, a batch and a manual abs run never lose each other's index entries or evict a folder that is
+    being copied from. Threads of one process also take cache_lock.
+    """
+    with cache_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, LOCK_NAME), 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+def cache_key(audio_sha256, command):
+    return hashlib.sha256(f"{audio_sha256}\0{command}".encode('utf-8')).hexdigest()
+
+def load_index(root=CACHE_FOLDER):
+    path = os.path.join(root, INDEX_NAME)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error("Error reading transcript cache index %s: %s", path, e)
+    return {'entries': {}}
+
+def save_index(index, root=CACHE_FOLDER):
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, INDEX_NAME)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(index, file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def copy_atomic(source, target):
+    """Copies through a temporary name so a reader never sees half a file."""
+    temp_path = target + '.tmp'
+    shutil.copyfile(source, temp_path)
+    os.replace(temp_path, target)
+
+def lookup(key, targets, root=CACHE_FOLDER):
+    """
+    Writes the cached transcript files to targets ({suffix: path}, eg. {'.srt': 'books/x/x.srt'}).
+    Returns the suffixes written, or None if the cache has no complete entry for the key.
+    """
+    with index_lock(root):
+        index = load_index(root)
+        entry = index['entries'].get(key)
+        folder = os.path.join(root, key)
+        if entry is None or not all(os.path.exists(os.path.join(folder, 'transcript' + suffix)) for suffix in entry['files']):
+            return None
+        written = []
+        for suffix in entry['files']:
+            if suffix in targets:
+                copy_atomic(os.path.join(folder, 'transcript' + suffix), targets[suffix])
+                written.append(suffix)
+        entry['last_used'] = time.time()
+        entry['hits'] = entry.get('hits', 0) + 1
+        save_index(index, root)
+    return written
+
+def evict(index, limit_bytes, keep, root=CACHE_FOLDER):
+    """Removes the least recently used entries, except keep, until the cache fits in limit_bytes."""
+    total = sum(entry['bytes'] for entry in index['entries'].values())
+    for key, entry in sorted(index['entries'].items(), key=lambda item: item[1]['last_used']):
+        if total <= limit_bytes:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(os.path.join(root, key), ignore_errors=True)
+        del index['entries'][key]
+        total -= entry['bytes']
+        logging.info("Evicted transcript %s (%s) from the cache", key[:12], entry.get('book'))
+
+def store(key, sources, limit_bytes, book=None, root=CACHE_FOLDER):
+    """Adds the transcript files (sources, {suffix: path}) that exist under key, then evicts down to limit_bytes."""
+    sources = {suffix: path for suffix, path in sources.items() if os.path.exists(path)}
+    if not sources:
+        return False
+    with index_lock(root):
+        folder = os.path.join(root, key)
+        os.makedirs(folder, exist_ok=True)
+        for suffix, path in sources.items():
+            copy_atomic(path, os.path.join(folder, 'transcript' + suffix))
+        index = load_index(root)
+        index['entries'][key] = {'files': sorted(sources), 'bytes': sum(os.path.getsize(path) for path in sources.values()),
+                                 'book': book, 'created': time.time(), 'last_used': time.time(), 'hits': 0}
+        evict(index, limit_bytes, key, root)
+        save_index(index, root)
+    return True
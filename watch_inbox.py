@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import abs
+
+# Progress of every audio folder the watcher has seen, so a restart resumes instead of starting over
+STATE_FILE = os.path.join('books', '.abs_watch.json')
+
+def book_name(folder):
+    """The book name for an inbox folder: the folder name with characters that upset paths and ffmpeg replaced."""
+    return re.sub(r'[^\w.-]+', '_', os.path.basename(os.path.normpath(folder))).strip('._') or 'book'
+
+def audio_fingerprint(folder):
+    """[name, size, mtime] of the audio files of a folder, found the same way as Step 3. Empty if there are none."""
+    dir_path, files = abs.find_audio_files(folder)
+    fingerprint = []
+    for name in sorted(files):
+        try:
+            stat = os.stat(os.path.join(dir_path, name))
+        except OSError:
+            # Still being moved into place
+            return []
+        fingerprint.append([name, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+def load_state(path=STATE_FILE):
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error("Error reading watch state %s: %s", path, e)
+    return {'books': {}}
+
+def save_state(state, path=STATE_FILE):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def run_book(bookname, source, api_key, process_pool, workers):
+    """Runs one book unattended. Returns (status, message) with status 'done', 'blocked' or 'failed'."""
+    book = abs.open_book(bookname, source, api_key=api_key, process_pool=process_pool, interactive=False)
+    if book is None:
+        return 'failed', "could not open the book"
+    if abs.run_pipeline(book, workers=workers):
+        return 'done', None
+    if book.blocked:
+        return 'blocked', book.blocked
+    return 'failed', "a step failed, see the log"
+
+class Watcher:
+    """
+    Watches an inbox folder. Every subfolder with audio files is an audio book; once its files have not
+    changed for watch_settle_seconds it runs through the pipeline, at most watch_max_books at a time.
+    Books blocked on the user (eg. images not generated yet) are tried again after watch_retry_minutes,
+    and a book whose audio files change is run again.
+    """
+
+    def __init__(self, inbox, config, state_file=STATE_FILE):
+        self.inbox = inbox
+        self.state_file = state_file
+        self.state = load_state(state_file)
+        self.poll_seconds = float(config.get('watch_poll_seconds', 30))
+        self.settle_seconds = float(config.get('watch_settle_seconds', 60))
+        self.retry_seconds = float(config.get('watch_retry_minutes', 30)) * 60
+        self.max_books = max(1, int(config.get('watch_max_books', 1)))
+        self.workers = config.get('workers', 1)
+        self.cpu_workers = config.get('cpu_workers') or None
+        # source folder -> (fingerprint, time it was first seen with that fingerprint)
+        self.seen = {}
+        self.running = {}
+
+    def update(self, source, **fields):
+        record = self.state['books'].setdefault(source, {})
+        record.update(fields, updated=datetime.now().isoformat(timespec='seconds'))
+        save_state(self.state, self.state_file)
+
+    def unique_name(self, source):
+        name = book_name(source)
+        taken = {record.get('book') for path, record in self.state['books'].items() if path != source}
+        candidate, number = name, 2
+        while candidate in taken:
+            candidate = f"{name}_{number}"
+            number += 1
+        return candidate
+
+    def wants_run(self, source, fingerprint, now):
+        record = self.state['books'].get(source)
+        if record is None or record.get('fingerprint') != fingerprint:
+            # New or changed audio: wait until the copy has finished
+            first_seen = self.seen.get(source)
+            if first_seen is None or first_seen[0] != fingerprint:
+                self.seen[source] = (fingerprint, now)
+                return False
+            return now - first_seen[1] >= self.settle_seconds
+        status = record.get('status')
+        if status in ('queued', 'running'):
+            # Interrupted by a restart
+            return True
+        if status == 'blocked':
+            updated = datetime.fromisoformat(record['updated']).timestamp()
+            return time.time() - updated >= self.retry_seconds
+        return False
+
+    def scan(self):
+        """Returns the source folders that are ready to run, in name order."""
+        if not os.path.isdir(self.inbox):
+            logging.error("Inbox folder does not exist: %s", self.inbox)
+            return []
+        ready = []
+        now = time.monotonic()
+        for entry in sorted(os.scandir(self.inbox), key=lambda e: e.name):
+            source = os.path.abspath(entry.path)
+            if not entry.is_dir() or source in self.running:
+                continue
+            fingerprint = audio_fingerprint(source)
+            if fingerprint and self.wants_run(source, fingerprint, now):
+                record = self.state['books'].get(source, {})
+                if record.get('fingerprint') != fingerprint:
+                    self.update(source, book=record.get('book') or self.unique_name(source), fingerprint=fingerprint,
+                                status='queued', message=None)
+                ready.append(source)
+        return ready
+
+    def collect(self):
+        for source, future in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[source]
+            try:
+                status, message = future.result()
+            except Exception as e:
+                status, message = 'failed', str(e)
+            self.update(source, status=status, message=message)
+            logging.info("Watch: %s %s%s", self.state['books'][source]['book'], status, f": {message}" if message else "")
+
+    def run(self):
+        logging.info("Watching %s for audio book folders (Ctrl+C to stop)", self.inbox)
+        api_key = abs.read_api_key()
+        with ProcessPoolExecutor(max_workers=self.cpu_workers) as process_pool, \
+                ThreadPoolExecutor(max_workers=self.max_books) as book_pool:
+            try:
+                while True:
+                    self.collect()
+                    for source in self.scan():
+                        if len(self.running) >= self.max_books:
+                            break
+                        bookname = self.state['books'][source]['book']
+                        self.update(source, status='running')
+                        logging.info("Watch: starting %s from %s", bookname, source)
+                        self.running[source] = book_pool.submit(run_book, bookname, source, api_key, process_pool, self.workers)
+                    time.sleep(self.poll_seconds)
+            except KeyboardInterrupt:
+                logging.info("Stopping the watcher after the running books finish (%d)", len(self.running))
+                book_pool.shutdown(wait=True)
+                self.collect()
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='abs watch', description='Run every audio book dropped into an inbox folder')
+    parser.add_argument('inbox', help='Folder with one subfolder of audio files per book')
+    parser.add_argument('--max-books', type=int, default=None, help='Books processed at once (overrides the watch_max_books config key)')
+    args = parser.parse_args(argv)
+
+    config = abs.load_default_config()
+    if config is None:
+        return False
+    if args.max_books:
+        config['watch_max_books'] = args.max_books
+    abs.create_directory('books')
+    Watcher(args.inbox, config).run()
+    return True